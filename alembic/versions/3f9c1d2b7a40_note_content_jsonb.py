@@ -0,0 +1,69 @@
+"""Store file and note content as JSONB
+
+Revision ID: 3f9c1d2b7a40
+Revises: a65eb2401ee9
+Create Date: 2026-10-19 09:12:41.118204
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "3f9c1d2b7a40"
+down_revision: Union[str, None] = "a65eb2401ee9"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing rows hold json.dumps() output, so a plain cast parses them
+    op.alter_column(
+        "files",
+        "content",
+        existing_type=sa.Text(),
+        type_=postgresql.JSONB(),
+        postgresql_using="content::jsonb",
+        existing_nullable=True,
+    )
+    op.alter_column(
+        "notes",
+        "content",
+        existing_type=sa.Text(),
+        type_=postgresql.JSONB(),
+        postgresql_using="content::jsonb",
+        existing_nullable=False,
+    )
+
+    # Backfill: unwrap deltas that were stored double-encoded as a JSON string
+    op.execute(
+        "UPDATE files SET content = (content #>> '{}')::jsonb "
+        "WHERE jsonb_typeof(content) = 'string'"
+    )
+    op.execute(
+        "UPDATE notes SET content = (content #>> '{}')::jsonb "
+        "WHERE jsonb_typeof(content) = 'string'"
+    )
+
+
+def downgrade() -> None:
+    op.alter_column(
+        "notes",
+        "content",
+        existing_type=postgresql.JSONB(),
+        type_=sa.Text(),
+        postgresql_using="content::text",
+        existing_nullable=False,
+    )
+    op.alter_column(
+        "files",
+        "content",
+        existing_type=postgresql.JSONB(),
+        type_=sa.Text(),
+        postgresql_using="content::text",
+        existing_nullable=True,
+    )
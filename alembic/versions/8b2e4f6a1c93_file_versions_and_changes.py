@@ -0,0 +1,45 @@
+"""Add file version and file_changes log for delta patches
+
+Revision ID: 8b2e4f6a1c93
+Revises: 3f9c1d2b7a40
+Create Date: 2026-10-19 11:40:07.552310
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "8b2e4f6a1c93"
+down_revision: Union[str, None] = "3f9c1d2b7a40"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "files", sa.Column("version", sa.Integer(), server_default="0", nullable=False)
+    )
+    op.create_table(
+        "file_changes",
+        sa.Column("file_id", sa.UUID(), nullable=False),
+        sa.Column("version", sa.Integer(), nullable=False),
+        sa.Column("delta", postgresql.JSONB(), nullable=False),
+        sa.Column(
+            "created_at",
+            sa.DateTime(),
+            server_default=sa.text("CURRENT_TIMESTAMP"),
+            nullable=False,
+        ),
+        sa.ForeignKeyConstraint(["file_id"], ["files.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("file_id", "version"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("file_changes")
+    op.drop_column("files", "version")
@@ -0,0 +1,30 @@
+"""Add users.tree_version for the folder tree cache
+
+Revision ID: a7d4c2e8b316
+Revises: f3b8d2a6c915
+Create Date: 2026-10-19 18:12:44.905137
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a7d4c2e8b316"
+down_revision: Union[str, None] = "f3b8d2a6c915"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "users",
+        sa.Column("tree_version", sa.Integer(), server_default="0", nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_column("users", "tree_version")
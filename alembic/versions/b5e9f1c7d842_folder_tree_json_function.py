@@ -0,0 +1,83 @@
+"""Build the folder tree JSON in Postgres
+
+Revision ID: b5e9f1c7d842
+Revises: a7d4c2e8b316
+Create Date: 2026-10-19 19:03:27.561930
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b5e9f1c7d842"
+down_revision: Union[str, None] = "a7d4c2e8b316"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION folder_tree_json(p_user_id varchar) RETURNS json
+        LANGUAGE plpgsql STABLE AS $$
+        DECLARE
+            -- Folder ids of the user level by level, level k is ids[bounds[k] + 1 : bounds[k + 1]]
+            ids uuid[] := '{}';
+            bounds int[] := '{0}';
+            level_ids uuid[];
+            -- Finished subfolder lists of the level below and the folder they belong to
+            parent_ids uuid[];
+            subfolder_lists json[];
+            roots json;
+        BEGIN
+            SELECT array_agg(id) INTO level_ids
+            FROM folders WHERE user_id = p_user_id AND parent_id IS NULL;
+            WHILE level_ids IS NOT NULL LOOP
+                ids := ids || level_ids;
+                bounds := bounds || cardinality(ids);
+                SELECT array_agg(id) INTO level_ids
+                FROM folders WHERE parent_id = ANY(level_ids) AND user_id = p_user_id;
+            END LOOP;
+
+            FOR level IN REVERSE cardinality(bounds) - 1 .. 1 LOOP
+                SELECT array_agg(parent_id), array_agg(subfolders)
+                INTO parent_ids, subfolder_lists
+                FROM (
+                    SELECT f.parent_id, json_agg(json_build_object(
+                               'id', f.id,
+                               'name', f.name,
+                               'parent_id', f.parent_id,
+                               'subfolders', coalesce(children.subfolders, '[]'),
+                               'files', coalesce(folder_files.files, '[]')
+                           ) ORDER BY f.name, f.id) AS subfolders
+                    FROM folders f
+                    LEFT JOIN unnest(parent_ids, subfolder_lists) AS children (id, subfolders)
+                        ON children.id = f.id
+                    LEFT JOIN (
+                        SELECT folder_id, json_agg(json_build_object(
+                                   'id', id, 'name', name, 'video_id', video_id, 'folder_id', folder_id
+                               ) ORDER BY name, id) AS files
+                        FROM files
+                        WHERE folder_id = ANY(ids[bounds[level] + 1 : bounds[level + 1]])
+                        GROUP BY folder_id
+                    ) folder_files ON folder_files.folder_id = f.id
+                    WHERE f.id = ANY(ids[bounds[level] + 1 : bounds[level + 1]])
+                    GROUP BY f.parent_id
+                ) grouped;
+            END LOOP;
+
+            -- Roots are the only group of the last level
+            SELECT subfolders INTO roots
+            FROM unnest(parent_ids, subfolder_lists) AS children (id, subfolders);
+            RETURN json_build_object('folders', coalesce(roots, '[]'));
+        END
+        $$;
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP FUNCTION IF EXISTS folder_tree_json(varchar)")
@@ -0,0 +1,61 @@
+"""Keyset pagination indexes for the lazy folder tree API
+
+Revision ID: c2f6a8d4e913
+Revises: b5e9f1c7d842
+Create Date: 2026-10-19 20:14:51.073218
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c2f6a8d4e913"
+down_revision: Union[str, None] = "b5e9f1c7d842"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ("ix_folders_parent_name_id", "folders", ["parent_id", "name", "id"]),
+    ("ix_files_folder_name_id", "files", ["folder_id", "name", "id"]),
+    (
+        "ix_folder_closure_ancestor_depth",
+        "folder_closure",
+        ["ancestor_id", "depth", "descendant_id"],
+    ),
+]
+# Foreign key indexes now covered by the leading column of the new ones
+REPLACED_INDEXES = [
+    ("ix_folders_parent", "folders", ["parent_id"]),
+    ("ix_files_folder", "files", ["folder_id"]),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            # A failed concurrent build leaves an invalid index behind, drop it first
+            op.drop_index(
+                name, table_name=table, postgresql_concurrently=True, if_exists=True
+            )
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+        for name, table, _ in REPLACED_INDEXES:
+            op.drop_index(
+                name, table_name=table, postgresql_concurrently=True, if_exists=True
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns in REPLACED_INDEXES:
+            op.drop_index(
+                name, table_name=table, postgresql_concurrently=True, if_exists=True
+            )
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(
+                name, table_name=table, postgresql_concurrently=True, if_exists=True
+            )
@@ -0,0 +1,68 @@
+"""Add indexes for hot lookups
+
+Revision ID: c47d0e5f9b12
+Revises: 8b2e4f6a1c93
+Create Date: 2026-10-19 14:03:55.904117
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "c47d0e5f9b12"
+down_revision: Union[str, None] = "8b2e4f6a1c93"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = [
+    ("ix_files_user_folder_name", "files", ["user_id", "folder_id", "name"], False),
+    ("ix_files_user_video", "files", ["user_id", "video_id"], False),
+    ("ix_folders_user_parent_name", "folders", ["user_id", "parent_id", "name"], False),
+    ("uq_notes_video_id", "notes", ["video_id"], True),
+    (
+        "ix_subscriptions_user_status_period_end",
+        "subscriptions",
+        ["user_id", "status", "current_period_end"],
+        False,
+    ),
+]
+
+
+def upgrade() -> None:
+    # Keep only the oldest note per video so the unique index can be built
+    op.execute(
+        """
+        DELETE FROM notes WHERE id IN (
+            SELECT id FROM (
+                SELECT id, row_number() OVER (
+                    PARTITION BY video_id ORDER BY created_at NULLS LAST, id
+                ) AS rn
+                FROM notes
+            ) ranked
+            WHERE rn > 1
+        )
+        """
+    )
+
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in INDEXES:
+            # A failed concurrent build leaves an invalid index behind, drop it first
+            op.drop_index(
+                name, table_name=table, postgresql_concurrently=True, if_exists=True
+            )
+            op.create_index(
+                name, table, columns, unique=unique, postgresql_concurrently=True
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(
+                name, table_name=table, postgresql_concurrently=True, if_exists=True
+            )
@@ -0,0 +1,74 @@
+"""Full-text search over the plain text of notes and files
+
+Revision ID: d8a3f5b1e627
+Revises: c2f6a8d4e913
+Create Date: 2026-10-19 21:02:17.518304
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d8a3f5b1e627"
+down_revision: Union[str, None] = "c2f6a8d4e913"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Same projection as app.utils.delta.plain_text: text inserts in order, no embeds
+PLAIN_TEXT = """
+    (SELECT coalesce(string_agg(op->>'insert', '' ORDER BY position), '')
+     FROM jsonb_array_elements(content->'ops') WITH ORDINALITY AS ops(op, position)
+     WHERE jsonb_typeof(op->'insert') = 'string')
+"""
+# Markup characters are blanked out: the parser skips <script>...</script> as HTML
+SEARCH_TEXT = "translate(coalesce(content_text, ''), '<>&', '   ')"
+SEARCH_VECTORS = {
+    "files": "setweight(to_tsvector('english', name), 'A') || "
+    f"setweight(to_tsvector('english', {SEARCH_TEXT}), 'B')",
+    "notes": f"setweight(to_tsvector('english', {SEARCH_TEXT}), 'B')",
+}
+
+
+def upgrade() -> None:
+    for table, vector in SEARCH_VECTORS.items():
+        op.add_column(table, sa.Column("content_text", sa.Text(), nullable=True))
+        op.execute(
+            f"UPDATE {table} SET content_text = {PLAIN_TEXT} WHERE content IS NOT NULL"
+        )
+        # Filled by Postgres for existing rows while the table is rewritten
+        op.add_column(
+            table,
+            sa.Column(
+                "search_vector",
+                postgresql.TSVECTOR(),
+                sa.Computed(vector, persisted=True),
+                nullable=True,
+            ),
+        )
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        for table in SEARCH_VECTORS:
+            name = f"ix_{table}_search_vector"
+            # A failed concurrent build leaves an invalid index behind, drop it first
+            op.drop_index(
+                name, table_name=table, postgresql_concurrently=True, if_exists=True
+            )
+            op.create_index(
+                name,
+                table,
+                ["search_vector"],
+                postgresql_using="gin",
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    for table in SEARCH_VECTORS:
+        op.drop_index(f"ix_{table}_search_vector", table_name=table, if_exists=True)
+        op.drop_column(table, "search_vector")
+        op.drop_column(table, "content_text")
@@ -0,0 +1,57 @@
+"""Share note content with files until their first edit
+
+Revision ID: e1a6b9c3d204
+Revises: c47d0e5f9b12
+Create Date: 2026-10-19 16:21:30.447862
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e1a6b9c3d204"
+down_revision: Union[str, None] = "c47d0e5f9b12"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.alter_column(
+        "files",
+        "content",
+        existing_type=postgresql.JSONB(astext_type=sa.Text()),
+        nullable=True,
+    )
+    # Files never edited hold an identical copy of the video's note: drop the copy.
+    # Run VACUUM (or pg_repack) on files afterwards to give the space back.
+    op.execute(
+        """
+        UPDATE files SET content = NULL
+        FROM notes
+        WHERE notes.video_id = files.video_id
+          AND files.content IS NOT NULL
+          AND files.content = notes.content
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        UPDATE files SET content = notes.content
+        FROM notes
+        WHERE notes.video_id = files.video_id
+          AND files.content IS NULL
+        """
+    )
+    op.alter_column(
+        "files",
+        "content",
+        existing_type=postgresql.JSONB(astext_type=sa.Text()),
+        nullable=False,
+    )
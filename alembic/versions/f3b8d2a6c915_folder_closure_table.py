@@ -0,0 +1,71 @@
+"""Folder hierarchy closure table
+
+Revision ID: f3b8d2a6c915
+Revises: e1a6b9c3d204
+Create Date: 2026-10-19 17:05:12.318604
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f3b8d2a6c915"
+down_revision: Union[str, None] = "e1a6b9c3d204"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Foreign keys followed by the cascading subtree delete
+FOREIGN_KEY_INDEXES = [
+    ("ix_folders_parent", "folders", ["parent_id"]),
+    ("ix_files_folder", "files", ["folder_id"]),
+]
+
+
+def upgrade() -> None:
+    op.create_table(
+        "folder_closure",
+        sa.Column("ancestor_id", sa.UUID(), nullable=False),
+        sa.Column("descendant_id", sa.UUID(), nullable=False),
+        sa.Column("depth", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["ancestor_id"], ["folders.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["descendant_id"], ["folders.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("ancestor_id", "descendant_id"),
+    )
+    # Backfill every (ancestor, descendant) pair from folders.parent_id
+    op.execute(
+        """
+        INSERT INTO folder_closure (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE paths AS (
+            SELECT id AS ancestor_id, id AS descendant_id, 0 AS depth FROM folders
+            UNION ALL
+            SELECT paths.ancestor_id, folders.id, paths.depth + 1
+            FROM paths JOIN folders ON folders.parent_id = paths.descendant_id
+        )
+        SELECT ancestor_id, descendant_id, depth FROM paths
+        """
+    )
+    op.create_index(
+        "ix_folder_closure_descendant", "folder_closure", ["descendant_id", "depth"]
+    )
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in FOREIGN_KEY_INDEXES:
+            # A failed concurrent build leaves an invalid index behind, drop it first
+            op.drop_index(
+                name, table_name=table, postgresql_concurrently=True, if_exists=True
+            )
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(FOREIGN_KEY_INDEXES):
+            op.drop_index(
+                name, table_name=table, postgresql_concurrently=True, if_exists=True
+            )
+    op.drop_index("ix_folder_closure_descendant", table_name="folder_closure")
+    op.drop_table("folder_closure")
@@ -0,0 +1,62 @@
+"""Denormalise the subscription entitlement on users, index lapsed subscriptions
+
+Revision ID: f6d2b8e4a137
+Revises: e4c7a9b2d518
+Create Date: 2026-10-19 23:16:52.640519
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f6d2b8e4a137"
+down_revision: Union[str, None] = "e4c7a9b2d518"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Same as app.utils.entitlements.refresh_entitlements, for every user
+LATEST_ACTIVE_SUBSCRIPTION = """
+    (SELECT {column} FROM subscriptions s
+     WHERE s.user_id = users.id AND s.status = 'active'
+     ORDER BY s.current_period_end DESC NULLS LAST LIMIT 1)
+"""
+
+
+def upgrade() -> None:
+    op.add_column("users", sa.Column("entitled_until", sa.DateTime(), nullable=True))
+    op.add_column(
+        "users", sa.Column("entitled_plan_id", sa.String(length=255), nullable=True)
+    )
+    op.execute(
+        "UPDATE users SET "
+        f"entitled_until = {LATEST_ACTIVE_SUBSCRIPTION.format(column='current_period_end')}, "
+        f"entitled_plan_id = {LATEST_ACTIVE_SUBSCRIPTION.format(column='plan_id')}"
+    )
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        # A failed concurrent build leaves an invalid index behind, drop it first
+        op.drop_index(
+            "ix_subscriptions_active_period_end",
+            table_name="subscriptions",
+            postgresql_concurrently=True,
+            if_exists=True,
+        )
+        op.create_index(
+            "ix_subscriptions_active_period_end",
+            "subscriptions",
+            ["current_period_end"],
+            postgresql_where=sa.text("status = 'active'"),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    op.drop_index(
+        "ix_subscriptions_active_period_end", table_name="subscriptions", if_exists=True
+    )
+    op.drop_column("users", "entitled_plan_id")
+    op.drop_column("users", "entitled_until")
@@ -0,0 +1,60 @@
+#  Admin tools: the on-demand sampling profiler (app.core.profiler)
+#  POST /admin/profile arms it for the next requests of a route in this worker,
+#  GET /admin/profile returns the profile so far (?format=folded for flamegraph.pl,
+#  inferno or speedscope), DELETE /admin/profile stops and discards it.
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import PlainTextResponse
+
+from app.core.profiler import ProfilerUnavailable, sampling_profiler
+from app.core.security import get_admin_user
+from app.models.models import User
+from app.schemas.schemas import ProfileRequest
+
+admin_router = APIRouter(prefix="/admin")
+
+
+@admin_router.post("/profile", status_code=status.HTTP_201_CREATED)
+async def start_profile(
+    profile_request: ProfileRequest,
+    request: Request,
+    user: User = Depends(get_admin_user),
+):
+    routes = {
+        (method, route.path)
+        for route in request.app.routes
+        for method in getattr(route, "methods", None) or ()
+    }
+    if (profile_request.method, profile_request.route) not in routes:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No route {profile_request.method} {profile_request.route}",
+        )
+    try:
+        profile = sampling_profiler.start(
+            profile_request.method,
+            profile_request.route,
+            profile_request.requests,
+            profile_request.interval_ms / 1000,
+        )
+    except ProfilerUnavailable as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return profile.to_dict()
+
+
+@admin_router.get("/profile")
+async def get_profile(
+    format: str = Query("json", pattern="^(json|folded)$"),
+    user: User = Depends(get_admin_user),
+):
+    profile = sampling_profiler.profile
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No profile")
+    if format == "folded":
+        return PlainTextResponse(profile.folded())
+    return profile.to_dict()
+
+
+@admin_router.delete("/profile")
+async def delete_profile(user: User = Depends(get_admin_user)):
+    sampling_profiler.clear()
+    return {"message": "Profile discarded"}
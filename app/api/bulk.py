@@ -0,0 +1,378 @@
+#  Bulk move / rename / delete of files and folders in one request and one transaction
+#  Ownership, destinations, name conflicts and cycles are validated with a few
+#  set-based queries up front. Operations are checked in order against the library
+#  as changed by the operations accepted before them; invalid ones are reported by
+#  index and skipped (or abort the request with atomic=true). Moves and renames are
+#  applied first, deletes last; names of deleted items are free for the renames and
+#  moves of the request, and nothing can be moved or renamed inside a folder the
+#  request deletes (it would be deleted with it).
+import logging
+from uuid import UUID
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy import (
+    String,
+    and_,
+    cast,
+    column,
+    delete,
+    literal,
+    or_,
+    select,
+    tuple_,
+    union_all,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.security import get_subscribed_user
+from app.database.db import get_db, mark_written
+from app.models.models import File, Folder, FolderClosure, User
+from app.schemas.schemas import BulkRequest, BulkResponse
+from app.utils.autosave import autosave_buffer
+from app.utils.folder_tree import lock_tree, move_subtree
+from app.utils.tree_cache import bump_tree_version
+
+logger = logging.getLogger(__name__)
+
+
+bulk_router = APIRouter()
+
+
+def _parse_id(value):
+    return UUID(value) if value is not None else None
+
+
+async def _owned_items(db: AsyncSession, user_id: str, folder_ids, file_ids):
+    """(kind, id) -> (name, parent folder id) of the referenced items the user owns"""
+    rows = (
+        await db.execute(
+            union_all(
+                select(
+                    literal("folder").label("kind"),
+                    Folder.id,
+                    Folder.name,
+                    Folder.parent_id.label("parent_id"),
+                ).where(Folder.user_id == user_id, Folder.id.in_(folder_ids)),
+                select(
+                    literal("file").label("kind"),
+                    File.id,
+                    File.name,
+                    File.folder_id.label("parent_id"),
+                ).where(File.user_id == user_id, File.id.in_(file_ids)),
+            )
+        )
+    ).all()
+    return {(row.kind, row.id): (row.name, row.parent_id) for row in rows}
+
+
+async def _parents_above(db: AsyncSession, folder_ids):
+    """Parent of every folder on the paths from the given folders up to their roots"""
+    rows = (
+        await db.execute(
+            select(Folder.id, Folder.parent_id)
+            .join(FolderClosure, FolderClosure.ancestor_id == Folder.id)
+            .where(FolderClosure.descendant_id.in_(folder_ids))
+        )
+    ).all()
+    return {row.id: row.parent_id for row in rows}
+
+
+def _inside(node, folders, parents) -> bool:
+    """Whether a folder is one of `folders` or below one of them"""
+    seen = set()
+    while node is not None and node not in seen:
+        if node in folders:
+            return True
+        seen.add(node)
+        node = parents.get(node)
+    return False
+
+
+async def _occupants(db: AsyncSession, user_id: str, places):
+    """(kind, parent, name) -> id of the existing items at the given places"""
+    occupants = {}
+    for kind, model, parent_column in (
+        ("file", File, File.folder_id),
+        ("folder", Folder, Folder.parent_id),
+    ):
+        pairs = [(parent, name) for k, parent, name in places if k == kind and parent]
+        root_names = [name for k, parent, name in places if k == kind and not parent]
+        if not pairs and not root_names:
+            continue
+        conditions = []
+        if pairs:
+            conditions.append(tuple_(parent_column, model.name).in_(pairs))
+        if root_names:
+            conditions.append(and_(parent_column.is_(None), model.name.in_(root_names)))
+        rows = (
+            await db.execute(
+                select(model.id, parent_column.label("parent_id"), model.name).where(
+                    model.user_id == user_id, or_(*conditions)
+                )
+            )
+        ).all()
+        for row in rows:
+            occupants[(kind, row.parent_id, row.name)] = row.id
+    return occupants
+
+
+@bulk_router.post("/bulk", response_model=BulkResponse)
+async def bulk_operations(
+    bulk: BulkRequest,
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_subscribed_user),
+):
+    operations = bulk.operations
+    errors = {}
+    targets = {}
+    try:
+        # Parse ids and required fields
+        for index, operation in enumerate(operations):
+            try:
+                target = _parse_id(operation.id)
+                destination = _parse_id(operation.new_parent_id)
+            except ValueError:
+                errors[index] = "Invalid id"
+                continue
+            if operation.op == "rename" and not operation.new_name:
+                errors[index] = "new_name is required to rename"
+            elif (
+                operation.op == "move" and operation.kind == "file" and not destination
+            ):
+                errors[index] = "new_parent_id is required to move a file"
+            else:
+                targets[index] = (operation.kind, target, destination)
+
+        # Serialize with other changes to this user's tree
+        await lock_tree(db, user.id)
+
+        # One query for the ownership of every referenced file and folder
+        folder_ids = {
+            target for kind, target, _ in targets.values() if kind == "folder"
+        }
+        folder_ids |= {
+            destination
+            for index, (_, _, destination) in targets.items()
+            if operations[index].op == "move" and destination
+        }
+        file_ids = {target for kind, target, _ in targets.values() if kind == "file"}
+        owned = await _owned_items(db, user.id, folder_ids, file_ids)
+
+        # Deletes that will go through: of an owned item no earlier operation targets
+        pending_deletes = {"file": set(), "folder": set()}
+        targeted = set()
+        for index, (kind, target, _) in targets.items():
+            if (
+                operations[index].op == "delete"
+                and (kind, target) in owned
+                and (kind, target) not in targeted
+            ):
+                pending_deletes[kind].add(target)
+            targeted.add((kind, target))
+
+        # Pre-request parents of every folder above a move destination, and above
+        # the parent of a renamed item (to find those inside deleted folders)
+        starts = {
+            destination
+            for index, (kind, _, destination) in targets.items()
+            if operations[index].op == "move"
+            and destination
+            and (kind == "folder" or pending_deletes["folder"])
+        }
+        if pending_deletes["folder"]:
+            starts |= {
+                owned[(kind, target)][1]
+                for index, (kind, target, _) in targets.items()
+                if operations[index].op == "rename"
+                and (kind, target) in owned
+                and owned[(kind, target)][1]
+            }
+        parents = await _parents_above(db, starts) if starts else {}
+        parents.update(
+            {
+                item_id: parent
+                for (kind, item_id), (_, parent) in owned.items()
+                if kind == "folder"
+            }
+        )
+
+        # Places the moves and renames would take, to look for name conflicts
+        places = set()
+        for index, (kind, target, destination) in targets.items():
+            if (kind, target) not in owned or operations[index].op == "delete":
+                continue
+            name, parent = owned[(kind, target)]
+            if operations[index].op == "move":
+                places.add((kind, destination, name))
+            else:
+                places.add((kind, parent, operations[index].new_name))
+        occupied = await _occupants(db, user.id, places) if places else {}
+        for (kind, item_id), (name, parent) in owned.items():
+            occupied[(kind, parent, name)] = item_id
+        # Names of the items the request deletes are free
+        occupied = {
+            place: item_id
+            for place, item_id in occupied.items()
+            if item_id not in pending_deletes[place[0]]
+        }
+
+        # Check the operations in order against the library as changed so far
+        changes = {}  # (kind, id) -> (name, parent) after the request
+        folder_moves = []
+        deletes = {"file": [], "folder": []}
+        for index, (kind, target, destination) in targets.items():
+            operation = operations[index]
+            if (kind, target) not in owned:
+                errors[index] = f"{kind.capitalize()} not found"
+                continue
+            if (kind, target) in changes or target in deletes[kind]:
+                errors[index] = (
+                    f"{kind.capitalize()} is already changed by this request"
+                )
+                continue
+            name, parent = owned[(kind, target)]
+            if operation.op == "delete":
+                deletes[kind].append(target)
+                # Free its name for the operations after it
+                if occupied.get((kind, parent, name)) == target:
+                    del occupied[(kind, parent, name)]
+                continue
+
+            if operation.op == "move":
+                if destination and ("folder", destination) not in owned:
+                    errors[index] = "Destination folder not found"
+                    continue
+                if _inside(destination, pending_deletes["folder"], parents):
+                    errors[index] = "Destination folder is deleted by this request"
+                    continue
+                new_name, new_parent = name, destination
+                if kind == "folder":
+                    # Walk up from the destination through the tree as changed so far
+                    node, seen = destination, set()
+                    while node is not None and node != target and node not in seen:
+                        seen.add(node)
+                        node = parents.get(node)
+                    if node == target:
+                        errors[index] = (
+                            "Cannot move a folder into itself or its subfolders"
+                        )
+                        continue
+            else:
+                if _inside(parent, pending_deletes["folder"], parents):
+                    errors[index] = "Folder is deleted by this request"
+                    continue
+                new_name, new_parent = operation.new_name, parent
+
+            if (new_name, new_parent) == (name, parent):
+                continue
+            occupant = occupied.get((kind, new_parent, new_name))
+            if occupant is not None and occupant != target:
+                errors[index] = (
+                    f"{kind.capitalize()} with this name already exists there"
+                )
+                continue
+
+            occupied.pop((kind, parent, name), None)
+            occupied[(kind, new_parent, new_name)] = target
+            changes[(kind, target)] = (new_name, new_parent)
+            if kind == "folder" and new_parent != parent:
+                parents[target] = new_parent
+                folder_moves.append((target, new_parent))
+
+        if errors and bulk.atomic:
+            await db.rollback()
+            return {
+                "applied": 0,
+                "failed": len(errors),
+                "results": [
+                    (
+                        {"index": index, "status": "error", "detail": errors[index]}
+                        if index in errors
+                        else {"index": index, "status": "skipped"}
+                    )
+                    for index in range(len(operations))
+                ],
+            }
+
+        # Apply: one UPDATE per kind from a VALUES list, closure moves, then deletes
+        for kind, model, parent_column in (
+            ("file", File, "folder_id"),
+            ("folder", Folder, "parent_id"),
+        ):
+            rows = [
+                (item_id, name, parent)
+                for (k, item_id), (name, parent) in changes.items()
+                if k == kind
+            ]
+            if not rows:
+                continue
+            changed = values(
+                column("id", PG_UUID(as_uuid=True)),
+                column("name", String),
+                column("parent_id", PG_UUID(as_uuid=True)),
+                name="changed",
+            ).data(rows)
+            await db.execute(
+                update(model)
+                .where(model.id == changed.c.id, model.user_id == user.id)
+                .values(
+                    {
+                        "name": changed.c.name,
+                        # A VALUES list of only NULL parents is typed text
+                        parent_column: cast(changed.c.parent_id, PG_UUID(as_uuid=True)),
+                    }
+                )
+            )
+        for folder_id, new_parent in folder_moves:
+            await move_subtree(db, folder_id, new_parent)
+        if deletes["file"]:
+            await db.execute(
+                delete(File).where(
+                    File.id.in_(deletes["file"]), File.user_id == user.id
+                )
+            )
+        if deletes["folder"]:
+            await db.execute(
+                delete(Folder).where(
+                    Folder.id.in_(
+                        select(FolderClosure.descendant_id).where(
+                            FolderClosure.ancestor_id.in_(deletes["folder"])
+                        )
+                    ),
+                    Folder.user_id == user.id,
+                )
+            )
+        applied = len(operations) - len(errors)
+        if applied:
+            await bump_tree_version(db, user.id)
+        await db.commit()
+        for file_id in deletes["file"]:
+            autosave_buffer.discard(str(file_id))
+            mark_written(f"file:{file_id}")
+        for kind, item_id in changes:
+            if kind == "file":
+                mark_written(f"file:{item_id}")
+
+        return {
+            "applied": applied,
+            "failed": len(errors),
+            "results": [
+                (
+                    {"index": index, "status": "error", "detail": errors[index]}
+                    if index in errors
+                    else {"index": index, "status": "ok"}
+                )
+                for index in range(len(operations))
+            ],
+        }
+
+    except Exception:
+        logger.exception("Error while applying bulk operations")
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to apply bulk operations",
+        )
@@ -1,21 +1,51 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from typing import Optional
+from sqlalchemy import delete, exists, or_, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 from sqlalchemy.sql import text
 
 from app.core.security import get_subscribed_user
-from app.database.db import get_db
-from app.models.models import File, Folder, User
+from app.database.db import get_db, read_session_for
+from app.models.models import File, Folder, FolderClosure, User
 from app.schemas.schemas import (
+    FolderChildrenResponse,
     FolderCreateRequest,
     FolderCreateResponse,
+    FolderDepthTreeResponse,
+    FolderFilesResponse,
+    FolderMove,
     FolderRename,
     FolderTreeResponse,
 )
+from app.utils.folder_tree import (
+    add_folder,
+    is_in_subtree,
+    lock_tree,
+    move_subtree,
+    subtree_ids,
+)
+from app.utils.pagination import decode_cursor, page
+from app.utils.tree_cache import bump_tree_version, etag_matches, tree_cache, tree_etag
+
+logger = logging.getLogger(__name__)
 
 
 folder_router = APIRouter()
 
+# Page size of the lazy tree endpoints and the deepest tree they return
+FOLDER_PAGE_SIZE = 50
+FOLDER_PAGE_MAX_SIZE = 200
+FOLDER_TREE_MAX_DEPTH = 5
+
+
+async def get_tree_read_db(user: User = Depends(get_subscribed_user)):
+    """get_read_db for the folder tree, the primary while the user's tree is fresh"""
+    async with await read_session_for(f"tree:{user.id}") as db:
+        yield db
+
 
 @folder_router.post(
     "/folder",
@@ -28,26 +58,24 @@ folder_router = APIRouter()
 )
 async def create_folder(
     folder_create: FolderCreateRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: User = Depends(get_subscribed_user),
 ):
     try:
-        print(
-            f"--->Creating folder: name={folder_create.name}, parent_id={folder_create.parent_id}"
-        )
+        logger.debug("Creating folder under %s", folder_create.parent_id)
         # Check if folder is 'root level' folder or not
+        await lock_tree(db, user.id)
         if folder_create.parent_id is not None:
             # Find existing folder in Folder table in database
-            existing_folder = (
-                db.query(Folder)
-                .filter(
-                    Folder.parent_id == folder_create.parent_id,
-                    Folder.name == folder_create.name,
-                    Folder.user_id == user.id,
+            existing_folder = await db.scalar(
+                select(
+                    exists().where(
+                        Folder.parent_id == folder_create.parent_id,
+                        Folder.name == folder_create.name,
+                        Folder.user_id == user.id,
+                    )
                 )
-                .first()
             )
-            print(f"Existing folder => {existing_folder}")
             # if folder with same name at same level already present
             if existing_folder:
                 raise HTTPException(
@@ -62,10 +90,11 @@ async def create_folder(
                     user_id=user.id,
                 )
                 db.add(new_folder)
-                print("Added Folder")
-                db.commit()
-                print("Commit successful")
-                db.refresh(new_folder)
+                await db.flush()
+                await add_folder(db, new_folder.id, folder_create.parent_id)
+                await bump_tree_version(db, user.id)
+                await db.commit()
+                await db.refresh(new_folder)
 
                 return JSONResponse(
                     status_code=201,
@@ -85,14 +114,14 @@ async def create_folder(
         else:
             # Here root folder creation will occur
             # Check for root level folder with same name
-            existing_folder = (
-                db.query(Folder)
-                .filter(
-                    Folder.parent_id.is_(None),
-                    Folder.name == folder_create.name,
-                    Folder.user_id == user.id,
+            existing_folder = await db.scalar(
+                select(
+                    exists().where(
+                        Folder.parent_id.is_(None),
+                        Folder.name == folder_create.name,
+                        Folder.user_id == user.id,
+                    )
                 )
-                .first()
             )
             if existing_folder:
                 raise HTTPException(
@@ -104,10 +133,11 @@ async def create_folder(
                 name=folder_create.name, parent_id=None, user_id=user.id
             )
             db.add(new_folder)
-            print("Added Folder")
-            db.commit()
-            print("Commit successful")
-            db.refresh(new_folder)
+            await db.flush()
+            await add_folder(db, new_folder.id)
+            await bump_tree_version(db, user.id)
+            await db.commit()
+            await db.refresh(new_folder)
 
             return JSONResponse(
                 status_code=201,
@@ -123,8 +153,8 @@ async def create_folder(
                 },
             )
     except Exception as e:
-        print(f"Error{e} while creating folder")
-        db.rollback()
+        logger.exception("Error while creating folder")
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
         )
@@ -132,78 +162,203 @@ async def create_folder(
 
 @folder_router.get("/folder", response_model=FolderTreeResponse)
 async def get_folders(
-    db: Session = Depends(get_db), user: User = Depends(get_subscribed_user)
+    request: Request,
+    db: AsyncSession = Depends(get_tree_read_db),
+    user: User = Depends(get_subscribed_user),
 ):
     try:
-        # Using a recursive CTE to get all folders with hierarchy information in one query
-        cte_query = """WITH RECURSIVE folder_tree AS (
-        --- Base Case: select root folders
-        SELECT id, name, parent_id,0 as level
-        FROM folders
-        WHERE user_id =:user_id AND parent_id is NULL
-
-        UNION ALL
-
-        -- Recursive case: select children folders
-        SELECT f.id,f.name,f.parent_id,ft.level+1
-        FROM folders f
-        JOIN folder_tree ft ON f.parent_id = ft.id
-        WHERE f.user_id = :user_id
+        # Read from the same database as the tree so the tag never runs ahead of it
+        version = await db.scalar(select(User.tree_version).where(User.id == user.id))
+        etag = tree_etag(user.id, version)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        body = await tree_cache.load(user.id, version, lambda: _build_tree(db, user.id))
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    except Exception as e:
+        logger.exception("Error while fetching folders")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
         )
-        SELECT id,name,parent_id,level FROM folder_tree ORDER BY level, name
-        """
-        # Execute the query
-        folder_result = db.execute(
-            text(cte_query), {"user_id": str(user.id)}
-        ).fetchall()
-        # create folder dict
-        folders_dict = {}
-        for row in folder_result:
-            folders_dict[str(row.id)] = {
-                "id": str(row.id),
-                "name": row.name,
-                "parent_id": str(row.parent_id) if row.parent_id else None,
-                "subfolders": [],
-                "files": [],
-            }
-
-        # Fetch all relevant files in a single query (without content for performance)
-        file_results = (
-            db.query(File.id, File.name, File.folder_id, File.video_id)
-            .filter(
-                File.user_id == user.id,
-                File.folder_id.in_([row.id for row in folder_result]),
+
+
+async def _build_tree(db: AsyncSession, user_id: str) -> str:
+    # Finished JSON straight from Postgres (see FOLDER_TREE_JSON_FUNCTION), cached
+    # and sent as is
+    return await db.scalar(
+        text("SELECT folder_tree_json(:user_id)::text"), {"user_id": user_id}
+    )
+
+
+# Lazy tree for large libraries: GET /folder returns everything and stays for
+# small accounts, these return one level or page at a time
+
+
+def _has_children():
+    subfolder = aliased(Folder)
+    return or_(
+        exists().where(subfolder.parent_id == Folder.id),
+        exists().where(File.folder_id == Folder.id),
+    ).label("has_children")
+
+
+def _folder_node(row):
+    return {
+        "id": str(row.id),
+        "name": row.name,
+        "parent_id": str(row.parent_id) if row.parent_id else None,
+        "has_children": row.has_children,
+    }
+
+
+async def _check_folder(db: AsyncSession, folder_id: str, user_id: str):
+    folder = await db.scalar(
+        select(exists().where(Folder.id == folder_id, Folder.user_id == user_id))
+    )
+    if not folder:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Folder not found"
+        )
+
+
+@folder_router.get("/folder/children", response_model=FolderChildrenResponse)
+async def get_folder_children(
+    parent_id: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(FOLDER_PAGE_SIZE, ge=1, le=FOLDER_PAGE_MAX_SIZE),
+    db: AsyncSession = Depends(get_tree_read_db),
+    user: User = Depends(get_subscribed_user),
+):
+    """Subfolders of a folder (root level without parent_id), by name"""
+    try:
+        if parent_id is not None:
+            await _check_folder(db, parent_id, user.id)
+        query = (
+            select(Folder.id, Folder.name, Folder.parent_id, _has_children())
+            .where(
+                Folder.user_id == user.id,
+                (
+                    Folder.parent_id == parent_id
+                    if parent_id is not None
+                    else Folder.parent_id.is_(None)
+                ),
             )
-            .all()
+            .order_by(Folder.name, Folder.id)
+            .limit(limit + 1)
+        )
+        if cursor:
+            query = query.where(tuple_(Folder.name, Folder.id) > decode_cursor(cursor))
+        rows, next_cursor = page((await db.execute(query)).all(), limit)
+        return {
+            "folders": [_folder_node(row) for row in rows],
+            "next_cursor": next_cursor,
+        }
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.exception("Error while fetching folder children")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
         )
-        print(file_results)
-        # Add files to their respective folders
-        for file in file_results:
-            folder_id = str(file.folder_id)
-            if folder_id in folders_dict:
-                folders_dict[folder_id]["files"].append(
-                    {
-                        "id": str(file.id),
-                        "name": file.name,
-                        "video_id": file.video_id,
-                        "folder_id": str(file.folder_id),
-                    }
+
+
+@folder_router.get("/folder/{folder_id}/files", response_model=FolderFilesResponse)
+async def get_folder_files(
+    folder_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(FOLDER_PAGE_SIZE, ge=1, le=FOLDER_PAGE_MAX_SIZE),
+    db: AsyncSession = Depends(get_tree_read_db),
+    user: User = Depends(get_subscribed_user),
+):
+    """Files of a folder, by name"""
+    try:
+        await _check_folder(db, folder_id, user.id)
+        query = (
+            select(File.id, File.name, File.video_id, File.folder_id)
+            .where(File.folder_id == folder_id, File.user_id == user.id)
+            .order_by(File.name, File.id)
+            .limit(limit + 1)
+        )
+        if cursor:
+            query = query.where(tuple_(File.name, File.id) > decode_cursor(cursor))
+        rows, next_cursor = page((await db.execute(query)).all(), limit)
+        return {
+            "files": [
+                {
+                    "id": str(row.id),
+                    "name": row.name,
+                    "video_id": row.video_id,
+                    "folder_id": str(row.folder_id),
+                }
+                for row in rows
+            ],
+            "next_cursor": next_cursor,
+        }
+
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.exception("Error while fetching folder files")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
+        )
+
+
+@folder_router.get("/folder/tree", response_model=FolderDepthTreeResponse)
+async def get_folder_tree(
+    parent_id: Optional[str] = None,
+    depth: int = Query(2, ge=1, le=FOLDER_TREE_MAX_DEPTH),
+    db: AsyncSession = Depends(get_tree_read_db),
+    user: User = Depends(get_subscribed_user),
+):
+    """Folders down to `depth` levels below a folder (or the root level), no files"""
+    try:
+        # Descendants within the depth come from the closure table in one index scan
+        if parent_id is not None:
+            await _check_folder(db, parent_id, user.id)
+            descendants = select(FolderClosure.descendant_id).where(
+                FolderClosure.ancestor_id == parent_id,
+                FolderClosure.depth.between(1, depth),
+            )
+        else:
+            root = aliased(Folder)
+            descendants = (
+                select(FolderClosure.descendant_id)
+                .join(root, root.id == FolderClosure.ancestor_id)
+                .where(
+                    root.user_id == user.id,
+                    root.parent_id.is_(None),
+                    FolderClosure.depth < depth,
                 )
+            )
+        rows = (
+            await db.execute(
+                select(Folder.id, Folder.name, Folder.parent_id, _has_children())
+                .where(Folder.id.in_(descendants))
+                .order_by(Folder.name, Folder.id)
+            )
+        ).all()
 
-        # Build the folder tree
+        nodes = {str(row.id): {**_folder_node(row), "subfolders": []} for row in rows}
         folder_tree = []
-        for folder_id, folder_data in folders_dict.items():
-            parent_id = folder_data["parent_id"]
-            if not parent_id:
-                folder_tree.append(folder_data)
+        for node in nodes.values():
+            if node["parent_id"] in nodes:
+                nodes[node["parent_id"]]["subfolders"].append(node)
             else:
-                if parent_id in folders_dict:
-                    folders_dict[parent_id]["subfolders"].append(folder_data)
-
+                folder_tree.append(node)
         return {"folders": folder_tree}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error fetching folders{e}")
+        logger.exception("Error while fetching folder tree")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
         )
@@ -212,31 +367,30 @@ async def get_folders(
 @folder_router.put("/folder")
 async def rename_folder(
     folder_data: FolderRename,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: User = Depends(get_subscribed_user),
 ):
     # check if new name is not already taken in the same level or is not same as parent folder name
     try:
-        print(f"The new name of folder is {folder_data.new_name}")
-        existing_folder = (
-            db.query(Folder)
-            .filter(Folder.id == folder_data.folder_id, Folder.user_id == user.id)
-            .first()
+        existing_folder = await db.scalar(
+            select(Folder).where(
+                Folder.id == folder_data.folder_id, Folder.user_id == user.id
+            )
         )
         if not existing_folder:
             return HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Folder not found"
             )
         # check duplicate name at same level
-        duplicate_folder = (
-            db.query(Folder)
-            .filter(
-                Folder.parent_id == existing_folder.parent_id,
-                Folder.name == folder_data.new_name,
-                Folder.id != existing_folder.id,
-                Folder.user_id == user.id,
+        duplicate_folder = await db.scalar(
+            select(
+                exists().where(
+                    Folder.parent_id == existing_folder.parent_id,
+                    Folder.name == folder_data.new_name,
+                    Folder.id != existing_folder.id,
+                    Folder.user_id == user.id,
+                )
             )
-            .first()
         )
         if duplicate_folder:
             return HTTPException(
@@ -246,13 +400,14 @@ async def rename_folder(
 
         # update folder name
         existing_folder.name = folder_data.new_name
-        db.commit()
+        await bump_tree_version(db, user.id)
+        await db.commit()
         return JSONResponse(
             status_code=status.HTTP_200_OK,
             content={"message": "Folder renamed successfully"},
         )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
         )
@@ -261,22 +416,25 @@ async def rename_folder(
 @folder_router.delete("/folder/{folder_id}")
 async def delete_folder(
     folder_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: User = Depends(get_subscribed_user),
 ):
     try:
-        existing_folder = (
-            db.query(Folder)
-            .filter(Folder.id == folder_id, Folder.user_id == user.id)
-            .first()
-        )
-        if not existing_folder:
+        # One statement for the whole subtree, files and closure rows go by
+        # ON DELETE CASCADE
+        deleted_folders = (
+            await db.scalars(
+                delete(Folder)
+                .where(Folder.id.in_(subtree_ids(folder_id)), Folder.user_id == user.id)
+                .returning(Folder.id)
+            )
+        ).all()
+        if not deleted_folders:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Folder does not exist"
             )
-        # Delete all files in the folder and its subfolders
-        db.delete(existing_folder)
-        db.commit()
+        await bump_tree_version(db, user.id)
+        await db.commit()
 
         return JSONResponse(
             status_code=status.HTTP_200_OK,
@@ -284,7 +442,95 @@ async def delete_folder(
         )
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
+        )
+
+
+@folder_router.put("/folder/move")
+async def move_folder(
+    folder_move: FolderMove,
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_subscribed_user),
+):
+    try:
+        await lock_tree(db, user.id)
+        existing_folder = (
+            await db.execute(
+                select(Folder.id, Folder.name, Folder.parent_id).where(
+                    Folder.id == folder_move.folder_id, Folder.user_id == user.id
+                )
+            )
+        ).first()
+        if not existing_folder:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Folder not found"
+            )
+        new_parent_id = folder_move.new_parent_id
+        if new_parent_id is not None:
+            new_parent = await db.scalar(
+                select(
+                    exists().where(
+                        Folder.id == new_parent_id, Folder.user_id == user.id
+                    )
+                )
+            )
+            if not new_parent:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Destination folder not found",
+                )
+            # Moving a folder below itself would detach the subtree in a cycle
+            if await is_in_subtree(db, new_parent_id, existing_folder.id):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Cannot move a folder into itself or its subfolders",
+                )
+        if str(existing_folder.parent_id or "") == str(new_parent_id or ""):
+            return JSONResponse(
+                status_code=status.HTTP_200_OK,
+                content={"message": "Folder already in this location"},
+            )
+
+        # check duplicate name at the destination
+        duplicate_folder = await db.scalar(
+            select(
+                exists().where(
+                    (
+                        Folder.parent_id == new_parent_id
+                        if new_parent_id is not None
+                        else Folder.parent_id.is_(None)
+                    ),
+                    Folder.name == existing_folder.name,
+                    Folder.user_id == user.id,
+                )
+            )
+        )
+        if duplicate_folder:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Folder with this name already exist at destination",
+            )
+
+        await move_subtree(db, existing_folder.id, new_parent_id)
+        await db.execute(
+            update(Folder)
+            .where(Folder.id == existing_folder.id)
+            .values(parent_id=new_parent_id)
+        )
+        await bump_tree_version(db, user.id)
+        await db.commit()
+        return JSONResponse(
+            status_code=status.HTTP_200_OK,
+            content={"message": "Folder moved successfully"},
+        )
+    except HTTPException:
+        await db.rollback()
+        raise
+    except Exception as e:
+        logger.exception("Error while moving folder")
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e)
         )
@@ -1,18 +1,26 @@
 #  Handles YouTube API calls, video metadata extraction, and transcript downloading
-import json
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+import logging
 import asyncio
 
-from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import JSONResponse, ORJSONResponse
+from sqlalchemy import and_, cast, delete, exists, func, select, union_all, update
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+from app.core.metrics import record_cache, stage
 from app.core.security import get_subscribed_user
-from app.database.db import get_db
-from app.models.models import File, User, Note
+from app.database.db import get_db, get_note_read_db, get_read_db, mark_written
+from app.models.models import SEARCH_CONFIG, File, FileChange, User, Note
 from app.schemas.schemas import (
     ChatDetail,
     MessageResponse,
     NoteDetail,
     NoteResponse,
+    NoteSearchResponse,
+    PatchNote,
+    PatchNoteResponse,
     RenameFile,
     UpdateNote,
 )
@@ -24,31 +32,54 @@ from app.utils.helpers import (
     extract_video_transcript,
     break_into_chunks,
 )
+from app.utils.admission import (
+    AdmissionRejected,
+    admission_controller,
+    estimate_answer_tokens,
+    estimate_note_tokens,
+)
+from app.utils.autosave import autosave_buffer
+from app.utils.delta import compose, is_document, normalize, plain_text, transform
 from app.utils.markdown_delta import markdown_to_quill_delta
+from app.utils.tree_cache import bump_tree_version
+
+logger = logging.getLogger(__name__)
 
 
 note_router = APIRouter()
 
 
+def _overloaded(e: AdmissionRejected):
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many requests in progress, retry later",
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
 @note_router.post("/note", response_model=NoteResponse)
 async def post_youtube_url(
     note_detail: NoteDetail,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: User = Depends(get_subscribed_user),
 ):
-    print(
-        f"-->The {note_detail.folder_id},{note_detail.name},{note_detail.youtube_url}"
+    logger.debug(
+        "Creating note",
+        extra={
+            "folder_id": str(note_detail.folder_id),
+            "youtube_url": note_detail.youtube_url,
+        },
     )
     try:
         # Check if duplicate already exists
-        existing_file = (
-            db.query(File)
-            .filter(
-                File.folder_id == note_detail.folder_id,
-                File.name == note_detail.name,
-                File.user_id == user.id,  # Important security check
+        existing_file = await db.scalar(
+            select(
+                exists().where(
+                    File.folder_id == note_detail.folder_id,
+                    File.name == note_detail.name,
+                    File.user_id == user.id,  # Important security check
+                )
             )
-            .first()
         )
 
         if existing_file:
@@ -56,11 +87,10 @@ async def post_youtube_url(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Duplicate file in the folder",
             )
-    except HTTPException as e:
-        print(f"Error {e } while searching for existing file")
+    except HTTPException:
         raise
-    except Exception as e:
-        print(f"Unexpected error {e} while searching for existing file")
+    except Exception:
+        logger.exception("Unexpected error while searching for existing file")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Internal server error",
@@ -73,10 +103,14 @@ async def post_youtube_url(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid youtube url",
         )
-    # Check if video's note already exists
-    existing_video_note = db.query(Note).filter(Note.video_id == video_id).first()
+    # Check if video's note already exists (content only, not the transcript)
+    existing_video_content = await db.scalar(
+        select(Note.content).where(Note.video_id == video_id).limit(1)
+    )
+    # Notes are generated once per video, every later file reuses them
+    record_cache("video_note", existing_video_content is not None)
 
-    if not existing_video_note:
+    if existing_video_content is None:
         # Get transcript from the videos
         transcript = extract_video_transcript(video_id)
         if transcript is None:
@@ -87,117 +121,261 @@ async def post_youtube_url(
         transcript = transcript.replace("\n", "").strip()
         # Break the transcript in chunks
         chunks = break_into_chunks(transcript)
-        # Run vector processing and note generation concurrently
-        vector_task = asyncio.create_task(create_embedding_and_store(chunks, video_id))
-        notes_task = asyncio.create_task(generate_notes(chunks))
-
-        notes, _ = await asyncio.gather(notes_task, vector_task)
-        # print(f"--> Notes from ChatGpt=> {notes}")
-        formated_notes = markdown_to_quill_delta(notes)
-        # print(f"-->formated_notes{formated_notes} type=>{type(formated_notes)}")
+        try:
+            # Wait for OpenAI budget, or shed the request if it is exhausted
+            async with admission_controller.admit(
+                user.id, estimate_note_tokens(transcript)
+            ):
+                # Run vector processing and note generation concurrently
+                vector_task = asyncio.create_task(
+                    create_embedding_and_store(chunks, video_id)
+                )
+                notes_task = asyncio.create_task(generate_notes(chunks))
+
+                notes, _ = await asyncio.gather(notes_task, vector_task)
+        except AdmissionRejected as e:
+            raise _overloaded(e)
+        with stage("markdown_to_quill_delta"):
+            formated_notes = markdown_to_quill_delta(notes)
         try:
             # Start transaction
             new_note = Note(
-                video_id=video_id, content=formated_notes, transcript=transcript
+                video_id=video_id,
+                content=formated_notes,
+                content_text=plain_text(formated_notes),
+                transcript=transcript,
             )
-            # print(f"New Note => {new_note}")
             db.add(new_note)
 
+            # No content: the file shares the note until its first edit
             new_file = File(
                 user_id=user.id,
                 video_id=video_id,
                 folder_id=note_detail.folder_id,
-                content=formated_notes,
+                content=None,
                 name=note_detail.name,
             )
             db.add(new_file)
+            await bump_tree_version(db, user.id)
 
             # Commit both operations
-            db.commit()
-
-            # Refresh both objects
-            db.refresh(new_note)
-            db.refresh(new_file)
+            with stage("db_commit"):
+                await db.commit()
+            mark_written(f"file:{new_file.id}")
 
             return {
                 "note": {
                     "id": str(new_file.id),
                     "name": new_file.name,
-                    "content": new_file.content,
+                    "content": formated_notes,
                     "folder_id": str(new_file.folder_id),
                     "video_id": new_file.video_id,
                 }
             }
-        except Exception as e:
-            db.rollback()
-            print(f"===>Error {e} while creating note!!!!!!!!")
+        except IntegrityError:
+            # Another request stored the note of this video first, reuse it below
+            await db.rollback()
+            existing_video_content = await db.scalar(
+                select(Note.content).where(Note.video_id == video_id)
+            )
+            if existing_video_content is None:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="Something went wrong",
+                )
+        except Exception:
+            await db.rollback()
+            logger.exception("Error while creating note of video %s", video_id)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Something went wrong",
             )
     # Note of video already exists in database
     try:
-        # print(f"-->Creating new file for already existing note of videoId{video_id}")
+        # No copy of the shared note content until the user edits the file
         new_file = File(
             user_id=user.id,
             video_id=video_id,
             folder_id=note_detail.folder_id,
-            content=existing_video_note.content,
+            content=None,
             name=note_detail.name,
         )
         db.add(new_file)
-        db.commit()
-        db.refresh(new_file)
+        await bump_tree_version(db, user.id)
+        await db.commit()
+        mark_written(f"file:{new_file.id}")
         return {
             "note": {
                 "id": str(new_file.id),
                 "name": new_file.name,
-                "content": new_file.content,
+                "content": existing_video_content,
                 "folder_id": str(new_file.folder_id),
                 "video_id": new_file.video_id,
             }
         }
 
-    except Exception as e:
-        db.rollback()
-        # print(f"--> Error {e} while creating file")
+    except Exception:
+        await db.rollback()
+        logger.exception("Error while creating file of video %s", video_id)
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to create note",
         )
 
 
+NOTE_SEARCH_LIMIT = 10
+NOTE_SEARCH_MAX_LIMIT = 50
+# A few short fragments around the matches
+NOTE_SEARCH_HEADLINE = (
+    "StartSel=<mark>, StopSel=</mark>, MaxFragments=3, MaxWords=20, MinWords=8"
+)
+
+
+def _escape_html(text):
+    # Before ts_headline, so only its <mark> tags reach the client unescaped
+    for char, entity in (("&", "&amp;"), ("<", "&lt;"), (">", "&gt;")):
+        text = func.replace(text, char, entity)
+    return text
+
+
+@note_router.get("/notes/search", response_model=NoteSearchResponse)
+async def search_notes(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(NOTE_SEARCH_LIMIT, ge=1, le=NOTE_SEARCH_MAX_LIMIT),
+    db: AsyncSession = Depends(get_read_db),
+    user: User = Depends(get_subscribed_user),
+):
+    """Files of the user matching a web-style query, best first
+
+    The query takes words, "phrases", -excluded words and or.
+    """
+    try:
+        config = cast(SEARCH_CONFIG, REGCONFIG)
+        query = func.websearch_to_tsquery(config, q)
+        # Files with their own text match on their vector (name and text), files still
+        # sharing their video's note also on the note's vector; both use GIN indexes
+        matches = union_all(
+            select(
+                File.id, func.ts_rank(File.search_vector, query).label("rank")
+            ).where(File.user_id == user.id, File.search_vector.op("@@")(query)),
+            select(File.id, func.ts_rank(Note.search_vector, query))
+            .join(Note, Note.video_id == File.video_id)
+            .where(
+                File.user_id == user.id,
+                File.content_text.is_(None),
+                Note.search_vector.op("@@")(query),
+            ),
+        ).subquery()
+        best = (
+            select(matches.c.id, func.sum(matches.c.rank).label("rank"))
+            .group_by(matches.c.id)
+            .order_by(func.sum(matches.c.rank).desc(), matches.c.id)
+            .limit(limit)
+            .subquery()
+        )
+        # Highlights only for the page of results: ts_headline re-parses the whole
+        # text (about 1 ms for 500 words), it is most of the time of a search
+        rows = (
+            await db.execute(
+                select(
+                    File.id,
+                    File.name,
+                    File.video_id,
+                    File.folder_id,
+                    best.c.rank,
+                    func.ts_headline(
+                        config,
+                        _escape_html(
+                            func.coalesce(File.content_text, Note.content_text)
+                        ),
+                        query,
+                        NOTE_SEARCH_HEADLINE,
+                    ).label("highlight"),
+                )
+                .join(best, best.c.id == File.id)
+                .outerjoin(
+                    Note,
+                    and_(File.content_text.is_(None), Note.video_id == File.video_id),
+                )
+                .order_by(best.c.rank.desc(), File.id)
+            )
+        ).all()
+        return {
+            "results": [
+                {
+                    "id": str(row.id),
+                    "name": row.name,
+                    "video_id": row.video_id,
+                    "folder_id": str(row.folder_id),
+                    "rank": row.rank,
+                    "highlight": row.highlight or None,
+                }
+                for row in rows
+            ]
+        }
+
+    except Exception:
+        logger.exception("Error while searching notes")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to search notes",
+        )
+
+
 @note_router.get("/note/{note_id}", response_model=NoteResponse)
 async def get_note(
     note_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_note_read_db),
     user: User = Depends(get_subscribed_user),
 ):
     try:
         # Search if file is present or not
+        # Shared content of the video's note comes along when the file has no copy
         existing_note = (
-            db.query(File)
-            .filter(File.user_id == user.id)
-            .filter(File.id == note_id)
-            .first()
-        )
+            await db.execute(
+                select(
+                    File.id,
+                    File.name,
+                    File.folder_id,
+                    File.video_id,
+                    File.version,
+                    File.content,
+                    Note.content.label("shared_content"),
+                )
+                .outerjoin(
+                    Note, and_(File.content.is_(None), Note.video_id == File.video_id)
+                )
+                .where(File.user_id == user.id, File.id == note_id)
+            )
+        ).first()
         if not existing_note:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Note not found"
             )
-        return {
-            "note": {
-                "id": str(existing_note.id),
-                "name": existing_note.name,
-                "content": existing_note.content,
-                "folder_id": str(existing_note.folder_id),
-                "video_id": existing_note.video_id,
+        content, version = existing_note.content, existing_note.version
+        if content is None:
+            content = existing_note.shared_content
+        # An autosave not written yet is newer than the database row
+        buffered_content = autosave_buffer.get(note_id, user.id)
+        if buffered_content is not None:
+            content, version = buffered_content, version + 1
+        # Content is already a dict (JSONB), encode the response once with orjson
+        return ORJSONResponse(
+            {
+                "note": {
+                    "id": str(existing_note.id),
+                    "name": existing_note.name,
+                    "content": content,
+                    "folder_id": str(existing_note.folder_id),
+                    "video_id": existing_note.video_id,
+                    "version": version,
+                }
             }
-        }
+        )
 
-    except Exception as e:
-        db.rollback()
-        print(f"Error {e} while fetching file")
+    except Exception:
+        await db.rollback()
+        logger.exception("Error while fetching file")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Something went wrong",
@@ -207,61 +385,160 @@ async def get_note(
 @note_router.put("/note", response_model=MessageResponse)
 async def update_note(
     update_note: UpdateNote,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: User = Depends(get_subscribed_user),
 ):
     try:
-        # Check if file exists
-        existing_note = (
-            db.query(File)
-            .filter(File.user_id == user.id)
-            .filter(File.id == update_note.file_id)
-            .first()
+        # Check if file exists, unless this user already has a save buffered for it
+        if not autosave_buffer.owns(update_note.file_id, user.id):
+            existing_note = await db.scalar(
+                select(File.id).where(
+                    File.user_id == user.id, File.id == update_note.file_id
+                )
+            )
+            if not existing_note:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND, detail="Note not found"
+                )
+        # Acknowledge now, only the latest content is written once edits settle
+        autosave_buffer.put(update_note.file_id, user.id, normalize(update_note.note))
+        return {"message": "FIle updated successfully"}
+
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception:
+        logger.exception("Error while updating note")
+        await db.rollback()
+        raise HTTPException(status_code=500, detail="Failed to update note")
+
+
+# Number of applied changes kept per file to transform patches from stale clients
+FILE_CHANGE_HISTORY = 100
+
+
+@note_router.patch("/note", response_model=PatchNoteResponse)
+async def patch_note(
+    patch: PatchNote,
+    db: AsyncSession = Depends(get_db),
+    user: User = Depends(get_subscribed_user),
+):
+    try:
+        # Write any buffered full save first so the patch applies on top of it
+        await autosave_buffer.flush(patch.file_id)
+        # Lock the row so concurrent patches of the same file are applied in order
+        existing_note = await db.scalar(
+            select(File)
+            .options(undefer(File.content))
+            .where(File.user_id == user.id, File.id == patch.file_id)
+            .with_for_update()
         )
         if not existing_note:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Note not found"
             )
-        print(type(update_note.note))
-        existing_note.content = json.dumps(update_note.note)
-        db.commit()
-        return {"message": "FIle updated successfully"}
+        if patch.base_version > existing_note.version:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT, detail="Unknown base version"
+            )
 
-    except Exception as e:
-        print(f"Error{e} while updating note")
-        db.rollback()
+        change = patch.delta
+        missed = {"ops": []}
+        if patch.base_version < existing_note.version:
+            # Client is behind: transform its change against the changes it missed
+            server_changes = (
+                await db.execute(
+                    select(FileChange.delta)
+                    .where(
+                        FileChange.file_id == existing_note.id,
+                        FileChange.version > patch.base_version,
+                    )
+                    .order_by(FileChange.version)
+                )
+            ).all()
+            if len(server_changes) != existing_note.version - patch.base_version:
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Note changed, reload it before saving",
+                )
+            for server_change in server_changes:
+                missed = compose(missed, server_change.delta)
+            change = transform(missed, patch.delta, priority=True)
+            missed = transform(patch.delta, missed, priority=False)
+
+        base_content = existing_note.content
+        if base_content is None:
+            # First edit of a shared note: the result becomes the file's private copy
+            base_content = await db.scalar(
+                select(Note.content).where(Note.video_id == existing_note.video_id)
+            )
+        new_content = normalize(compose(base_content or {"ops": []}, change))
+        if not is_document(new_content):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Patch does not apply to this note",
+            )
+
+        existing_note.content = new_content
+        existing_note.content_text = plain_text(new_content)
+        existing_note.version += 1
+        db.add(
+            FileChange(
+                file_id=existing_note.id, version=existing_note.version, delta=change
+            )
+        )
+        await db.execute(
+            delete(FileChange).where(
+                FileChange.file_id == existing_note.id,
+                FileChange.version <= existing_note.version - FILE_CHANGE_HISTORY,
+            )
+        )
+        await db.commit()
+        # Reads of the file skip the replica until it has this version
+        mark_written(f"file:{existing_note.id}")
+        return {"version": existing_note.version, "delta": missed}
+
+    except HTTPException:
+        await db.rollback()
+        raise
+    except ValueError as e:
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception:
+        logger.exception("Error while patching note")
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Failed to update note")
 
 
 @note_router.put("/rename_file", response_model=MessageResponse)
 async def rename_note(
     rename_file: RenameFile,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: User = Depends(get_subscribed_user),
 ):
     try:
-        file = (
-            db.query(File)
-            .filter(File.id == rename_file.file_id)
-            .filter(File.user_id == user.id)
-            .first()
+        file_name = await db.scalar(
+            select(File.name).where(
+                File.id == rename_file.file_id, File.user_id == user.id
+            )
         )
-        if not file:
+        if file_name is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="File not found"
             )
 
         # Skip update if name hasn't changed
-        if file.name == rename_file.new_file_name:
+        if file_name == rename_file.new_file_name:
             return {"message": "File name unchanged"}
 
         # check if new_name is already exists
-        duplicate_named_file = (
-            db.query(File)
-            .filter(File.name == rename_file.new_file_name)
-            .filter(File.folder_id == rename_file.folder_id)
-            .filter(File.user_id == user.id)
-            .first()
+        duplicate_named_file = await db.scalar(
+            select(
+                exists().where(
+                    File.name == rename_file.new_file_name,
+                    File.folder_id == rename_file.folder_id,
+                    File.user_id == user.id,
+                )
+            )
         )
         if duplicate_named_file:
             raise HTTPException(
@@ -269,27 +546,35 @@ async def rename_note(
                 detail="File with this name already exists",
             )
 
-        file.name = rename_file.new_file_name
-        db.commit()
+        await db.execute(
+            update(File)
+            .where(File.id == rename_file.file_id, File.user_id == user.id)
+            .values(name=rename_file.new_file_name)
+        )
+        await bump_tree_version(db, user.id)
+        await db.commit()
+        mark_written(f"file:{rename_file.file_id}")
         return {"message": "File name changed"}
-    except Exception as e:
-        print(f"Error {e} while updating filename")
-        db.rollback()
+    except Exception:
+        logger.exception("Error while updating filename")
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Failed to change filename")
 
 
 @note_router.post("/note/ask")
 async def ask_question(
     chat_detail: ChatDetail,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: User = Depends(get_subscribed_user),
 ):
     try:
         # Check if the video exists in the user's notes
-        existing_file = (
-            db.query(File)
-            .filter(File.video_id == chat_detail.video_id, File.user_id == user.id)
-            .first()
+        existing_file = await db.scalar(
+            select(
+                exists().where(
+                    File.video_id == chat_detail.video_id, File.user_id == user.id
+                )
+            )
         )
 
         if not existing_file:
@@ -299,9 +584,10 @@ async def ask_question(
             )
 
         # Get answer from the transcript
-        print("-->Getting Answer:")
-        answer = await answer_question(chat_detail.question, chat_detail.video_id)
-        print(f"-->Answer=> {answer}")
+        async with admission_controller.admit(
+            user.id, estimate_answer_tokens(chat_detail.question)
+        ):
+            answer = await answer_question(chat_detail.question, chat_detail.video_id)
         return JSONResponse(
             {
                 "question": chat_detail.question,
@@ -310,6 +596,10 @@ async def ask_question(
             }
         )
 
+    except AdmissionRejected as e:
+        raise _overloaded(e)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -317,27 +607,30 @@ async def ask_question(
 @note_router.delete("/note/{note_id}", response_model=MessageResponse)
 async def delete_note(
     note_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     user: User = Depends(get_subscribed_user),
 ):
     try:
-        existing_note = (
-            db.query(File)
-            .filter(File.user_id == user.id)
-            .filter(File.id == note_id)
-            .first()
+        # Delete by id, no need to load the file
+        # (its change log cascades in the database)
+        existing_note = await db.scalar(
+            delete(File)
+            .where(File.user_id == user.id, File.id == note_id)
+            .returning(File.id)
         )
         if not existing_note:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Note not found"
             )
-        db.delete(existing_note)
-        db.commit()
+        await bump_tree_version(db, user.id)
+        await db.commit()
+        autosave_buffer.discard(note_id)
+        mark_written(f"file:{note_id}")
         return {"message": "File deleted"}
 
-    except Exception as e:
-        print(f"Error {e} while deleting file")
-        db.rollback()
+    except Exception:
+        logger.exception("Error while deleting file")
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to delete note",
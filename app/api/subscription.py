@@ -1,141 +1,117 @@
 from fastapi import APIRouter, Depends, Request, HTTPException, status
+import logging
 import httpx
-from sqlalchemy.orm import Session
-from app.database.db import get_db
-from app.models.models import User, Subscription
-from app.core.security import get_current_user, get_subscribed_user
-from typing import Dict, Any
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.database.db import get_db, get_read_db
+from app.models.models import PaddleEvent, User, Subscription
+from app.core.security import get_subscribed_user
+from app.utils.paddle_events import (
+    paddle_event_consumer,
+    parse_paddle_time,
+    subscription_key,
+)
+from app.utils.serialization import json_loads
 import hmac
 import hashlib
-import json
-from datetime import datetime, timezone
+import time
 import os
 
+logger = logging.getLogger(__name__)
+
 subscription_router = APIRouter()
 
 PADDLE_API_KEY = os.getenv("PADDLE_API_KEY")
 PADDLE_WEBHOOK_SECRET = os.getenv("PADDLE_WEBHOOK_SECRET")
+# Accepted age of a webhook signature, in seconds
+PADDLE_WEBHOOK_TOLERANCE_SECONDS = int(
+    os.getenv("PADDLE_WEBHOOK_TOLERANCE_SECONDS", "300")
+)
 
 
 # verify webhook signature for security
-def verify_webhook(request_data: Dict[Any, Any], signature: str) -> bool:
+def verify_webhook(raw_body: bytes, signature: str) -> bool:
     """Verify the Paddle webhook signature"""
     # For test environment, you might want to skip verification during development
     if os.getenv("ENVIRONMENT", "development") == "development":
         return True
 
     if not PADDLE_WEBHOOK_SECRET:
-        print("Warning: PADDLE_WEBHOOK_SECRET is not set")
+        logger.warning("PADDLE_WEBHOOK_SECRET is not set")
         return False
-    # verify using signature system
-    serialized_data = json.dumps(request_data, separators=(",", ":"))
-    signature_verified = False
-
+    # Paddle-Signature: ts=<unix time>;h1=<HMAC-SHA256 of "<ts>:<raw body>">, with one
+    # h1 per secret while secrets are being rotated
     try:
+        fields = [field.split("=", 1) for field in signature.split(";")]
+        timestamp = next(value for name, value in fields if name == "ts")
+        signatures = [value for name, value in fields if name == "h1"]
+        # Old signed requests can't be replayed
+        if abs(time.time() - int(timestamp)) > PADDLE_WEBHOOK_TOLERANCE_SECONDS:
+            return False
         computed_hash = hmac.new(
             PADDLE_WEBHOOK_SECRET.encode("utf-8"),
-            serialized_data.encode("utf-8"),
+            timestamp.encode("utf-8") + b":" + raw_body,
             hashlib.sha256,
         ).hexdigest()
-        signature_verified = hmac.compare_digest(computed_hash, signature)
-    except Exception as e:
-        print(f"Error verifying signature:{e}")
+    except (ValueError, StopIteration) as e:
+        logger.warning("Malformed webhook signature: %s", e)
         return False
-    return signature_verified
+    return any(hmac.compare_digest(computed_hash, h1) for h1 in signatures)
 
 
 @subscription_router.post("/webhook/paddle")
-async def paddle_webhook(request: Request, db: Session = Depends(get_db)):
-    """Handle Paddle webhook events for subscription lifecycle"""
-    body = await request.json()
-    print(body)
+async def paddle_webhook(request: Request, db: AsyncSession = Depends(get_db)):
+    """Store a Paddle webhook event and acknowledge it, the consumer applies it"""
+    # The signature covers the body exactly as sent
+    raw_body = await request.body()
     signature = request.headers.get("Paddle-Signature")
-    print(f"Signature==>{signature}")
     if not signature:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Missing webhook signature",
         )
     # verify webhook signature to ensure its's from Paddle
-    if not verify_webhook(body, signature):
+    if not verify_webhook(raw_body, signature):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid webhook signature",
         )
-    # Extract webhook data
-    event_type = body.get("event_type", "")
-    print(f"Event type==>{event_type}")
-    data = body.get("data", {})
     try:
-        if event_type == "subscription.created":
-            await handle_subscription_created(data, db)
-        elif event_type == "subscription.canceled":
-            await handle_subscription_canceled(data, db)
-        return {"status": "success"}
-    except Exception as e:
-        print(f"Error processing webhook: {e}")
-        # Still return 200 to prevent Paddle from retrying
-        return {"status": "error", "message": str(e)}
-
-
-async def handle_subscription_created(data: Dict, db: Session):
-    """Handle subscription.created event"""
-    print("_____ Keys are ______")
-    print(data.get("custom_data"))
-
-    custom_data = data.get("custom_data")
-    if not custom_data:
-        raise ValueError("Custom data not provided")
-    customer_email = custom_data.get("email")
-
-    if not customer_email:
-        raise ValueError("Customer email not provided")
-    print(f"Customer email=?{customer_email}")
-    # Find the user
-    user = db.query(User).filter(User.email == customer_email).first()
-    if not user:
-        raise ValueError(f"User with email {customer_email} not found")
-
-    scheduled_change = data.get("scheduled_change")
-    is_cancelling = False
-    if scheduled_change is not None:
-        is_cancelling = scheduled_change.get("action") == "cancel"
-    
-    # Create new subscription record
-    subscription = Subscription(
-        user_id=user.id,
-        paddle_subscription_id=data.get("id"),
-        status=data.get("status", "active"),
-        plan_id=data.get("items", [{}])[0].get("price", {}).get("id"),
-        current_period_end=datetime.fromisoformat(
-            data.get("current_billing_period", {}).get("ends_at").replace("Z", "+00:00")
-        ),
-        cancel_at_period_end=is_cancelling,
-    )
-    print("---Model created---")  #  4242 4242 4242 4242
-    db.add(subscription)
-    db.commit()
-    db.refresh(subscription)
-    print(f"Created subscription for user ==> {user.id}")
-
-
-async def handle_subscription_canceled(data: Dict, db: Session):
-    """Handle subscription.canceled event"""
-    subscription_id = data.get("id")
-    subscription = (
-        db.query(Subscription)
-        .filter(Subscription.paddle_subscription_id == subscription_id)
-        .first()
+        event = json_loads(raw_body)
+        values = {
+            "event_id": event["event_id"],
+            "event_type": event["event_type"],
+            "subscription_key": subscription_key(event),
+            "occurred_at": parse_paddle_time(event["occurred_at"]),
+            "payload": event,
+        }
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Malformed webhook event"
+        )
+    logger.info(
+        "Paddle event received",
+        extra={"event_type": values["event_type"], "event_id": values["event_id"]},
     )
-
-    if not subscription:
-        raise ValueError(f"Subscription {subscription_id} not found")
-
-    # Update subscription status
-    subscription.status = "canceled"
-    subscription.canceled_at = datetime.now(timezone.utc)
-    db.commit()
-    print(f"Canceled subscription {subscription_id}")
+    try:
+        # A redelivered event is already stored, nothing to do
+        await db.execute(
+            insert(PaddleEvent)
+            .values(values)
+            .on_conflict_do_nothing(index_elements=[PaddleEvent.event_id])
+        )
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        logger.exception("Error while storing webhook event %s", values["event_id"])
+        # Paddle retries until it gets a 2xx
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to store webhook event",
+        )
+    paddle_event_consumer.wake()
+    return {"status": "success"}
 
 
 # Add these endpoints to your subscriptions.py file
@@ -143,14 +119,14 @@ async def handle_subscription_canceled(data: Dict, db: Session):
 
 @subscription_router.post("/subscription/cancel")
 async def cancel_subscription(
-    db: Session = Depends(get_db), user: User = Depends(get_subscribed_user)
+    db: AsyncSession = Depends(get_db), user: User = Depends(get_subscribed_user)
 ):
     """Cancel the user's subscription through Paddle API"""
     # Get the user's active subscription
-    subscription = (
-        db.query(Subscription)
-        .filter(Subscription.user_id == user.id, Subscription.status == "active")
-        .first()
+    subscription = await db.scalar(
+        select(Subscription)
+        .where(Subscription.user_id == user.id, Subscription.status == "active")
+        .limit(1)
     )
 
     if not subscription:
@@ -176,7 +152,7 @@ async def cancel_subscription(
 
             # Update local subscription record
             subscription.cancel_at_period_end = True
-            db.commit()
+            await db.commit()
 
             return {
                 "status": "success",
@@ -194,14 +170,14 @@ async def cancel_subscription(
 
 @subscription_router.get("/status")
 async def get_subscription_status(
-    db: Session = Depends(get_db), user: User = Depends(get_subscribed_user)
+    db: AsyncSession = Depends(get_read_db), user: User = Depends(get_subscribed_user)
 ):
     """Get the current user's subscription status"""
-    subscription = (
-        db.query(Subscription)
-        .filter(Subscription.user_id == user.id, Subscription.status == "active")
+    subscription = await db.scalar(
+        select(Subscription)
+        .where(Subscription.user_id == user.id, Subscription.status == "active")
         .order_by(Subscription.created_at.desc())
-        .first()
+        .limit(1)
     )
 
     if not subscription:
@@ -221,31 +197,3 @@ async def get_subscription_status(
             else None
         ),
     }
-
-
-async def get_subscribed_user(
-    current_user: User = Depends(get_current_user), db: Session = Depends(get_db)
-):
-    """Check if user has an active subscription and return the user"""
-
-    # Check if user has an active subscription
-    subscription = (
-        db.query(Subscription)
-        .filter(
-            Subscription.user_id == current_user.id,
-            Subscription.status == "active",
-            Subscription.current_period_end > datetime.now(),
-        )
-        .first()
-    )
-
-    if not subscription:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail={
-                "message": "This feature requires an active subscription",
-                "subscription_required": True,
-            },
-        )
-
-    return current_user
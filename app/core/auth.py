@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.responses import JSONResponse, RedirectResponse
 from contextlib import asynccontextmanager
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from dotenv import load_dotenv
 
 # import secrets
+import logging
 import httpx
 import os
 
@@ -21,6 +23,8 @@ from app.database.db import get_db
 from app.models.models import User
 from app.schemas.schemas import OAuthUser
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 auth_router = APIRouter()
 
@@ -54,8 +58,8 @@ async def auth_google():
         )
         return RedirectResponse(url=auth_url)
 
-    except Exception as e:
-        print(f"--> Error{e} while redirecting")
+    except Exception:
+        logger.exception("Error while redirecting to Google")
         raise HTTPException(
             status_code=status.HTTP_302_FOUND, detail="Auth Url or user found"
         )
@@ -63,7 +67,7 @@ async def auth_google():
 
 # Callback route to handle the response from Google
 @auth_router.get("/auth/google-callback")
-async def callback(code: str, db: Session = Depends(get_db)):
+async def callback(code: str, db: AsyncSession = Depends(get_db)):
     try:
         # Use connection pooling with async context manager
         async with get_http_client() as client:
@@ -81,8 +85,12 @@ async def callback(code: str, db: Session = Depends(get_db)):
             )
 
             if token_response.status_code != 200:
-                print(
-                    f"Token response error: {token_response.status_code}, {token_response.text}"
+                logger.warning(
+                    "Google token exchange failed",
+                    extra={
+                        "status": token_response.status_code,
+                        "body": token_response.text,
+                    },
                 )
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -146,8 +154,8 @@ async def callback(code: str, db: Session = Depends(get_db)):
 
     except HTTPException:
         raise
-    except Exception as e:
-        print(f"Unexpected error in Google callback: {e}")
+    except Exception:
+        logger.exception("Unexpected error in Google callback")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Authentication error",
@@ -157,7 +165,6 @@ async def callback(code: str, db: Session = Depends(get_db)):
 @auth_router.get("/me")
 async def get_me(req: Request):
     access_token = req.cookies.get("access_token")
-    # print("--- Access Token ---")
     if not access_token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated"
@@ -166,14 +173,14 @@ async def get_me(req: Request):
         user_detail = verify_token(access_token)
         return user_detail
     except Exception as e:
-        print(f"Token verification error: {e}")
+        logger.info("Token verification error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token"
         )
 
 
 @auth_router.get("/refresh")
-async def refresh_token(req: Request, db: Session = Depends(get_db)):
+async def refresh_token(req: Request, db: AsyncSession = Depends(get_db)):
     refresh_token = req.cookies.get("refresh_token")
 
     if not refresh_token:
@@ -186,7 +193,7 @@ async def refresh_token(req: Request, db: Session = Depends(get_db)):
         user_data = verify_token(refresh_token)
 
         # Verify user exists in database
-        user = db.query(User).filter(User.email == user_data["email"]).first()
+        user = await db.scalar(select(User).where(User.email == user_data["email"]))
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found"
@@ -226,7 +233,7 @@ async def refresh_token(req: Request, db: Session = Depends(get_db)):
         return response
 
     except Exception as e:
-        print(f"Refresh token error: {e}")
+        logger.info("Refresh token error: %s", e)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token"
         )
@@ -0,0 +1,129 @@
+#  Logging of the app: one JSON object per line on stderr, written off the event loop
+#  Records go through a bounded queue to a QueueListener thread that formats and
+#  writes them, so a log call on a request path costs a dict copy and a put; when the
+#  queue is full the record is dropped (and counted) rather than blocking the loop.
+#  Every record carries the id of the request it was logged in (request_id_middleware).
+#  String fields longer than LOG_MAX_FIELD_CHARS are truncated and DEBUG records, the
+#  ones carrying payloads, are kept with probability LOG_DEBUG_SAMPLE_RATE.
+#  Levels: LOG_LEVEL for everything, LOG_LEVELS="app.api.notes=DEBUG,httpx=WARNING"
+#  per logger.
+
+import copy
+import logging
+import os
+import queue
+import random
+import sys
+import traceback
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+import orjson
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "2000"))
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1"))
+
+# Id of the request being handled, "-" outside of requests
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+
+# Attributes every LogRecord has, anything else was passed with extra=
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "request_id"}
+
+
+def _truncate(value):
+    if isinstance(value, str) and len(value) > LOG_MAX_FIELD_CHARS:
+        omitted = len(value) - LOG_MAX_FIELD_CHARS
+        return f"{value[:LOG_MAX_FIELD_CHARS]}...(+{omitted} chars)"
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": _truncate(record.getMessage()),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                entry[name] = _truncate(value)
+        if record.exc_info:
+            entry["exception"] = _truncate(
+                "".join(traceback.format_exception(*record.exc_info))
+            )
+        return orjson.dumps(entry, default=str).decode()
+
+
+class _AppQueueHandler(QueueHandler):
+    """Hands records to the listener thread, formatting happens there"""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments now: they may be mutated after the call returns
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.request_id = request_id_var.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _AppQueueHandler.dropped += 1
+
+
+class _DebugSampler(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < LOG_DEBUG_SAMPLE_RATE
+
+
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging():
+    """Route the root logger through the queue, idempotent"""
+    global _listener
+    if _listener is not None:
+        return
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter())
+    records: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = _AppQueueHandler(records)
+    handler.addFilter(_DebugSampler())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    for entry in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+        name, _, level = entry.partition("=")
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+    # Uvicorn's loggers write on their own handlers, send them through ours too
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+
+    _listener = QueueListener(records, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """Write the queued records and stop the listener thread"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    if _AppQueueHandler.dropped:
+        sys.stderr.write(
+            f"{_AppQueueHandler.dropped} log records dropped, queue full\n"
+        )
@@ -0,0 +1,129 @@
+#  Prometheus metrics of the app, exposed on GET /metrics
+#  Code records through the few functions below rather than the metric objects, so
+#  names and labels stay in one place. Everything is in-process counters and
+#  histograms (a lock and a few additions per observation); the database pools are
+#  only read when /metrics is scraped. Metrics are per worker process, Prometheus
+#  tells workers apart by their instance/pod labels.
+#  Cache hit ratios: rate(backyt_cache_requests_total{result="hit"}[5m]) over the
+#  sum of both results, per cache.
+
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+
+from app.core.timing import add_upstream
+from app.database.db import DB_MAX_OVERFLOW, DB_POOL_SIZE, engine, replica_engine
+
+# Note generation steps take from milliseconds (chunking) to minutes (the LLM calls)
+STAGE_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    20,
+    40,
+    80,
+    160,
+)
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+STAGE_SECONDS = Histogram(
+    "backyt_stage_seconds",
+    "Duration of the steps of note generation and of answering questions",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "backyt_http_request_seconds",
+    "Duration of HTTP requests by route template",
+    ["method", "route", "status"],
+    buckets=HTTP_BUCKETS,
+)
+OPENAI_TOKENS = Counter(
+    "backyt_openai_tokens",
+    "OpenAI tokens spent, by call site",
+    ["call_site", "kind"],
+)
+CACHE_REQUESTS = Counter(
+    "backyt_cache_requests",
+    "Cache lookups by result",
+    ["cache", "result"],
+)
+
+
+@contextmanager
+def stage(name: str, upstream: bool = False):
+    """
+    Time the body as step `name` (also around awaits).
+
+    Args:
+        name (str): Step, the stage label
+        upstream (bool): The step waits on another service, its time is part of the
+            upstream entry of the Server-Timing header
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        if upstream:
+            add_upstream(elapsed)
+
+
+def observe_request(method: str, route: str, status: int, seconds: float):
+    HTTP_REQUEST_SECONDS.labels(method, route, str(status)).observe(seconds)
+
+
+def record_openai_usage(call_site: str, usage):
+    """Count the tokens of an OpenAI response (its `usage`, None if not reported)"""
+    if usage is None:
+        return
+    OPENAI_TOKENS.labels(call_site, "prompt").inc(usage.prompt_tokens or 0)
+    OPENAI_TOKENS.labels(call_site, "completion").inc(usage.completion_tokens or 0)
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+class DatabasePoolCollector:
+    """Connections of the SQLAlchemy pools, read at scrape time"""
+
+    def collect(self):
+        connections = GaugeMetricFamily(
+            "backyt_db_pool_connections",
+            "Connections of the database pool by state",
+            labels=["engine", "state"],
+        )
+        saturation = GaugeMetricFamily(
+            "backyt_db_pool_saturation",
+            "Checked out connections over the most the pool can open"
+            " (1 = requests wait)",
+            labels=["engine"],
+        )
+        capacity = DB_POOL_SIZE + DB_MAX_OVERFLOW
+        engines = {"primary": engine, "replica": replica_engine}
+        for name, db_engine in engines.items():
+            if db_engine is None:
+                continue
+            pool = db_engine.pool
+            checked_out = pool.checkedout()
+            connections.add_metric([name, "checked_out"], checked_out)
+            connections.add_metric([name, "idle"], pool.checkedin())
+            connections.add_metric([name, "overflow"], max(0, pool.overflow()))
+            saturation.add_metric([name], checked_out / capacity)
+        yield connections
+        yield saturation
+
+
+REGISTRY.register(DatabasePoolCollector())
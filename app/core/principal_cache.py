@@ -0,0 +1,169 @@
+#  Per-worker cache of the authenticated principal of a request
+#  get_current_user resolves the user and their entitlement (users.entitled_until) with
+#  one query and keeps them for PRINCIPAL_CACHE_TTL_SECONDS per (email, token id), so
+#  most requests reach the route without a database round trip. Subscription changes
+#  drop the entries of the user right away in this worker and, over Redis pub/sub, in
+#  every other one; if Redis is unreachable the TTL bounds how stale an entry gets.
+
+import logging
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Optional, Set, Tuple
+
+from redis.asyncio import Redis
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.redis_client import create_redis
+from app.models.models import User
+
+logger = logging.getLogger(__name__)
+
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+PRINCIPAL_INVALIDATION_CHANNEL = "principal-invalidations"
+LISTEN_RETRY_SECONDS = 5
+
+
+@dataclass(frozen=True)
+class Principal:
+    id: str
+    name: Optional[str]
+    email: str
+    image: Optional[str]
+    google_id: str
+    # End of the latest active subscription and its plan, None without one
+    subscribed_until: Optional[datetime]
+    plan_id: Optional[str] = None
+
+    def is_subscribed(self) -> bool:
+        return (
+            self.subscribed_until is not None and self.subscribed_until > datetime.now()
+        )
+
+    def to_user(self) -> User:
+        """Detached User for the routes, with is_subscribed set"""
+        user = User(
+            id=self.id,
+            name=self.name,
+            email=self.email,
+            image=self.image,
+            google_id=self.google_id,
+        )
+        user.is_subscribed = self.is_subscribed()
+        return user
+
+
+async def load_principal(db: AsyncSession, email: str) -> Optional[Principal]:
+    """User with the given email and their entitlement, one read of the users row"""
+    row = (
+        await db.execute(
+            select(
+                User.id,
+                User.name,
+                User.email,
+                User.image,
+                User.google_id,
+                User.entitled_until.label("subscribed_until"),
+                User.entitled_plan_id.label("plan_id"),
+            ).where(User.email == email)
+        )
+    ).first()
+    return Principal(**row._mapping) if row else None
+
+
+@dataclass
+class PrincipalCache:
+    ttl_seconds: float = PRINCIPAL_CACHE_TTL_SECONDS
+    max_entries: int = PRINCIPAL_CACHE_MAX_ENTRIES
+    # (email, token id) -> (expires at, principal), least recently used first
+    _entries: "OrderedDict[Tuple[str, str], Tuple[float, Principal]]" = field(
+        default_factory=OrderedDict
+    )
+    _keys_by_user: Dict[str, Set[Tuple[str, str]]] = field(default_factory=dict)
+    _redis: Optional[Redis] = None
+
+    def get(self, email: str, token_id: str) -> Optional[Principal]:
+        key = (email, token_id)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, email: str, token_id: str, principal: Principal):
+        key = (email, token_id)
+        self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, principal)
+        self._keys_by_user.setdefault(principal.id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def discard_user(self, user_id: str):
+        """Drop the cached principals of a user in this worker"""
+        for key in self._keys_by_user.pop(user_id, ()):
+            self._entries.pop(key, None)
+
+    async def invalidate_user(self, user_id: str):
+        """Drop the cached principals of a user in every worker (after committing)"""
+        self.discard_user(user_id)
+        redis = self._client()
+        if redis is None:
+            return
+        try:
+            await redis.publish(PRINCIPAL_INVALIDATION_CHANNEL, user_id)
+        except Exception as e:
+            logger.warning(
+                "Error %s while publishing principal invalidation of %s", e, user_id
+            )
+
+    async def listen(self):
+        """Apply invalidations published by other workers, until cancelled"""
+        redis = self._client()
+        if redis is None:
+            return
+        while True:
+            try:
+                pubsub = redis.pubsub(ignore_subscribe_messages=True)
+                async with pubsub:
+                    await pubsub.subscribe(PRINCIPAL_INVALIDATION_CHANNEL)
+                    # Anything published while we were not subscribed is lost
+                    self.clear()
+                    async for message in pubsub.listen():
+                        self.discard_user(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(
+                    "Error %s while listening for principal invalidations", e
+                )
+            await asyncio.sleep(LISTEN_RETRY_SECONDS)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_user.clear()
+
+    def _remove(self, key: Tuple[str, str]):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._keys_by_user.get(entry[1].id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[entry[1].id]
+
+    def _client(self) -> Optional[Redis]:
+        if self._redis is None:
+            self._redis = create_redis()
+        return self._redis
+
+
+principal_cache = PrincipalCache()
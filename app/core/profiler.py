@@ -0,0 +1,187 @@
+#  On-demand sampling profiler of the requests of one route
+#  An admin arms it for the next N requests of a route (POST /admin/profile) in the
+#  worker that gets the call. While armed, an interval timer (ITIMER_REAL, SIGALRM)
+#  interrupts the event loop thread every interval; the signal handler runs in the
+#  context of the code it interrupted, so it records the Python stack only when that
+#  code belongs to a profiled request (profile_middleware sets a context variable,
+#  the tasks the request spawns inherit it). Stacks are counted in the folded format
+#  ("outer;...;inner count") that flamegraph.pl, inferno and speedscope read.
+#  Samples show where the requests keep the event loop busy, blocking calls
+#  included; time spent awaiting is on no stack (Server-Timing has it), and
+#  threadpool code (sync dependencies) is not sampled.
+
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Optional
+
+# Stops a profile whose route gets fewer requests than asked for
+PROFILE_MAX_SECONDS = 600
+PROFILE_MAX_DEPTH = 128
+
+# True while a profiled request is handled
+_profiled_var: ContextVar[bool] = ContextVar("profiled", default=False)
+
+
+class ProfilerUnavailable(Exception):
+    """A profile is running already, or signals can't be used in this worker"""
+
+
+@dataclass
+class Profile:
+    method: str
+    route: str
+    requests: int
+    interval_seconds: float
+    started_at: datetime = field(default_factory=datetime.now)
+    deadline: float = 0.0
+    # Requests taken for profiling, and those of them that completed
+    taken: int = 0
+    finished: int = 0
+    samples: int = 0
+    stopped: bool = False
+    stacks: Counter = field(default_factory=Counter)
+
+    def to_dict(self) -> dict:
+        return {
+            "method": self.method,
+            "route": self.route,
+            "requests": self.requests,
+            "interval_ms": self.interval_seconds * 1000,
+            "started_at": self.started_at.isoformat(),
+            "status": "done" if self.stopped else "running",
+            "profiled": self.finished,
+            "samples": self.samples,
+            "stacks": dict(self.stacks.most_common()),
+        }
+
+    def folded(self) -> str:
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.stacks.most_common()
+        )
+
+
+@dataclass
+class SamplingProfiler:
+    profile: Optional[Profile] = None
+    _previous_handler: object = None
+    # Code object -> frame label, built once per function
+    _labels: Dict[object, str] = field(default_factory=dict)
+
+    def start(
+        self,
+        method: str,
+        route: str,
+        requests: int,
+        interval_seconds: float,
+        max_seconds: float = PROFILE_MAX_SECONDS,
+    ) -> Profile:
+        """
+        Profile the next `requests` requests of a route.
+
+        Args:
+            method (str): HTTP method of the route
+            route (str): Path template of the route, e.g. /note/{note_id}
+            requests (int): Requests to profile
+            interval_seconds (float): Time between two samples
+            max_seconds (float): Stop after that long whatever the requests profiled
+
+        Raises:
+            ProfilerUnavailable: Another profile is running, or this worker can't
+                handle signals (the event loop is not in the main thread)
+        """
+        if self.profile is not None and not self.profile.stopped:
+            raise ProfilerUnavailable("A profile is running already")
+        if threading.current_thread() is not threading.main_thread():
+            raise ProfilerUnavailable("The event loop is not in the main thread")
+        if signal.getsignal(signal.SIGALRM) not in (signal.SIG_DFL, None):
+            raise ProfilerUnavailable("SIGALRM is in use")
+
+        self.profile = Profile(method.upper(), route, requests, interval_seconds)
+        self.profile.deadline = time.monotonic() + max_seconds
+        self._previous_handler = signal.signal(signal.SIGALRM, self._sample)
+        signal.setitimer(signal.ITIMER_REAL, interval_seconds, interval_seconds)
+        return self.profile
+
+    def stop(self):
+        if self.profile is None or self.profile.stopped:
+            return
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self._previous_handler or signal.SIG_DFL)
+        self.profile.stopped = True
+
+    def clear(self):
+        self.stop()
+        self.profile = None
+
+    def take(self, method: str, route: str) -> bool:
+        """Whether to profile a request of this route (then call finish after it)"""
+        profile = self.profile
+        if (
+            profile is None
+            or profile.stopped
+            or profile.taken >= profile.requests
+            or (method, route) != (profile.method, profile.route)
+        ):
+            return False
+        profile.taken += 1
+        return True
+
+    def finish(self):
+        profile = self.profile
+        if profile is None:
+            return
+        profile.finished += 1
+        if profile.finished >= profile.requests:
+            self.stop()
+
+    def _sample(self, signum, frame):
+        # Runs on the event loop thread between two bytecodes of the interrupted code
+        profile = self.profile
+        if profile is None or profile.stopped:
+            return
+        if time.monotonic() > profile.deadline:
+            self.stop()
+            return
+        if not _profiled_var.get():
+            return
+        labels = []
+        while frame is not None and len(labels) < PROFILE_MAX_DEPTH:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = _frame_label(code)
+            labels.append(label)
+            frame = frame.f_back
+        labels.reverse()
+        profile.stacks[";".join(labels)] += 1
+        profile.samples += 1
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    # Shortest path relative to sys.path, e.g. app/api/notes.py or sqlalchemy/...
+    for root in sorted(filter(None, sys.path), key=len, reverse=True):
+        if filename.startswith(root.rstrip("/") + "/"):
+            filename = filename[len(root.rstrip("/")) + 1 :]
+            break
+    # ";" separates the frames of a folded stack
+    name = code.co_qualname.replace(";", ":")
+    return f"{name} ({filename}:{code.co_firstlineno})"
+
+
+def profiled_request():
+    """Mark the current context (the request and the tasks it spawns) as profiled"""
+    return _profiled_var.set(True)
+
+
+def end_profiled_request(token):
+    _profiled_var.reset(token)
+
+
+sampling_profiler = SamplingProfiler()
@@ -0,0 +1,17 @@
+#  Redis connection settings shared by the rate limiter and the principal cache
+
+import os
+from typing import Optional
+
+from redis.asyncio import Redis
+
+# Empty to run without Redis (single worker, tests): callers fall back to
+# in-process state
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+def create_redis(**options) -> Optional[Redis]:
+    """Client for REDIS_URL (connects lazily), None when Redis is not configured"""
+    if not REDIS_URL:
+        return None
+    return Redis.from_url(REDIS_URL, decode_responses=True, **options)
@@ -4,12 +4,20 @@ from jose import jwt
 from jose.exceptions import JWTError, ExpiredSignatureError
 from fastapi import HTTPException, Depends, Request
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.database.db import get_db
+import logging
 import os
 
+from app.core.metrics import record_cache
+from app.core.principal_cache import Principal, load_principal, principal_cache
+from app.core.token_verifier import TokenVerifier, create_backend
 from app.models.models import Subscription, User
 from app.schemas.schemas import OAuthUser
+from app.utils.entitlements import refresh_entitlements
+
+logger = logging.getLogger(__name__)
 
 SECRET_KEY = os.getenv("AUTH_SECRET")
 if not SECRET_KEY:
@@ -22,9 +30,18 @@ REFRESH_TOKEN_EXPIRE_DAYS = 7 * 24 * 60  # 30 days
 if not SECRET_KEY:
     raise ValueError("AUTH_SECRET environment variable is not set")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-
-
-def create_trial_subscription(user_id: str, db: Session, trial_days: int = 15):
+# Verification backend (hmac, pyjwt or jose), the fastest available by default
+JWT_BACKEND = os.getenv("JWT_BACKEND", "")
+token_verifier = TokenVerifier(create_backend(SECRET_KEY, ALGORITHM, JWT_BACKEND))
+# Users allowed on the /admin routes, comma separated emails
+ADMIN_EMAILS = {
+    email.strip().lower()
+    for email in os.getenv("ADMIN_EMAILS", "").split(",")
+    if email.strip()
+}
+
+
+def create_trial_subscription(user_id: str, db: AsyncSession, trial_days: int = 15):
     """Create a free trial subscription for a new user"""
     try:
         # Calculate trial end date
@@ -42,16 +59,16 @@ def create_trial_subscription(user_id: str, db: Session, trial_days: int = 15):
 
         db.add(trial_subscription)
         return trial_subscription
-    except Exception as e:
-        print(f"Error creating trial subscription: {e}")
+    except Exception:
+        logger.exception("Error creating trial subscription")
         return None
 
 
 # Check if user is present or not in
-async def authenticate_user(req: OAuthUser, db: Session):
+async def authenticate_user(req: OAuthUser, db: AsyncSession):
     try:
         user_email = req.email
-        existing_user = db.query(User).filter(User.email == user_email).first()
+        existing_user = await db.scalar(select(User).where(User.email == user_email))
         is_new_user = not existing_user
 
         if is_new_user:
@@ -60,7 +77,7 @@ async def authenticate_user(req: OAuthUser, db: Session):
                 name=req.name, email=req.email, image=req.image, google_id=req.google_id
             )
             db.add(new_user)
-            db.flush()  # Get ID without committing transaction
+            await db.flush()  # Get ID without committing transaction
             user = {
                 "name": new_user.name,
                 "email": new_user.email,
@@ -70,6 +87,8 @@ async def authenticate_user(req: OAuthUser, db: Session):
 
             # Create a free trial subscription for new users
             create_trial_subscription(new_user.id, db, trial_days=15)
+            await db.flush()
+            await refresh_entitlements(db, [new_user.id])
 
             # Mark as subscribed since they have a trial
             is_subscribed = True
@@ -82,16 +101,10 @@ async def authenticate_user(req: OAuthUser, db: Session):
             }
 
             # Check if existing user has active subscription
-            subscription = (
-                db.query(Subscription)
-                .filter(
-                    Subscription.user_id == existing_user.id,
-                    Subscription.status == "active",
-                    Subscription.current_period_end > datetime.now(),
-                )
-                .first()
+            is_subscribed = (
+                existing_user.entitled_until is not None
+                and existing_user.entitled_until > datetime.now()
             )
-            is_subscribed = subscription is not None
 
         # Create tokens with subscription status
         access_token = create_token(
@@ -101,10 +114,10 @@ async def authenticate_user(req: OAuthUser, db: Session):
             user, expires_delta=REFRESH_TOKEN_EXPIRE_DAYS, subscribed=is_subscribed
         )
 
-        db.commit()
+        await db.commit()
         return {"access_token": access_token, "refresh_token": refresh_token}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -116,6 +129,8 @@ def create_token(
         "email": user["email"],
         "image": user["image"],
         "subscribed": subscribed,
+        # Token id, part of the principal cache key
+        "jti": uuid4().hex,
     }
     if expires_delta:
         expire = datetime.now(timezone.utc) + timedelta(minutes=expires_delta)
@@ -128,9 +143,7 @@ def create_token(
 
 def verify_token(token: str | None):
     try:
-        print(token)
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])  # type: ignore
-        print(payload)
+        payload = token_verifier.verify(token)  # type: ignore
         return {
             "name": payload["name"],
             "email": payload["email"],
@@ -138,13 +151,32 @@ def verify_token(token: str | None):
             "subscribed": payload.get("subscribed", False),
         }
     except ExpiredSignatureError:
-        # print("Signature error")
         raise HTTPException(status_code=401, detail="Token has expired")
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
-async def get_current_user(request: Request, db: Session = Depends(get_db)):
+async def resolve_principal(
+    db: AsyncSession, access_token: str, email: str
+) -> Principal | None:
+    """Principal of a verified access token, from the cache or loaded and cached"""
+    # Tokens issued before token ids existed are told apart by their signature
+    # (verify() again is a cache hit)
+    token_id = (
+        token_verifier.verify(access_token).get("jti")
+        or access_token.rsplit(".", 1)[-1]
+    )
+    principal = principal_cache.get(email, token_id)
+    record_cache("principal", principal is not None)
+    if principal is None:
+        # User and subscription status in one query, then cached
+        principal = await load_principal(db, email)
+        if principal:
+            principal_cache.put(email, token_id, principal)
+    return principal
+
+
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_db)):
     try:
         # Extract token from cookies instead of header
         access_token = request.cookies.get("access_token")
@@ -157,13 +189,12 @@ async def get_current_user(request: Request, db: Session = Depends(get_db)):
         if not email:
             raise HTTPException(status_code=401, detail="Invalid token")
 
-        user = db.query(User).filter(User.email == email).first()
-        if not user:
+        principal = await resolve_principal(db, access_token, email)
+        if not principal:
             raise HTTPException(status_code=404, detail="User not found")
 
-        user.is_subscribed = payload.get("subscribed", False)
-
-        return user
+        # Subscription status from the database, not the (day long) token claim
+        return principal.to_user()
 
     except ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
@@ -171,9 +202,7 @@ async def get_current_user(request: Request, db: Session = Depends(get_db)):
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
-async def get_subscribed_user(
-    current_user: User = Depends(get_current_user), db: Session = Depends(get_db)
-):
+async def get_subscribed_user(current_user: User = Depends(get_current_user)):
     """Check if user is subscribed and return the user if they are"""
     if not current_user.is_subscribed:
         raise HTTPException(
@@ -184,3 +213,10 @@ async def get_subscribed_user(
             },
         )
     return current_user
+
+
+async def get_admin_user(current_user: User = Depends(get_current_user)):
+    """Return the user if their email is one of ADMIN_EMAILS"""
+    if current_user.email.lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin only")
+    return current_user
@@ -0,0 +1,65 @@
+#  Where the time of one request went, for its Server-Timing header
+#  server_timing_middleware starts a RequestTimings for each request; tasks the
+#  request spawns share it through the context. Database time is the time between
+#  cursor execute events of the SQLAlchemy engines, upstream time (OpenAI, Pinecone,
+#  the transcript proxy) is added by metrics.stage(..., upstream=True). Concurrent
+#  calls add up, so with the note chunks summarized in parallel upstream can exceed
+#  the duration of the request.
+
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import event
+
+from app.database.db import engine, replica_engine
+
+
+@dataclass
+class RequestTimings:
+    db_seconds: float = 0.0
+    db_queries: int = 0
+    upstream_seconds: float = 0.0
+    upstream_calls: int = 0
+
+
+# Timings of the request being handled, None outside of requests
+request_timings_var: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def add_upstream(seconds: float):
+    timings = request_timings_var.get()
+    if timings is not None:
+        timings.upstream_seconds += seconds
+        timings.upstream_calls += 1
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    timings = request_timings_var.get()
+    if timings is not None:
+        timings.db_seconds += time.perf_counter() - started
+        timings.db_queries += 1
+
+
+def _handle_error(exception_context):
+    # A failed statement never reaches after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+
+for _engine in (engine, replica_engine):
+    if _engine is not None:
+        event.listen(
+            _engine.sync_engine, "before_cursor_execute", _before_cursor_execute
+        )
+        event.listen(_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(_engine.sync_engine, "handle_error", _handle_error)
@@ -0,0 +1,176 @@
+#  Verification of the access and refresh JWTs
+#  Every authenticated request verifies its token, so the claims of verified tokens
+#  are kept in an LRU keyed by the SHA-256 of the token until the token expires; a hit
+#  costs one hash instead of a signature check and two base64/JSON decodes. Misses go
+#  to a backend built once at import for the configured algorithm and key:
+#  - hmac: HS256/384/512 with the standard library, no claim checks beyond exp/nbf
+#  - pyjwt: PyJWT, when installed
+#  - jose: python-jose, any algorithm it supports
+#  Every backend raises python-jose's ExpiredSignatureError / JWTError.
+
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Tuple
+
+from jose import jwt
+from jose.exceptions import ExpiredSignatureError, JWTError
+
+from app.core.metrics import record_cache
+from app.utils.serialization import json_loads
+
+try:
+    import jwt as pyjwt
+except ImportError:  # optional backend
+    pyjwt = None
+
+VERIFIED_TOKEN_CACHE_MAX_ENTRIES = int(
+    os.getenv("VERIFIED_TOKEN_CACHE_MAX_ENTRIES", "10000")
+)
+
+_HMAC_DIGESTS = {
+    "HS256": hashlib.sha256,
+    "HS384": hashlib.sha384,
+    "HS512": hashlib.sha512,
+}
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+class JoseBackend:
+    name = "jose"
+
+    def __init__(self, key: str, algorithm: str):
+        self.key = key
+        self.algorithms = [algorithm]
+
+    def decode(self, token: str) -> dict:
+        return jwt.decode(token, self.key, algorithms=self.algorithms)
+
+
+class PyJWTBackend:
+    name = "pyjwt"
+
+    def __init__(self, key: str, algorithm: str):
+        if pyjwt is None:
+            raise ValueError("The pyjwt backend needs PyJWT installed")
+        self.key = key
+        self.algorithms = [algorithm]
+
+    def decode(self, token: str) -> dict:
+        try:
+            return pyjwt.decode(token, self.key, algorithms=self.algorithms)
+        except pyjwt.ExpiredSignatureError:
+            raise ExpiredSignatureError("Signature has expired.")
+        except pyjwt.InvalidTokenError as e:
+            raise JWTError(str(e))
+
+
+class HMACBackend:
+    name = "hmac"
+
+    def __init__(self, key: str, algorithm: str):
+        if algorithm not in _HMAC_DIGESTS:
+            raise ValueError(f"The hmac backend does not support {algorithm}")
+        self.algorithm = algorithm
+        # Keyed hash state built once, copied for every token
+        self._mac = hmac.new(key.encode(), digestmod=_HMAC_DIGESTS[algorithm])
+
+    def decode(self, token: str) -> dict:
+        try:
+            signing_input, _, signature = token.rpartition(".")
+            header_segment, _, payload_segment = signing_input.partition(".")
+            header = json_loads(_b64decode(header_segment))
+            if not isinstance(header, dict) or header.get("alg") != self.algorithm:
+                raise JWTError("The specified alg value is not allowed")
+            mac = self._mac.copy()
+            mac.update(signing_input.encode("ascii"))
+            if not hmac.compare_digest(mac.digest(), _b64decode(signature)):
+                raise JWTError("Signature verification failed.")
+            claims = json_loads(_b64decode(payload_segment))
+        except (ValueError, UnicodeEncodeError, binascii.Error):
+            raise JWTError("Error decoding token")
+        if not isinstance(claims, dict):
+            raise JWTError("Invalid payload")
+
+        now = time.time()
+        exp = claims.get("exp")
+        if exp is not None:
+            if not isinstance(exp, (int, float)):
+                raise JWTError("Expiration Time claim (exp) must be an integer.")
+            if exp <= now:
+                raise ExpiredSignatureError("Signature has expired.")
+        nbf = claims.get("nbf")
+        if nbf is not None and (not isinstance(nbf, (int, float)) or nbf > now):
+            raise JWTError("The token is not yet valid (nbf)")
+        return claims
+
+
+BACKENDS: Dict[str, Callable] = {
+    "hmac": HMACBackend,
+    "pyjwt": PyJWTBackend,
+    "jose": JoseBackend,
+}
+
+
+def create_backend(key: str, algorithm: str, name: str = ""):
+    """Backend by name, or the fastest one available for the algorithm"""
+    if name:
+        return BACKENDS[name](key, algorithm)
+    if algorithm in _HMAC_DIGESTS:
+        return HMACBackend(key, algorithm)
+    if pyjwt is not None:
+        return PyJWTBackend(key, algorithm)
+    return JoseBackend(key, algorithm)
+
+
+@dataclass
+class TokenVerifier:
+    backend: object
+    max_entries: int = VERIFIED_TOKEN_CACHE_MAX_ENTRIES
+    # SHA-256 of the token -> (exp, claims), least recently used first
+    _verified: "OrderedDict[bytes, Tuple[float, dict]]" = field(
+        default_factory=OrderedDict
+    )
+
+    def verify(self, token: str) -> dict:
+        """
+        Claims of a token, verifying its signature unless it was verified before.
+
+        Args:
+            token (str): Encoded JWT
+
+        Returns:
+            dict: Claims of the token, not to be modified
+
+        Raises:
+            ExpiredSignatureError: The token has expired
+            JWTError: The token is invalid
+        """
+        if not isinstance(token, str):
+            raise JWTError("Invalid token")
+        key = hashlib.sha256(token.encode()).digest()
+        entry = self._verified.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self._verified.move_to_end(key)
+                record_cache("verified_token", True)
+                return entry[1]
+            del self._verified[key]
+
+        record_cache("verified_token", False)
+        claims = self.backend.decode(token)
+        exp = claims.get("exp")
+        # Only tokens that expire are cached, for as long as they are valid
+        if isinstance(exp, (int, float)):
+            self._verified[key] = (exp, claims)
+            while len(self._verified) > self.max_entries:
+                self._verified.popitem(last=False)
+        return claims
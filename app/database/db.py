@@ -1,8 +1,16 @@
+import logging
 import os
+import time
+from typing import Dict
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
+from app.utils.serialization import json_dumps, json_loads
+
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 
 # Get database URL with a fallback
@@ -12,16 +20,134 @@ DATABASE_URI = os.getenv("DATABASE_URI")
 if not DATABASE_URI:
     raise ValueError("DATABASE_URL environment variable is not set")
 
+# Optional read replica used by read-only endpoints
+DATABASE_REPLICA_URI = os.getenv("DATABASE_REPLICA_URI")
+
+# Engine settings, all overridable from the environment
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds
+DB_CONNECT_TIMEOUT = float(os.getenv("DB_CONNECT_TIMEOUT", "5"))  # seconds
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+# How long the replica is skipped after a failed connection
+DB_REPLICA_RETRY_SECONDS = float(os.getenv("DB_REPLICA_RETRY_SECONDS", "30"))
+# How long reads of a row written by this worker go to the primary; longer than the
+# replica lag, so a client reading back its write never gets the old row
+DB_REPLICA_LAG_SECONDS = float(os.getenv("DB_REPLICA_LAG_SECONDS", "5"))
+
+
+def to_async_url(uri: str):
+    """Same database over asyncpg (DATABASE_URI stays the psycopg2 URL for Alembic)"""
+    url = make_url(uri)
+    query = dict(url.query)
+    # asyncpg spells libpq's sslmode as ssl and has no channel_binding option
+    sslmode = query.pop("sslmode", None)
+    query.pop("channel_binding", None)
+    if sslmode:
+        query["ssl"] = sslmode
+    return url.set(drivername="postgresql+asyncpg", query=query)
+
 
-engine  = create_engine(DATABASE_URI,echo= True,pool_pre_ping=True)
-SessionLocal = sessionmaker(bind = engine, autocommit = False, autoflush = False)
+def create_db_engine(uri: str):
+    return create_async_engine(
+        to_async_url(uri),
+        echo=DB_ECHO,
+        pool_pre_ping=True,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        json_serializer=json_dumps,
+        json_deserializer=json_loads,
+        connect_args={
+            "timeout": DB_CONNECT_TIMEOUT,
+            "server_settings": {
+                "statement_timeout": str(DB_STATEMENT_TIMEOUT_MS),
+                "application_name": "backyt",
+            },
+        },
+    )
+
+
+engine = create_db_engine(DATABASE_URI)
+replica_engine = (
+    create_db_engine(DATABASE_REPLICA_URI) if DATABASE_REPLICA_URI else None
+)
+
+# expire_on_commit=False: attributes can't be lazily reloaded after commit in async code
+SessionLocal = async_sessionmaker(
+    bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
+ReadSessionLocal = async_sessionmaker(
+    bind=replica_engine or engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
 
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+_replica_down_until = 0.0
+# Key of a row written recently -> until when its reads go to the primary
+_written_until: Dict[str, float] = {}
+_WRITTEN_MAX_KEYS = 100000
+
+
+def mark_written(key: str):
+    """Read `key` (e.g. "file:<id>") from the primary for DB_REPLICA_LAG_SECONDS"""
+    now = time.monotonic()
+    if len(_written_until) >= _WRITTEN_MAX_KEYS:
+        for expired in [k for k, until in _written_until.items() if until <= now]:
+            del _written_until[expired]
+    _written_until[key] = now + DB_REPLICA_LAG_SECONDS
+
+
+def recently_written(key: str) -> bool:
+    until = _written_until.get(key)
+    if until is None:
+        return False
+    if until <= time.monotonic():
+        del _written_until[key]
+        return False
+    return True
+
+
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
+
+
+async def _read_session() -> AsyncSession:
+    """Connected replica session if set and up, else a primary session"""
+    global _replica_down_until
+    if replica_engine is not None and time.monotonic() >= _replica_down_until:
+        db = ReadSessionLocal()
+        try:
+            await db.connection()
+            return db
+        except (DBAPIError, OSError) as e:
+            await db.close()
+            logger.warning("Read replica unavailable, using primary: %s", e)
+            _replica_down_until = time.monotonic() + DB_REPLICA_RETRY_SECONDS
+    return SessionLocal()
+
+
+async def get_read_db():
+    """Session for read-only endpoints: the replica if set and up, else the primary"""
+    async with await _read_session() as db:
         yield db
-    finally:
-        db.close()
 
+
+async def read_session_for(key: str) -> AsyncSession:
+    """_read_session, but the primary while `key` is marked written"""
+    if recently_written(key):
+        return SessionLocal()
+    return await _read_session()
+
+
+async def get_note_read_db(note_id: str):
+    """get_read_db for GET /note/{note_id}, the primary while the file is fresh"""
+    async with await read_session_for(f"file:{note_id}") as db:
+        yield db
@@ -1,25 +1,70 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import uvicorn
 import os
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
+from app.api.admin import admin_router
 from app.api.subscription import subscription_router
 from app.api.folder import folder_router
+from app.api.bulk import bulk_router
+from app.api.metrics import metrics_router
 from app.core.auth import auth_router
+from app.core.principal_cache import principal_cache
+from app.core.profiler import sampling_profiler
 from app.api.notes import note_router
+from app.utils.autosave import autosave_buffer
+from app.utils.entitlements import subscription_sweeper
+from app.utils.paddle_events import paddle_event_consumer
 
-# from app.middlewares.middleware import rate_limit_middleware
+from app.core.log import configure_logging, stop_logging
+from app.middlewares.metrics import metrics_middleware
+from app.middlewares.middleware import rate_limit_middleware
+from app.middlewares.profiler import profile_middleware
+from app.middlewares.request_id import request_id_middleware
+from app.middlewares.server_timing import server_timing_middleware
 
 load_dotenv()
-app = FastAPI()
+configure_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Subscription changes made by other workers drop our cached principals
+    invalidations = asyncio.create_task(principal_cache.listen())
+    # Paddle webhook events are stored by the route and applied in the background
+    paddle_events = asyncio.create_task(paddle_event_consumer.run())
+    # Lapsed subscriptions (trials above all) are expired in bulk
+    sweeper = asyncio.create_task(subscription_sweeper.run())
+    yield
+    invalidations.cancel()
+    paddle_events.cancel()
+    sweeper.cancel()
+    # Write buffered note autosaves before the worker exits
+    await autosave_buffer.flush_all()
+    sampling_profiler.clear()
+    stop_logging()
+
+
+app = FastAPI(lifespan=lifespan)
 port = os.getenv("PORT")
 
 
-# app.middleware("http")(rate_limit_middleware)
+# Innermost: only requests past the rate limiter are profiled
+app.middleware("http")(profile_middleware)
+app.middleware("http")(rate_limit_middleware)
+# Outside the rate limiter: rejected requests get an id and a log line too
+app.middleware("http")(request_id_middleware)
+app.middleware("http")(metrics_middleware)
+app.middleware("http")(server_timing_middleware)
 app.include_router(auth_router, tags=["Auth router"])
 app.include_router(note_router, tags=["Note router"])
 app.include_router(folder_router, tags=["Folder router"])
+app.include_router(bulk_router, tags=["Bulk router"])
 app.include_router(subscription_router, tags=["subscriptions"])
+app.include_router(metrics_router)
+app.include_router(admin_router, tags=["Admin"])
 # cors middleware
 app.add_middleware(
     CORSMiddleware,
@@ -39,4 +84,5 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,  # for production Comment this line
+        log_config=None,  # keep the handlers of app.core.log
     )
@@ -0,0 +1,23 @@
+#  Latency of every request, by route template (/note/{file_id}, not the file id)
+#  Requests that match no route share the "unmatched" label so scans of random paths
+#  can't create new series.
+
+import time
+
+from fastapi import Request
+
+from app.core.metrics import observe_request
+
+
+async def metrics_middleware(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Set by the router on the request scope once a route matched
+    route = request.scope.get("route")
+    observe_request(
+        request.method,
+        route.path if route is not None else "unmatched",
+        response.status_code,
+        time.perf_counter() - started,
+    )
+    return response
@@ -1,52 +1,251 @@
-from fastapi import Request, HTTPException
+#  Token-bucket rate limiting per user and plan
+#  Every client has one bucket of RATE_LIMITS[plan].capacity tokens refilled at
+#  refill_per_second; a request takes ROUTE_COSTS tokens (1 by default) or is answered
+#  429 with Retry-After. Signed-in users are limited per user id at the rate of their
+#  plan, anonymous requests per client IP. Buckets live in Redis, refilled and taken
+#  from by one Lua script (one atomic round trip) so every worker shares them; while
+#  Redis is unreachable each worker limits with its own in-process buckets instead.
+#  Behind a reverse proxy the client IP comes from X-Forwarded-For, read only through
+#  the hops listed in FORWARDED_ALLOW_IPS: set it to the proxy addresses (or run
+#  uvicorn with --proxy-headers --forwarded-allow-ips), otherwise every anonymous
+#  client is the proxy and shares one bucket.
+
+import ipaddress
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, NamedTuple, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from jose.exceptions import JWTError
 from redis.asyncio import Redis
 
-# Create async Redis client
-redis_client = Redis(host="localhost", port=6379, db=0, decode_responses=True)
+from app.core.principal_cache import Principal
+from app.core.redis_client import create_redis
+from app.core.security import resolve_principal, token_verifier
+from app.database.db import SessionLocal
 
+logger = logging.getLogger(__name__)
 
-async def rate_limit_middleware(request: Request, call_next):
-    try:
-        # Get client IP with fallback for when client is None
-        client_ip = None
-        if request.client:
-            client_ip = request.client.host
-        else:
-            # Use a default or header-based IP if client is None
-            client_ip = request.headers.get("X-Forwarded-For", "unknown")
-
-        # Create rate limit key based on path and IP
-        route = request.url.path
-        key = f"ratelimit:{client_ip}:{route}"
-
-        # Check if rate limited (use proper await with async Redis)
-        requests = await redis_client.get(key)
-
-        # Set limits based on route
-        if route == "/auth/refresh":
-            limit = 20  # 20 requests
-            period = 60  # per minute
-        elif route.startswith("/auth"):
-            limit = 10  # 10 requests
-            period = 60  # per minute
+
+class RateLimit(NamedTuple):
+    capacity: int  # burst size, in tokens
+    refill_per_second: float
+
+
+RATE_LIMITS = {
+    "anonymous": RateLimit(capacity=30, refill_per_second=0.5),
+    "free": RateLimit(capacity=60, refill_per_second=1),
+    "trial": RateLimit(capacity=120, refill_per_second=2),
+    "subscribed": RateLimit(capacity=300, refill_per_second=5),
+}
+# Generating a note (transcript + LLM) and asking about one cost more than a plain
+# request
+ROUTE_COSTS = {
+    ("POST", "/note"): 20,
+    ("POST", "/note/ask"): 5,
+}
+# Paddle retries webhooks it gets a 429 for, they are never limited; neither are scrapes
+EXEMPT_PATHS = {"/webhook/paddle", "/metrics"}
+
+# Short timeouts: a slow Redis must not slow every request down
+RATE_LIMIT_REDIS_TIMEOUT = float(
+    os.getenv("RATE_LIMIT_REDIS_TIMEOUT", "0.25")
+)  # seconds
+# How long Redis is skipped after a failed call
+RATE_LIMIT_REDIS_RETRY_SECONDS = float(
+    os.getenv("RATE_LIMIT_REDIS_RETRY_SECONDS", "30")
+)
+# Clients tracked by the in-process fallback, least recently seen dropped first
+RATE_LIMIT_LOCAL_MAX_KEYS = int(os.getenv("RATE_LIMIT_LOCAL_MAX_KEYS", "100000"))
+
+# Proxies whose X-Forwarded-For is trusted, comma separated addresses or networks
+FORWARDED_ALLOW_IPS = [
+    ipaddress.ip_network(entry.strip(), strict=False)
+    for entry in os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1,::1").split(",")
+    if entry.strip()
+]
+
+# KEYS[1]: bucket; ARGV: capacity, refill per second, cost
+# Returns {allowed (0/1), milliseconds until the cost is available (0 if allowed)}
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1])
+local ts = tonumber(bucket[2])
+if tokens == nil or ts == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = math.ceil((cost - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+-- A bucket left alone that long is full again, no need to keep it
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate))
+return {allowed, retry_after}
+"""
+
+
+@dataclass
+class LocalTokenBuckets:
+    """Same algorithm as TOKEN_BUCKET_SCRIPT, in this worker only"""
+
+    max_keys: int = RATE_LIMIT_LOCAL_MAX_KEYS
+    # key -> (tokens, last refill), least recently used first
+    _buckets: "OrderedDict[str, Tuple[float, float]]" = field(
+        default_factory=OrderedDict
+    )
+
+    def take(self, key: str, limit: RateLimit, cost: int) -> Tuple[bool, float]:
+        now = time.monotonic()
+        tokens, ts = self._buckets.pop(key, (limit.capacity, now))
+        tokens = min(limit.capacity, tokens + (now - ts) * limit.refill_per_second)
+        if tokens >= cost:
+            allowed, retry_after = True, 0.0
+            tokens -= cost
         else:
-            limit = 100  # 100 requests
-            period = 60  # per minute
-
-        if requests and int(requests) > limit:
-            raise HTTPException(status_code=429, detail="Rate limit exceeded")
-
-        # Use transaction for atomic operations
-        async with redis_client.pipeline(transaction=True) as pipe:
-            await pipe.incr(key)
-            await pipe.expire(key, period)
-            await pipe.execute()  # This returns a list, don't await the result
-
-        # Process the request
-        response = await call_next(request)
-        return response
-    except Exception as e:
-        # Log the error
-        print(f"Rate limit middleware error: {e}")
-        # Allow the request to proceed even if rate limiting fails
+            allowed = False
+            retry_after = (cost - tokens) / limit.refill_per_second
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+
+@dataclass
+class RateLimiter:
+    local: LocalTokenBuckets = field(default_factory=LocalTokenBuckets)
+    _redis: Optional[Redis] = None
+    _script: object = None
+    _redis_down_until: float = 0.0
+
+    async def take(self, key: str, limit: RateLimit, cost: int) -> Tuple[bool, float]:
+        """
+        Take `cost` tokens from the bucket of `key` if it holds that many.
+
+        Returns:
+            Tuple[bool, float]: Whether the request is allowed, and if not the seconds
+            until it would be
+        """
+        script = self._bucket_script()
+        if script is not None and time.monotonic() >= self._redis_down_until:
+            try:
+                allowed, retry_after_ms = await script(
+                    keys=[f"ratelimit:{key}"],
+                    args=[limit.capacity, limit.refill_per_second, cost],
+                )
+                return bool(allowed), int(retry_after_ms) / 1000
+            except Exception as e:
+                logger.warning("Redis unavailable, rate limiting in process: %s", e)
+                self._redis_down_until = (
+                    time.monotonic() + RATE_LIMIT_REDIS_RETRY_SECONDS
+                )
+        return self.local.take(key, limit, cost)
+
+    def _bucket_script(self):
+        # Registered once, then run with EVALSHA (EVAL again if Redis lost it)
+        if self._script is None:
+            self._redis = create_redis(
+                socket_timeout=RATE_LIMIT_REDIS_TIMEOUT,
+                socket_connect_timeout=RATE_LIMIT_REDIS_TIMEOUT,
+            )
+            if self._redis is not None:
+                self._script = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+        return self._script
+
+
+rate_limiter = RateLimiter()
+
+
+def plan_of(principal: Optional[Principal]) -> str:
+    """RATE_LIMITS entry of a signed-in user (same trial/paid split as /status)"""
+    if principal is None or not principal.is_subscribed():
+        return "free"
+    if principal.plan_id == "trial":
+        return "trial"
+    return "subscribed"
+
+
+def _trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in FORWARDED_ALLOW_IPS)
+
+
+def client_ip(request: Request) -> str:
+    """
+    Address of the client: the peer, or behind trusted proxies the last address of
+    X-Forwarded-For that is not one of them (the earlier ones are client-supplied).
+    """
+    address = request.client.host if request.client else "unknown"
+    if not _trusted_proxy(address):
+        return address
+    hops: List[str] = [
+        hop.strip()
+        for header in request.headers.getlist("X-Forwarded-For")
+        for hop in header.split(",")
+        if hop.strip()
+    ]
+    for hop in reversed(hops):
+        address = hop
+        if not _trusted_proxy(hop):
+            break
+    return address
+
+
+async def rate_limit_key(request: Request) -> Tuple[str, str]:
+    """(bucket key, plan) of the request: its user and plan if signed in, else its IP"""
+    access_token = request.cookies.get("access_token")
+    if access_token:
+        try:
+            email = token_verifier.verify(access_token).get("email")
+        except JWTError:
+            email = None
+        if email:
+            try:
+                # Usually a principal cache hit, the session is then never connected
+                async with SessionLocal() as db:
+                    principal = await resolve_principal(db, access_token, email)
+            except Exception as e:
+                logger.warning("Error %s while resolving the plan, limiting as free", e)
+                return f"free:email:{email}", "free"
+            if principal is not None:
+                plan = plan_of(principal)
+                # A plan change starts from a full bucket of the new plan
+                return f"{plan}:user:{principal.id}", plan
+    return f"anonymous:ip:{client_ip(request)}", "anonymous"
+
+
+async def rate_limit_middleware(request: Request, call_next):
+    if request.url.path in EXEMPT_PATHS:
         return await call_next(request)
+
+    key, plan = await rate_limit_key(request)
+    cost = ROUTE_COSTS.get((request.method, request.url.path), 1)
+    allowed, retry_after = await rate_limiter.take(key, RATE_LIMITS[plan], cost)
+    if not allowed:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "Rate limit exceeded"},
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+    return await call_next(request)
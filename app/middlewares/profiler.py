@@ -0,0 +1,31 @@
+#  Hands the requests of the route being profiled to the sampling profiler
+#  (app.core.profiler); nothing but one attribute check while no profile runs.
+
+from fastapi import Request
+from starlette.routing import Match
+
+from app.core.profiler import end_profiled_request, profiled_request, sampling_profiler
+
+
+def route_template(request: Request) -> str:
+    """Path template of the route a request will be handled by, "" if none"""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return ""
+
+
+async def profile_middleware(request: Request, call_next):
+    profile = sampling_profiler.profile
+    if profile is None or profile.stopped:
+        return await call_next(request)
+    if not sampling_profiler.take(request.method, route_template(request)):
+        return await call_next(request)
+
+    token = profiled_request()
+    try:
+        return await call_next(request)
+    finally:
+        end_profiled_request(token)
+        sampling_profiler.finish()
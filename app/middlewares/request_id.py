@@ -0,0 +1,47 @@
+#  Request ids and one structured log line per request
+#  The id comes from the X-Request-ID header when a proxy in front set a sane one,
+#  else it is generated; it is echoed in the response and attached to every record
+#  logged while the request is handled (app.core.log.request_id_var).
+
+import logging
+import re
+import time
+from uuid import uuid4
+
+from fastapi import Request
+
+from app.core.log import request_id_var
+
+logger = logging.getLogger(__name__)
+
+_REQUEST_ID = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+
+async def request_id_middleware(request: Request, call_next):
+    request_id = request.headers.get("X-Request-ID", "")
+    if not _REQUEST_ID.fullmatch(request_id):
+        request_id = uuid4().hex
+    token = request_id_var.set(request_id)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+        logger.info(
+            "%s %s %s",
+            request.method,
+            request.url.path,
+            response.status_code,
+            extra={
+                "status": response.status_code,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            },
+        )
+    except Exception:
+        logger.exception(
+            "Unhandled error",
+            extra={"method": request.method, "path": request.url.path},
+        )
+        raise
+    finally:
+        request_id_var.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
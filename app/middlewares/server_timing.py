@@ -0,0 +1,49 @@
+#  Server-Timing header on every response (shown per request by browser devtools)
+#    db        time in database queries, with their count
+#    upstream  time waiting on OpenAI, Pinecone and the transcript proxy
+#    cpu       CPU time of the event loop thread while the request ran; other
+#              requests handled meanwhile count too, so it is exact only when alone
+#    app       the rest: our own code and waiting for the event loop
+#    total     wall time in the app, from this middleware
+#  SERVER_TIMING=false leaves the header out.
+
+import os
+import time
+
+from fastapi import Request
+
+from app.core.timing import RequestTimings, request_timings_var
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "true").lower() in ("1", "true", "yes")
+
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}"
+
+
+async def server_timing_middleware(request: Request, call_next):
+    if not SERVER_TIMING:
+        return await call_next(request)
+
+    timings = RequestTimings()
+    token = request_timings_var.set(timings)
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+    try:
+        response = await call_next(request)
+    finally:
+        request_timings_var.reset(token)
+    total = time.perf_counter() - started
+    cpu = time.thread_time() - cpu_started
+    app = max(0.0, total - timings.db_seconds - timings.upstream_seconds)
+    response.headers["Server-Timing"] = ", ".join(
+        (
+            f'db;dur={_ms(timings.db_seconds)};desc="{timings.db_queries} queries"',
+            f"upstream;dur={_ms(timings.upstream_seconds)}"
+            f';desc="{timings.upstream_calls} calls"',
+            f"cpu;dur={_ms(cpu)}",
+            f"app;dur={_ms(app)}",
+            f"total;dur={_ms(total)}",
+        )
+    )
+    return response
@@ -1,18 +1,29 @@
 from datetime import datetime
 from uuid import uuid4
-from sqlalchemy import UUID
+from sqlalchemy import DDL, UUID, event
 from typing import Optional, List
 from sqlalchemy import (
+    Computed,
     String,
     DateTime,
     ForeignKey,
+    Index,
+    Integer,
     Text,
     Boolean,
+    text,
 )
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
 from app.database.db import Base
 
+# Text search configuration of the search_vector columns, queries must use the same
+SEARCH_CONFIG = "english"
+# Note text as indexed. The default parser reads <...> as HTML tags and skips
+# everything between <script> and </script>, which notes about code do contain.
+SEARCH_TEXT = "translate(coalesce(content_text, ''), '<>&', '   ')"
+
 
 # User Model
 class User(Base):
@@ -25,6 +36,14 @@ class User(Base):
     email: Mapped[str] = mapped_column(String(255), nullable=False, unique=True)
     image: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
     google_id: Mapped[str] = mapped_column(String(255), unique=True)
+    # Bumped by every folder/file change, keys the cached GET /folder tree
+    tree_version: Mapped[int] = mapped_column(
+        Integer, nullable=False, server_default="0"
+    )
+    # End and plan of the latest active subscription, NULL without one
+    # (app.utils.entitlements.refresh_entitlements keeps them up to date)
+    entitled_until: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    entitled_plan_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     created_at: Mapped[datetime] = mapped_column(
         DateTime, nullable=False, server_default=func.current_timestamp()
     )
@@ -37,10 +56,16 @@ class User(Base):
 
     # Relationships
     folders: Mapped[List["Folder"]] = relationship(
-        "Folder", back_populates="user", cascade="all, delete-orphan"
+        "Folder",
+        back_populates="user",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
     )
     files: Mapped[List["File"]] = relationship(
-        "File", back_populates="user", cascade="all, delete-orphan"
+        "File",
+        back_populates="user",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
     )
     subscriptions: Mapped["Subscription"] = relationship(
         "Subscription", back_populates="user", cascade="all, delete-orphan"
@@ -50,6 +75,12 @@ class User(Base):
 # Folder Model
 class Folder(Base):
     __tablename__ = "folders"
+    __table_args__ = (
+        # Sibling name checks and the folder tree of a user
+        Index("ix_folders_user_parent_name", "user_id", "parent_id", "name"),
+        # Paginated children of a folder, also serves ON DELETE CASCADE from the parent
+        Index("ix_folders_parent_name_id", "parent_id", "name", "id"),
+    )
 
     id: Mapped[UUID] = mapped_column(
         UUID(as_uuid=True), primary_key=True, default=uuid4
@@ -71,25 +102,85 @@ class Folder(Base):
         onupdate=func.current_timestamp(),
     )
 
+    # Subfolders and files are removed by ON DELETE CASCADE, never loaded to be deleted
     parent: Mapped[Optional["Folder"]] = relationship("Folder", remote_side=[id])
     subfolders: Mapped[List["Folder"]] = relationship(
-        "Folder", back_populates="parent", cascade="all, delete-orphan"
+        "Folder",
+        back_populates="parent",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
     )
     user: Mapped["User"] = relationship("User", back_populates="folders")
     files: Mapped[List["File"]] = relationship(
-        "File", back_populates="folder", cascade="all, delete-orphan"
+        "File",
+        back_populates="folder",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+
+# Folder hierarchy as a closure table: one row per (ancestor, descendant) pair,
+# including each folder with itself at depth 0
+class FolderClosure(Base):
+    __tablename__ = "folder_closure"
+    __table_args__ = (
+        # Ancestors of a folder (cycle checks, moves)
+        Index("ix_folder_closure_descendant", "descendant_id", "depth"),
+        # Descendants of a folder down to a depth (depth limited tree)
+        Index(
+            "ix_folder_closure_ancestor_depth", "ancestor_id", "depth", "descendant_id"
+        ),
+    )
+
+    ancestor_id: Mapped[UUID] = mapped_column(
+        UUID(as_uuid=True),
+        ForeignKey("folders.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    descendant_id: Mapped[UUID] = mapped_column(
+        UUID(as_uuid=True),
+        ForeignKey("folders.id", ondelete="CASCADE"),
+        primary_key=True,
     )
+    depth: Mapped[int] = mapped_column(Integer, nullable=False)
 
 
 # File Model
 class File(Base):
     __tablename__ = "files"
+    __table_args__ = (
+        # Duplicate name checks within a folder
+        Index("ix_files_user_folder_name", "user_id", "folder_id", "name"),
+        # Ownership check of a video for /note/ask
+        Index("ix_files_user_video", "user_id", "video_id"),
+        # Paginated files of a folder, also serves ON DELETE CASCADE from the folder
+        Index("ix_files_folder_name_id", "folder_id", "name", "id"),
+        # Full-text search of /notes/search
+        Index("ix_files_search_vector", "search_vector", postgresql_using="gin"),
+    )
 
     id: Mapped[UUID] = mapped_column(
         UUID(as_uuid=True), primary_key=True, default=uuid4
     )
     name: Mapped[str] = mapped_column(String(255), nullable=False)
-    content: Mapped[str] = mapped_column(Text)  # Maybe it will be json for Quill
+    # Quill delta, NULL while the file still shares the content of the video's Note
+    # Deferred: only GET/PATCH /note need it, undefer or select it explicitly there
+    content: Mapped[Optional[dict]] = mapped_column(JSONB, nullable=True, deferred=True)
+    # Plain text of content (app.utils.delta.plain_text), NULL along with it
+    content_text: Mapped[Optional[str]] = mapped_column(
+        Text, nullable=True, deferred=True
+    )
+    # Name and own text, kept by Postgres; shared files match on their Note's vector
+    search_vector = mapped_column(
+        TSVECTOR,
+        Computed(
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', name), 'A') || "
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', {SEARCH_TEXT}), 'B')",
+            persisted=True,
+        ),
+        deferred=True,
+    )
+    version: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
     video_id: Mapped[str] = mapped_column(String)
     folder_id: Mapped[UUID] = mapped_column(
         UUID(as_uuid=True), ForeignKey("folders.id", ondelete="CASCADE"), nullable=False
@@ -111,9 +202,40 @@ class File(Base):
     user: Mapped["User"] = relationship("User", back_populates="files")
 
 
+# Recent changes applied to a file, used to transform patches made on an older version
+class FileChange(Base):
+    __tablename__ = "file_changes"
+
+    file_id: Mapped[UUID] = mapped_column(
+        UUID(as_uuid=True),
+        ForeignKey("files.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    version: Mapped[int] = mapped_column(Integer, primary_key=True)
+    delta: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, server_default=func.current_timestamp()
+    )
+
+
 # Subscription Model
 class Subscription(Base):
     __tablename__ = "subscriptions"
+    __table_args__ = (
+        # Active subscription lookup on every subscribed request
+        Index(
+            "ix_subscriptions_user_status_period_end",
+            "user_id",
+            "status",
+            "current_period_end",
+        ),
+        # Lapsed subscriptions for the expiry sweeper
+        Index(
+            "ix_subscriptions_active_period_end",
+            "current_period_end",
+            postgresql_where=text("status = 'active'"),
+        ),
+    )
 
     id: Mapped[UUID] = mapped_column(
         UUID(as_uuid=True), primary_key=True, default=uuid4
@@ -127,7 +249,7 @@ class Subscription(Base):
     plan_id: Mapped[str] = mapped_column(String(255), nullable=False)
     status: Mapped[str] = mapped_column(
         String, default="active"
-    )  # active, cancelled, paused
+    )  # active, canceled, expired, past_due, paused
     start_date: Mapped[datetime] = mapped_column(
         DateTime, server_default=func.current_timestamp()
     )
@@ -151,16 +273,128 @@ class Subscription(Base):
     )
 
 
+# Paddle webhook events, stored on receipt and applied by app.utils.paddle_events.
+# The event id primary key makes redelivered events no-ops.
+class PaddleEvent(Base):
+    __tablename__ = "paddle_events"
+    __table_args__ = (
+        # Pending events of a subscription in order, what the consumer scans
+        Index(
+            "ix_paddle_events_pending",
+            "subscription_key",
+            "occurred_at",
+            postgresql_where=text("processed_at IS NULL"),
+        ),
+    )
+
+    event_id: Mapped[str] = mapped_column(String(64), primary_key=True)
+    event_type: Mapped[str] = mapped_column(String(64), nullable=False)
+    # Paddle subscription the event is about, events of one key are applied in
+    # occurred_at order; the event id itself for events about no subscription
+    subscription_key: Mapped[str] = mapped_column(String(64), nullable=False)
+    occurred_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    payload: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    received_at: Mapped[datetime] = mapped_column(
+        DateTime, nullable=False, server_default=func.current_timestamp()
+    )
+    processed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+
+
 # Notes
 class Note(Base):
     __tablename__ = "notes"
+    __table_args__ = (
+        # One shared note per video
+        Index("uq_notes_video_id", "video_id", unique=True),
+        # Full-text search of the files sharing the note
+        Index("ix_notes_search_vector", "search_vector", postgresql_using="gin"),
+    )
 
     id: Mapped[UUID] = mapped_column(
         UUID(as_uuid=True), primary_key=True, default=uuid4
     )
-    content: Mapped[str] = mapped_column(Text, nullable=False)
+    # Large columns are deferred, lookups by video_id select what they need
+    content: Mapped[dict] = mapped_column(
+        JSONB, nullable=False, deferred=True
+    )  # Quill delta
+    # Plain text of content (app.utils.delta.plain_text)
+    content_text: Mapped[Optional[str]] = mapped_column(
+        Text, nullable=True, deferred=True
+    )
+    search_vector = mapped_column(
+        TSVECTOR,
+        Computed(
+            f"setweight(to_tsvector('{SEARCH_CONFIG}', {SEARCH_TEXT}), 'B')",
+            persisted=True,
+        ),
+        deferred=True,
+    )
     video_id: Mapped[str] = mapped_column(String(11), nullable=False)
-    transcript: Mapped["str"] = mapped_column(Text, nullable=True)
+    transcript: Mapped["str"] = mapped_column(Text, nullable=True, deferred=True)
     created_at: Mapped[datetime] = mapped_column(
         DateTime, server_default=func.current_timestamp()
     )
+
+
+# Nested GET /folder tree of a user built in Postgres, level by level from the
+# leaves up, so the response never goes through ORM rows or Python dicts.
+# Created with the tables here and by alembic revision b5e9f1c7d842.
+FOLDER_TREE_JSON_FUNCTION = """
+CREATE OR REPLACE FUNCTION folder_tree_json(p_user_id varchar) RETURNS json
+LANGUAGE plpgsql STABLE AS $$
+DECLARE
+    -- Folder ids of the user level by level, level k is ids[bounds[k] + 1 : bounds[k + 1]]
+    ids uuid[] := '{}';
+    bounds int[] := '{0}';
+    level_ids uuid[];
+    -- Finished subfolder lists of the level below and the folder they belong to
+    parent_ids uuid[];
+    subfolder_lists json[];
+    roots json;
+BEGIN
+    SELECT array_agg(id) INTO level_ids
+    FROM folders WHERE user_id = p_user_id AND parent_id IS NULL;
+    WHILE level_ids IS NOT NULL LOOP
+        ids := ids || level_ids;
+        bounds := bounds || cardinality(ids);
+        SELECT array_agg(id) INTO level_ids
+        FROM folders WHERE parent_id = ANY(level_ids) AND user_id = p_user_id;
+    END LOOP;
+
+    FOR level IN REVERSE cardinality(bounds) - 1 .. 1 LOOP
+        SELECT array_agg(parent_id), array_agg(subfolders)
+        INTO parent_ids, subfolder_lists
+        FROM (
+            SELECT f.parent_id, json_agg(json_build_object(
+                       'id', f.id,
+                       'name', f.name,
+                       'parent_id', f.parent_id,
+                       'subfolders', coalesce(children.subfolders, '[]'),
+                       'files', coalesce(folder_files.files, '[]')
+                   ) ORDER BY f.name, f.id) AS subfolders
+            FROM folders f
+            LEFT JOIN unnest(parent_ids, subfolder_lists) AS children (id, subfolders)
+                ON children.id = f.id
+            LEFT JOIN (
+                SELECT folder_id, json_agg(json_build_object(
+                           'id', id, 'name', name, 'video_id', video_id, 'folder_id', folder_id
+                       ) ORDER BY name, id) AS files
+                FROM files
+                WHERE folder_id = ANY(ids[bounds[level] + 1 : bounds[level + 1]])
+                GROUP BY folder_id
+            ) folder_files ON folder_files.folder_id = f.id
+            WHERE f.id = ANY(ids[bounds[level] + 1 : bounds[level + 1]])
+            GROUP BY f.parent_id
+        ) grouped;
+    END LOOP;
+
+    -- Roots are the only group of the last level
+    SELECT subfolders INTO roots
+    FROM unnest(parent_ids, subfolder_lists) AS children (id, subfolders);
+    RETURN json_build_object('folders', coalesce(roots, '[]'));
+END
+$$;
+"""
+event.listen(Base.metadata, "after_create", DDL(FOLDER_TREE_JSON_FUNCTION))
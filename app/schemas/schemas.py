@@ -1,6 +1,6 @@
 from enum import Enum
 from pydantic import BaseModel, EmailStr, Field
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 
 class OAuthUser(BaseModel):
@@ -54,6 +54,11 @@ class FolderRename(BaseModel):
     folder_id: str
 
 
+class FolderMove(BaseModel):
+    folder_id: str
+    new_parent_id: Optional[str] = None  # None moves the folder to the root level
+
+
 class FileResponse(BaseModel):
     id: str
     name: str
@@ -79,6 +84,31 @@ class FolderTreeResponse(BaseModel):
     folders: List[FolderResponse]
 
 
+class FolderNode(BaseModel):
+    id: str
+    name: str
+    parent_id: Optional[str] = None
+    has_children: bool  # subfolders or files, lets the client show an expander
+
+
+class FolderChildrenResponse(BaseModel):
+    folders: List[FolderNode]
+    next_cursor: Optional[str] = None
+
+
+class FolderFilesResponse(BaseModel):
+    files: List[FileResponse]
+    next_cursor: Optional[str] = None
+
+
+class FolderDepthNode(FolderNode):
+    subfolders: List["FolderDepthNode"] = []
+
+
+class FolderDepthTreeResponse(BaseModel):
+    folders: List[FolderDepthNode]
+
+
 class FolderCreate(BaseModel):
     id: str
     name: str
@@ -109,10 +139,11 @@ class ChatDetail(BaseModel):
 
 class NewNote(BaseModel):
     id: str
-    content: str
+    content: dict
     name: str
     video_id: str
     folder_id: str
+    version: int = 0
 
 
 class NoteResponse(BaseModel):
@@ -131,3 +162,60 @@ class NoteFetch(BaseModel):
 class UpdateNote(BaseModel):
     file_id: str
     note: dict
+
+
+class PatchNote(BaseModel):
+    file_id: str
+    base_version: int = Field(..., ge=0)
+    delta: dict
+
+
+class PatchNoteResponse(BaseModel):
+    version: int
+    # Server changes the client has not seen yet, transformed against its patch
+    delta: dict
+
+
+class NoteSearchResult(FileResponse):
+    rank: float
+    # Matching fragments of the note, matches wrapped in <mark></mark>, HTML escaped
+    highlight: Optional[str] = None
+
+
+class NoteSearchResponse(BaseModel):
+    results: List[NoteSearchResult]
+
+
+class BulkOperation(BaseModel):
+    op: Literal["move", "rename", "delete"]
+    kind: Literal["file", "folder"]
+    id: str
+    new_name: Optional[str] = Field(None, min_length=1, max_length=255)  # rename
+    # move: destination folder, None moves a folder to the root level
+    new_parent_id: Optional[str] = None
+
+
+class BulkRequest(BaseModel):
+    operations: List[BulkOperation] = Field(..., min_length=1, max_length=500)
+    # Apply nothing if any operation is invalid
+    atomic: bool = False
+
+
+class BulkResult(BaseModel):
+    index: int
+    status: Literal["ok", "error", "skipped"]
+    detail: Optional[str] = None
+
+
+class BulkResponse(BaseModel):
+    applied: int
+    failed: int
+    results: List[BulkResult]
+
+
+class ProfileRequest(BaseModel):
+    method: Literal["GET", "POST", "PUT", "PATCH", "DELETE"]
+    # Path template of the route, e.g. /note or /note/{note_id}
+    route: str
+    requests: int = Field(10, ge=1, le=1000)
+    interval_ms: float = Field(5, ge=1, le=1000)
@@ -0,0 +1,171 @@
+#  Admission control for the OpenAI-backed endpoints (POST /note, POST /note/ask)
+#  Each request is admitted with an estimate of the tokens it will spend, and holds
+#  them until it finishes. A user can hold at most ADMISSION_USER_TOKENS at a time and
+#  the worker ADMISSION_GLOBAL_TOKENS in total. Requests that don't fit queue up:
+#  users are served in turn, one request each, so one user's long videos can't keep
+#  everyone else's questions waiting. A request still queued after
+#  ADMISSION_MAX_WAIT_SECONDS (or arriving to a full queue) is rejected with the
+#  seconds after which a retry is likely to get in, so latency stays bounded under
+#  overload. Budgets are per worker: size them as the OpenAI budget / workers.
+
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Deque, Dict
+
+ADMISSION_GLOBAL_TOKENS = int(os.getenv("ADMISSION_GLOBAL_TOKENS", "400000"))
+ADMISSION_USER_TOKENS = int(os.getenv("ADMISSION_USER_TOKENS", "100000"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "20"))
+ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "200"))
+
+# Rough size of an OpenAI token in characters of English text
+CHARS_PER_TOKEN = 4
+# Notes: the chunk pass reads the transcript (+10% chunk overlap) and writes notes
+# about half its size, the combining pass reads those and writes the final notes
+NOTE_TOKENS_PER_TRANSCRIPT_TOKEN = 2.1
+NOTE_SUMMARY_TOKENS = 1000
+# Answers: up to 3 transcript chunks of 4000 characters as context, plus the answer
+ANSWER_CONTEXT_TOKENS = 3 * 1000
+ANSWER_TOKENS = 500
+
+
+def estimate_note_tokens(transcript: str) -> int:
+    """Tokens generate_notes will spend on a transcript"""
+    transcript_tokens = len(transcript) / CHARS_PER_TOKEN
+    return (
+        math.ceil(transcript_tokens * NOTE_TOKENS_PER_TRANSCRIPT_TOKEN)
+        + NOTE_SUMMARY_TOKENS
+    )
+
+
+def estimate_answer_tokens(question: str) -> int:
+    """Tokens answer_question will spend on a question"""
+    question_tokens = math.ceil(len(question) / CHARS_PER_TOKEN)
+    return question_tokens + ANSWER_CONTEXT_TOKENS + ANSWER_TOKENS
+
+
+class AdmissionRejected(Exception):
+    """Overloaded: retry the request after retry_after seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Overloaded, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+@dataclass
+class _Waiter:
+    user_id: str
+    cost: int
+    granted: asyncio.Future
+
+
+@dataclass
+class AdmissionController:
+    global_tokens: int = ADMISSION_GLOBAL_TOKENS
+    user_tokens: int = ADMISSION_USER_TOKENS
+    max_wait_seconds: float = ADMISSION_MAX_WAIT_SECONDS
+    max_queued: int = ADMISSION_MAX_QUEUED
+    _in_flight: int = 0
+    _in_flight_by_user: Dict[str, int] = field(default_factory=dict)
+    # user id -> their waiting requests, in the order users get their next turn
+    _queues: "OrderedDict[str, Deque[_Waiter]]" = field(default_factory=OrderedDict)
+    _queued: int = 0
+    # Moving average of how long an admitted request holds its tokens
+    _average_hold_seconds: float = ADMISSION_MAX_WAIT_SECONDS
+
+    @asynccontextmanager
+    async def admit(self, user_id: str, tokens: int):
+        """
+        Hold `tokens` of the budgets while the body runs, waiting for them if needed.
+
+        Raises:
+            AdmissionRejected: The queue is full or the tokens were not available
+                within max_wait_seconds
+        """
+        # A request bigger than a budget runs alone rather than never
+        cost = min(tokens, self.user_tokens, self.global_tokens)
+        if self._queued >= self.max_queued:
+            raise AdmissionRejected(self._retry_after())
+
+        waiter = _Waiter(user_id, cost, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        self._queued += 1
+        self._grant()
+        try:
+            await asyncio.wait({waiter.granted}, timeout=self.max_wait_seconds)
+        except BaseException:
+            # Cancelled (client gone) while queued, or right after being admitted
+            if waiter.granted.done():
+                self._release(user_id, cost)
+            else:
+                self._unqueue(waiter)
+            raise
+        if not waiter.granted.done():
+            self._unqueue(waiter)
+            raise AdmissionRejected(self._retry_after())
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - started
+            self._average_hold_seconds += (held - self._average_hold_seconds) * 0.1
+            self._release(user_id, cost)
+
+    def _fits_user(self, waiter: _Waiter) -> bool:
+        held = self._in_flight_by_user.get(waiter.user_id, 0)
+        return held + waiter.cost <= self.user_tokens
+
+    def _grant(self):
+        """Admit queued requests that fit, one per user per turn"""
+        granted = True
+        while granted:
+            granted = False
+            for user_id in list(self._queues):
+                waiter = self._queues[user_id][0]
+                if not self._fits_user(waiter):
+                    # Only this user is over their share, the others can go on
+                    continue
+                if self._in_flight + waiter.cost > self.global_tokens:
+                    # Stop here so smaller requests behind can't starve this one
+                    return
+                self._queues[user_id].popleft()
+                self._queued -= 1
+                if self._queues[user_id]:
+                    self._queues.move_to_end(user_id)
+                else:
+                    del self._queues[user_id]
+                self._in_flight += waiter.cost
+                self._in_flight_by_user[user_id] = (
+                    self._in_flight_by_user.get(user_id, 0) + waiter.cost
+                )
+                waiter.granted.set_result(None)
+                granted = True
+
+    def _unqueue(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.user_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self._queued -= 1
+        if not queue:
+            del self._queues[waiter.user_id]
+        # It may have been the head blocking the others
+        self._grant()
+
+    def _release(self, user_id: str, cost: int):
+        self._in_flight -= cost
+        remaining = self._in_flight_by_user.pop(user_id, 0) - cost
+        if remaining > 0:
+            self._in_flight_by_user[user_id] = remaining
+        self._grant()
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self._average_hold_seconds))
+
+
+admission_controller = AdmissionController()
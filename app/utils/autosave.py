@@ -0,0 +1,148 @@
+#  Write-behind buffer for note autosaves (PUT /note)
+#  Saves are acknowledged right away and only the latest content of a file is
+#  written to Postgres once the editor has been quiet for a while (or after a
+#  maximum delay). The buffer lives in the worker process, so the API must run
+#  with a single worker per file (sticky routing) for reads to see buffered saves;
+#  a flushed file is then read from the primary for DB_REPLICA_LAG_SECONDS.
+
+import logging
+import asyncio
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from sqlalchemy import update
+
+from app.database.db import SessionLocal, mark_written
+from app.models.models import File
+from app.utils.delta import plain_text
+
+logger = logging.getLogger(__name__)
+
+AUTOSAVE_QUIET_SECONDS = float(os.getenv("AUTOSAVE_QUIET_SECONDS", "2"))
+AUTOSAVE_MAX_DELAY_SECONDS = float(os.getenv("AUTOSAVE_MAX_DELAY_SECONDS", "10"))
+# Failed writes are retried after quiet_seconds, doubling each time, then dropped
+AUTOSAVE_MAX_ATTEMPTS = int(os.getenv("AUTOSAVE_MAX_ATTEMPTS", "5"))
+
+
+@dataclass
+class _PendingSave:
+    user_id: str
+    content: dict
+    first_at: float
+    timer: Optional[asyncio.TimerHandle] = None
+    # Failed writes of this content
+    failures: int = 0
+
+
+@dataclass
+class AutosaveBuffer:
+    quiet_seconds: float = AUTOSAVE_QUIET_SECONDS
+    max_delay_seconds: float = AUTOSAVE_MAX_DELAY_SECONDS
+    max_attempts: int = AUTOSAVE_MAX_ATTEMPTS
+    _pending: Dict[str, _PendingSave] = field(default_factory=dict)
+    # Content popped from _pending but not committed yet, still served to readers
+    _inflight: Dict[str, _PendingSave] = field(default_factory=dict)
+    _locks: Dict[str, asyncio.Lock] = field(default_factory=dict)
+    _tasks: set = field(default_factory=set)
+
+    def owns(self, file_id: str, user_id: str) -> bool:
+        """True if the file already has a buffered save by this user"""
+        pending = self._pending.get(file_id) or self._inflight.get(file_id)
+        return pending is not None and pending.user_id == user_id
+
+    def put(self, file_id: str, user_id: str, content: dict):
+        """Buffer the latest content of a file and (re)schedule its flush"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        pending = self._pending.get(file_id)
+        if pending is None:
+            pending = _PendingSave(user_id=user_id, content=content, first_at=now)
+            self._pending[file_id] = pending
+        else:
+            pending.content = content
+            pending.timer.cancel()
+
+        delay = min(self.quiet_seconds, pending.first_at + self.max_delay_seconds - now)
+        pending.timer = loop.call_later(max(delay, 0), self._schedule_flush, file_id)
+
+    def get(self, file_id: str, user_id: str) -> Optional[dict]:
+        """Buffered content of a file not yet written to the database"""
+        pending = self._pending.get(file_id) or self._inflight.get(file_id)
+        if pending is None or pending.user_id != user_id:
+            return None
+        return pending.content
+
+    def discard(self, file_id: str):
+        """Drop the buffered save of a file (e.g. the file was deleted)"""
+        pending = self._pending.pop(file_id, None)
+        if pending is not None:
+            pending.timer.cancel()
+
+    def _schedule_flush(self, file_id: str):
+        task = asyncio.ensure_future(self.flush(file_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, file_id: str):
+        """Write the buffered content of a file, if any"""
+        lock = self._locks.setdefault(file_id, asyncio.Lock())
+        async with lock:
+            pending = self._pending.pop(file_id, None)
+            if pending is None:
+                return
+            pending.timer.cancel()
+            self._inflight[file_id] = pending
+            try:
+                await _write_content(file_id, pending.user_id, pending.content)
+            except Exception:
+                logger.exception("Error while flushing autosave of file %s", file_id)
+                pending.failures += 1
+                if pending.failures >= self.max_attempts:
+                    # Content the database keeps refusing must not be served forever
+                    logger.error(
+                        "Dropped autosave of file %s after %d failed writes",
+                        file_id,
+                        pending.failures,
+                    )
+                elif file_id not in self._pending:
+                    # Keep the content buffered and retry, unless a newer save
+                    # replaced it
+                    self._pending[file_id] = pending
+                    pending.timer = asyncio.get_running_loop().call_later(
+                        self.quiet_seconds * 2 ** (pending.failures - 1),
+                        self._schedule_flush,
+                        file_id,
+                    )
+            else:
+                # Out of the buffer, reads of the file must not go to a lagging replica
+                mark_written(f"file:{file_id}")
+            finally:
+                if self._inflight.get(file_id) is pending:
+                    del self._inflight[file_id]
+                if file_id not in self._pending:
+                    self._locks.pop(file_id, None)
+
+    async def flush_all(self):
+        """Write every buffered save and wait for running flushes (called on shutdown)"""
+        await asyncio.gather(
+            *self._tasks, *(self.flush(file_id) for file_id in list(self._pending))
+        )
+
+
+async def _write_content(file_id: str, user_id: str, content: dict):
+    async with SessionLocal() as db:
+        # Full rewrite: patches based on older versions can no longer be transformed
+        await db.execute(
+            update(File)
+            .where(File.id == file_id, File.user_id == user_id)
+            .values(
+                content=content,
+                content_text=plain_text(content),
+                version=File.version + 1,
+            )
+        )
+        await db.commit()
+
+
+autosave_buffer = AutosaveBuffer()
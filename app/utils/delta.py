@@ -0,0 +1,423 @@
+#  Quill Delta operations (compose / transform) used for server-side note patches
+#  Port of the quill-delta JS library semantics: lengths and offsets are counted in
+#  UTF-16 code units like in the browser, so retains coming from Quill line up.
+
+from math import inf
+
+
+def _text_length(text):
+    if text.isascii():
+        return len(text)
+    return len(text.encode("utf-16-le", "surrogatepass")) // 2
+
+
+def _is_surrogate_pair(data, index):
+    # True if UTF-16 units index - 1 and index form one character
+    if index <= 0 or 2 * index >= len(data):
+        return False
+    high = int.from_bytes(data[2 * index - 2 : 2 * index], "little")
+    low = int.from_bytes(data[2 * index : 2 * index + 2], "little")
+    return 0xD800 <= high <= 0xDBFF and 0xDC00 <= low <= 0xDFFF
+
+
+def _text_slice(text, start, end):
+    if text.isascii():
+        return text[start:end]
+    data = text.encode("utf-16-le", "surrogatepass")
+    if _is_surrogate_pair(data, start) or _is_surrogate_pair(data, end):
+        raise ValueError("Delta splits a character made of two UTF-16 units")
+    return data[2 * start : 2 * end].decode("utf-16-le", "surrogatepass")
+
+
+def _join_text(a, b):
+    text = a + b
+    if a and "\ud800" <= a[-1] <= "\udbff":
+        # Halves of a character sent in two ops become the character again
+        text = text.encode("utf-16", "surrogatepass").decode("utf-16", "surrogatepass")
+    return text
+
+
+def _check_text(text):
+    if not text.isascii():
+        try:
+            text.encode("utf-8")
+        except UnicodeEncodeError:
+            raise ValueError("Delta insert has half of a UTF-16 character")
+
+
+def op_length(op):
+    """Length of a single op in Quill units"""
+    if "delete" in op:
+        return op["delete"]
+    if "retain" in op:
+        return op["retain"]
+    insert = op["insert"]
+    return _text_length(insert) if isinstance(insert, str) else 1
+
+
+def op_type(op):
+    if op is None:
+        return "retain"
+    if "delete" in op:
+        return "delete"
+    if "retain" in op:
+        return "retain"
+    return "insert"
+
+
+class _OpIterator:
+    """Walks a list of ops, handing out pieces of at most the requested length"""
+
+    def __init__(self, ops):
+        self.ops = ops
+        self.index = 0
+        self.offset = 0
+
+    def has_next(self):
+        return self.peek_length() < inf
+
+    def peek(self):
+        return self.ops[self.index] if self.index < len(self.ops) else None
+
+    def peek_length(self):
+        op = self.peek()
+        if op is None:
+            return inf
+        return op_length(op) - self.offset
+
+    def peek_type(self):
+        return op_type(self.peek())
+
+    def next(self, length=inf):
+        op = self.peek()
+        if op is None:
+            return {"retain": inf}
+
+        offset = self.offset
+        op_len = op_length(op)
+        if length >= op_len - offset:
+            length = op_len - offset
+            self.index += 1
+            self.offset = 0
+        else:
+            self.offset += length
+
+        if "delete" in op:
+            return {"delete": length}
+
+        piece = {}
+        if "retain" in op:
+            piece["retain"] = length
+        elif isinstance(op["insert"], str):
+            piece["insert"] = _text_slice(op["insert"], offset, offset + length)
+        else:
+            piece["insert"] = op["insert"]
+        if op.get("attributes"):
+            piece["attributes"] = op["attributes"]
+        return piece
+
+    def rest(self):
+        if not self.has_next():
+            return []
+        if self.offset == 0:
+            return self.ops[self.index :]
+        index, offset = self.index, self.offset
+        first = self.next()
+        rest = self.ops[self.index :]
+        self.index, self.offset = index, offset
+        return [first] + rest
+
+
+def push(ops, new_op):
+    """
+    Append an op to a list of ops, merging it with the previous op when possible.
+
+    Args:
+        ops (list): Ops to append to (modified in place)
+        new_op (dict): Op to append
+
+    Returns:
+        list: The same ops list
+    """
+    new_op = dict(new_op)
+    index = len(ops)
+    last_op = ops[index - 1] if index else None
+
+    if last_op is not None:
+        if "delete" in new_op and "delete" in last_op:
+            ops[index - 1] = {"delete": last_op["delete"] + new_op["delete"]}
+            return ops
+
+        # Inserting before or after a delete at the same index is the same,
+        # always prefer to insert first
+        if "delete" in last_op and "insert" in new_op:
+            index -= 1
+            last_op = ops[index - 1] if index else None
+            if last_op is None:
+                ops.insert(0, new_op)
+                return ops
+
+        if (new_op.get("attributes") or None) == (last_op.get("attributes") or None):
+            merged = None
+            if isinstance(new_op.get("insert"), str) and isinstance(
+                last_op.get("insert"), str
+            ):
+                merged = {"insert": _join_text(last_op["insert"], new_op["insert"])}
+            elif "retain" in new_op and "retain" in last_op:
+                merged = {"retain": last_op["retain"] + new_op["retain"]}
+            if merged is not None:
+                if new_op.get("attributes"):
+                    merged["attributes"] = new_op["attributes"]
+                ops[index - 1] = merged
+                return ops
+
+    ops.insert(index, new_op)
+    return ops
+
+
+def _retain(ops, length, attributes=None):
+    if length <= 0:
+        return
+    op = {"retain": length}
+    if attributes:
+        op["attributes"] = attributes
+    push(ops, op)
+
+
+def _chop(ops):
+    if ops and "retain" in ops[-1] and not ops[-1].get("attributes"):
+        ops.pop()
+    return ops
+
+
+def _compose_attributes(a, b, keep_null):
+    attributes = dict(b or {})
+    if not keep_null:
+        attributes = {k: v for k, v in attributes.items() if v is not None}
+    for key, value in (a or {}).items():
+        if key not in (b or {}):
+            attributes[key] = value
+    return attributes or None
+
+
+def _transform_attributes(a, b, priority):
+    if not a:
+        return b
+    if not b:
+        return None
+    if not priority:
+        return b
+    attributes = {k: v for k, v in b.items() if k not in a}
+    return attributes or None
+
+
+def _ops(delta):
+    ops = delta.get("ops") if isinstance(delta, dict) else None
+    if not isinstance(ops, list):
+        raise ValueError("Delta must be an object with an 'ops' list")
+    for op in ops:
+        if not isinstance(op, dict):
+            raise ValueError("Delta op must be an object")
+        kinds = [k for k in ("insert", "retain", "delete") if k in op]
+        if len(kinds) != 1:
+            raise ValueError("Delta op must have exactly one of insert/retain/delete")
+        kind = kinds[0]
+        if kind != "insert" and (
+            not isinstance(op[kind], int) or isinstance(op[kind], bool) or op[kind] < 0
+        ):
+            raise ValueError(f"Delta {kind} must be a non-negative integer")
+        if kind == "insert" and not isinstance(op["insert"], (str, dict)):
+            raise ValueError("Delta insert must be a string or an embed object")
+        if "attributes" in op and not isinstance(op["attributes"], (dict, type(None))):
+            raise ValueError("Delta attributes must be an object")
+    return ops
+
+
+def _canonical_op(op):
+    canonical = {key: op[key] for key in ("insert", "retain", "delete") if key in op}
+    attributes = op.get("attributes")
+    if attributes:
+        # Null only means "remove" in a change, it carries nothing on an insert
+        attributes = {
+            key: attributes[key]
+            for key in sorted(attributes)
+            if attributes[key] is not None or "insert" not in op
+        }
+        if attributes:
+            canonical["attributes"] = attributes
+    return canonical
+
+
+def normalize_into(ops, new_ops):
+    """
+    Append ops in canonical form, merging them with the previous ones when possible.
+
+    Args:
+        ops (list): Normalized ops to append to (modified in place)
+        new_ops (list): Ops to append
+
+    Returns:
+        list: The same ops list
+    """
+    for op in new_ops:
+        if op_length(op) == 0:
+            continue
+        push(ops, _canonical_op(op))
+    return ops
+
+
+def normalize(delta):
+    """
+    Canonical form of a delta.
+
+    Adjacent inserts/retains with equal attributes and adjacent deletes are
+    merged, empty ops are dropped and attribute dicts get sorted keys.
+
+    Args:
+        delta (dict): Delta to normalize
+
+    Returns:
+        dict: Normalized delta
+
+    Raises:
+        ValueError: The delta is malformed, or an insert keeps half of a character
+            made of two UTF-16 units (it can't be stored as JSON)
+    """
+    ops = normalize_into([], _ops(delta))
+    for op in ops:
+        if isinstance(op.get("insert"), str):
+            _check_text(op["insert"])
+    return {"ops": ops}
+
+
+def is_document(delta):
+    """True if the delta only contains inserts (a full document)"""
+    return all("insert" in op for op in _ops(delta))
+
+
+def plain_text(delta):
+    """
+    Plain text of a document delta, as indexed for full-text search.
+
+    Text inserts are concatenated in order, embeds (images, formulas...) and
+    formatting are dropped. Matches the SQL backfill of alembic revision d8a3f5b1e627.
+
+    Args:
+        delta (dict): Document delta
+
+    Returns:
+        str: Text of the document
+    """
+    return "".join(
+        op["insert"] for op in _ops(delta) if isinstance(op.get("insert"), str)
+    )
+
+
+def compose(a, b):
+    """
+    Compose two deltas: the result has the same effect as applying `a` then `b`.
+
+    Args:
+        a (dict): First delta (e.g. the stored document)
+        b (dict): Delta applied after `a` (e.g. the change from the editor)
+
+    Returns:
+        dict: Composed delta
+
+    Raises:
+        ValueError: The deltas are malformed, or `b` splits a character of `a` made
+            of two UTF-16 units
+    """
+    a_iter = _OpIterator(_ops(a))
+    b_iter = _OpIterator(_ops(b))
+    ops = []
+
+    # Fast path: skip over the leading plain retain without rebuilding ops
+    first_b = b_iter.peek()
+    if first_b is not None and "retain" in first_b and not first_b.get("attributes"):
+        first_left = first_b["retain"]
+        while a_iter.peek_type() == "insert" and a_iter.peek_length() <= first_left:
+            first_left -= a_iter.peek_length()
+            ops.append(a_iter.next())
+        if first_b["retain"] - first_left > 0:
+            b_iter.next(first_b["retain"] - first_left)
+
+    while a_iter.has_next() or b_iter.has_next():
+        if b_iter.peek_type() == "insert":
+            push(ops, b_iter.next())
+        elif a_iter.peek_type() == "delete":
+            push(ops, a_iter.next())
+        else:
+            length = min(a_iter.peek_length(), b_iter.peek_length())
+            a_op = a_iter.next(length)
+            b_op = b_iter.next(length)
+            if "retain" in b_op:
+                if "retain" in a_op:
+                    new_op = {"retain": length}
+                else:
+                    new_op = {"insert": a_op["insert"]}
+                attributes = _compose_attributes(
+                    a_op.get("attributes"), b_op.get("attributes"), "retain" in a_op
+                )
+                if attributes:
+                    new_op["attributes"] = attributes
+                push(ops, new_op)
+
+                # The rest of `b` is a plain retain, keep the rest of `a` as is
+                if not b_iter.has_next() and ops[-1] == new_op:
+                    rest = a_iter.rest()
+                    if rest:
+                        push(ops, rest[0])
+                        ops.extend(rest[1:])
+                    return {"ops": _chop(ops)}
+            elif "delete" in b_op and "retain" in a_op:
+                push(ops, b_op)
+            # Insert followed by delete cancels out
+
+    return {"ops": _chop(ops)}
+
+
+def transform(a, b, priority=False):
+    """
+    Transform delta `b` against delta `a`, both made on the same document.
+
+    The result can be applied after `a` and preserves the intent of `b`.
+
+    Args:
+        a (dict): Delta that is applied first
+        b (dict): Concurrent delta to transform
+        priority (bool): If True `a` wins ties (inserts at the same index)
+
+    Returns:
+        dict: Transformed `b`
+    """
+    a_iter = _OpIterator(_ops(a))
+    b_iter = _OpIterator(_ops(b))
+    ops = []
+
+    while a_iter.has_next() or b_iter.has_next():
+        if a_iter.peek_type() == "insert" and (
+            priority or b_iter.peek_type() != "insert"
+        ):
+            _retain(ops, op_length(a_iter.next()))
+        elif b_iter.peek_type() == "insert":
+            push(ops, b_iter.next())
+        else:
+            length = min(a_iter.peek_length(), b_iter.peek_length())
+            a_op = a_iter.next(length)
+            b_op = b_iter.next(length)
+            if "delete" in a_op:
+                # Our delete makes their delete or retain redundant
+                continue
+            elif "delete" in b_op:
+                push(ops, b_op)
+            else:
+                _retain(
+                    ops,
+                    length,
+                    _transform_attributes(
+                        a_op.get("attributes"), b_op.get("attributes"), priority
+                    ),
+                )
+
+    return {"ops": _chop(ops)}
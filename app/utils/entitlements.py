@@ -0,0 +1,121 @@
+#  Entitlements denormalised on users, and expiry of lapsed subscriptions
+#  users.entitled_until / entitled_plan_id hold the end and plan of the latest active
+#  subscription of the user, so the per-request access check reads the users row
+#  only. refresh_entitlements recomputes them and must run in the transaction of
+#  every change to subscriptions. The sweeper moves active subscriptions whose
+#  period has ended (trials never get a Paddle event) to "expired" in batches, every
+#  SUBSCRIPTION_SWEEP_SECONDS, in one worker at a time.
+
+import logging
+import asyncio
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterable, List
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.principal_cache import principal_cache
+from app.database.db import SessionLocal
+from app.models.models import Subscription, User
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION_SWEEP_SECONDS = float(os.getenv("SUBSCRIPTION_SWEEP_SECONDS", "300"))
+# Subscriptions expired per statement
+SUBSCRIPTION_SWEEP_BATCH = 1000
+SWEEP_LOCK_KEY = "subscription-sweep"
+
+
+async def refresh_entitlements(db: AsyncSession, user_ids: Iterable[str]):
+    """Recompute users.entitled_until / entitled_plan_id (call before committing)"""
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return
+    latest = (
+        select(Subscription)
+        .where(Subscription.user_id == User.id, Subscription.status == "active")
+        .order_by(Subscription.current_period_end.desc().nulls_last())
+        .limit(1)
+    )
+    await db.execute(
+        update(User)
+        .where(User.id.in_(user_ids))
+        .values(
+            entitled_until=latest.with_only_columns(
+                Subscription.current_period_end
+            ).scalar_subquery(),
+            entitled_plan_id=latest.with_only_columns(
+                Subscription.plan_id
+            ).scalar_subquery(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def expire_lapsed_subscriptions(db: AsyncSession, now: datetime) -> List[str]:
+    """
+    Expire one batch of active subscriptions whose period ended before `now`.
+
+    Returns:
+        List[str]: Users whose entitlement was refreshed, empty when none lapsed
+    """
+    lapsed = (
+        select(Subscription.id)
+        .where(Subscription.status == "active", Subscription.current_period_end <= now)
+        .limit(SUBSCRIPTION_SWEEP_BATCH)
+        .with_for_update(skip_locked=True)
+    )
+    user_ids = (
+        await db.scalars(
+            update(Subscription)
+            .where(Subscription.id.in_(lapsed))
+            .values(status="expired")
+            .returning(Subscription.user_id)
+            .execution_options(synchronize_session=False)
+        )
+    ).all()
+    await refresh_entitlements(db, user_ids)
+    return list(set(user_ids))
+
+
+@dataclass
+class SubscriptionSweeper:
+    interval_seconds: float = SUBSCRIPTION_SWEEP_SECONDS
+
+    async def run(self):
+        """Sweep every interval_seconds, until cancelled"""
+        while True:
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Error while expiring subscriptions")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def sweep(self) -> int:
+        """Expire every lapsed subscription, returns how many users lost access"""
+        now = datetime.now()
+        expired_users = 0
+        while True:
+            async with SessionLocal() as db:
+                # Another worker sweeping now will do it
+                locked = await db.scalar(
+                    select(
+                        func.pg_try_advisory_xact_lock(func.hashtext(SWEEP_LOCK_KEY))
+                    )
+                )
+                if not locked:
+                    return expired_users
+                user_ids = await expire_lapsed_subscriptions(db, now)
+                await db.commit()
+            for user_id in user_ids:
+                await principal_cache.invalidate_user(user_id)
+            expired_users += len(user_ids)
+            if not user_ids:
+                return expired_users
+
+
+subscription_sweeper = SubscriptionSweeper()
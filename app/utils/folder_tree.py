@@ -0,0 +1,99 @@
+#  Folder hierarchy kept in the folder_closure table
+#  Every folder has one row per ancestor (itself included at depth 0), so subtree and
+#  ancestor lookups are single index scans instead of recursive queries. Writers of
+#  a user's tree take lock_tree() first so concurrent moves cannot create cycles.
+
+from sqlalchemy import delete, exists, func, insert, literal, select, true, union_all
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.models.models import FolderClosure
+
+
+async def lock_tree(db: AsyncSession, user_id: str):
+    """Serialize changes to the folder tree of a user until the transaction ends"""
+    await db.execute(select(func.pg_advisory_xact_lock(func.hashtext(user_id))))
+
+
+def subtree_ids(folder_id):
+    """Select of the ids of a folder and all its subfolders"""
+    return select(FolderClosure.descendant_id).where(
+        FolderClosure.ancestor_id == folder_id
+    )
+
+
+async def add_folder(db: AsyncSession, folder_id, parent_id=None):
+    """Insert the closure rows of a new (leaf) folder"""
+    folder_id = literal(folder_id, UUID(as_uuid=True))
+    paths = select(folder_id, folder_id, literal(0))
+    if parent_id is not None:
+        paths = union_all(
+            paths,
+            select(FolderClosure.ancestor_id, folder_id, FolderClosure.depth + 1).where(
+                FolderClosure.descendant_id == parent_id
+            ),
+        )
+    await db.execute(
+        insert(FolderClosure).from_select(
+            ["ancestor_id", "descendant_id", "depth"], paths
+        )
+    )
+
+
+async def is_in_subtree(db: AsyncSession, folder_id, ancestor_id) -> bool:
+    """True if folder_id is ancestor_id itself or one of its subfolders"""
+    return await db.scalar(
+        select(
+            exists().where(
+                FolderClosure.ancestor_id == ancestor_id,
+                FolderClosure.descendant_id == folder_id,
+            )
+        )
+    )
+
+
+async def move_subtree(db: AsyncSession, folder_id, new_parent_id=None):
+    """
+    Re-attach the closure rows of a folder and its subtree under a new parent.
+
+    Args:
+        db (AsyncSession): Session holding lock_tree() for the owner
+        folder_id: Folder to move
+        new_parent_id: New parent, None to move the folder to the root level
+
+    The caller checks that new_parent_id is not inside the subtree and updates
+    folders.parent_id.
+    """
+    # Paths from the old ancestors into the subtree
+    await db.execute(
+        delete(FolderClosure).where(
+            FolderClosure.descendant_id.in_(subtree_ids(folder_id)),
+            FolderClosure.ancestor_id.in_(
+                select(FolderClosure.ancestor_id).where(
+                    FolderClosure.descendant_id == folder_id,
+                    FolderClosure.ancestor_id != folder_id,
+                )
+            ),
+        )
+    )
+    if new_parent_id is None:
+        return
+    # Every ancestor of the new parent to every folder of the subtree
+    parent_paths = aliased(FolderClosure)
+    subtree_paths = aliased(FolderClosure)
+    await db.execute(
+        insert(FolderClosure).from_select(
+            ["ancestor_id", "descendant_id", "depth"],
+            select(
+                parent_paths.ancestor_id,
+                subtree_paths.descendant_id,
+                parent_paths.depth + subtree_paths.depth + 1,
+            )
+            .join(subtree_paths, true())
+            .where(
+                parent_paths.descendant_id == new_parent_id,
+                subtree_paths.ancestor_id == folder_id,
+            ),
+        )
+    )
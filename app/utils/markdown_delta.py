@@ -1,72 +1,123 @@
 import re
-import json
 
-
-def markdown_to_quill_delta(markdown):
+from app.utils.delta import normalize_into
+from app.utils.serialization import json_dumps
+
+
+# Map common language aliases to standardized names
+LANGUAGE_MAPPING = {
+    "js": "javascript",
+    "py": "python",
+    "rb": "ruby",
+    "cs": "csharp",
+    "ts": "typescript",
+    "sh": "bash",
+    "c++": "cpp",
+    "html": "html",
+    "css": "css",
+    "java": "java",
+    "php": "php",
+    "go": "go",
+    "rust": "rust",
+    "swift": "swift",
+    "kotlin": "kotlin",
+    "sql": "sql",
+    "r": "r",
+    "scala": "scala",
+    "dart": "dart",
+    "perl": "perl",
+    "powershell": "powershell",
+    "c#": "csharp",
+    "": "",  # Default for empty language specification
+}
+
+
+class MarkdownDeltaStream:
     """
-    Convert markdown to Quill Delta format with proper code block handling.
+    Incremental markdown to Quill Delta converter.
 
-    Args:
-        markdown (str): Input markdown text
+    Text can be fed in fragments of any size (e.g. tokens streamed from the
+    LLM). Ops are returned as soon as the line or code block they belong to
+    is complete; a partial line is held back so that inline markers split
+    across fragments are never emitted half-parsed, and a code block is held
+    back until its closing fence arrives.
 
-    Returns:
-        dict: Quill Delta format object
+    Concatenating the ops returned by every `feed` call and by `close`
+    gives exactly the ops of `markdown_to_quill_delta` for the whole text.
+    The last op is always held back since the next line may merge into it.
     """
-    delta = {"ops": []}
-    lines = markdown.split("\n")
-    i = 0
-    in_code_block = False
-    code_block_content = ""
-    code_lang = ""
-
-    while i < len(lines):
-        line = lines[i]
 
+    def __init__(self):
+        self._pending = []
+        self._last_op = None
+        self._in_code_block = False
+        self._code_block_content = ""
+        self._code_lang = ""
+
+    def feed(self, fragment):
+        """
+        Add a markdown fragment and return the ops completed by it.
+
+        Args:
+            fragment (str): Next piece of markdown text
+
+        Returns:
+            list: Finished Quill Delta ops (may be empty)
+        """
+        if "\n" not in fragment:
+            self._pending.append(fragment)
+            return []
+
+        self._pending.append(fragment)
+        *lines, rest = "".join(self._pending).split("\n")
+        self._pending = [rest]
+
+        delta = {"ops": []}
+        for line in lines:
+            self._process_line(line, delta)
+        return self._normalized(delta["ops"], final=False)
+
+    def close(self):
+        """
+        Flush the last (unterminated) line and return its ops.
+
+        An unterminated code block is dropped, as in the batch converter.
+
+        Returns:
+            list: Remaining Quill Delta ops
+        """
+        line = "".join(self._pending)
+        self._pending = []
+
+        delta = {"ops": []}
+        self._process_line(line, delta)
+        return self._normalized(delta["ops"], final=True)
+
+    def _normalized(self, new_ops, final):
+        ops = [] if self._last_op is None else [self._last_op]
+        normalize_into(ops, new_ops)
+        self._last_op = None
+        if not final and ops:
+            self._last_op = ops.pop()
+        return ops
+
+    def _process_line(self, line, delta):
         # Handle code blocks - check if we're starting a code block
-        if not in_code_block and line.strip().startswith("```"):
-            in_code_block = True
-            code_lang = line.strip()[3:].strip().lower()
-            code_block_content = ""
-            i += 1
-            continue
+        if not self._in_code_block and line.strip().startswith("```"):
+            self._in_code_block = True
+            self._code_lang = line.strip()[3:].strip().lower()
+            self._code_block_content = ""
+            return
 
         # Handle code blocks - check if we're ending a code block
-        elif in_code_block and line.strip().startswith("```"):
-            in_code_block = False
-
-            # Map common language aliases to standardized names
-            language_mapping = {
-                "js": "javascript",
-                "py": "python",
-                "rb": "ruby",
-                "cs": "csharp",
-                "ts": "typescript",
-                "sh": "bash",
-                "c++": "cpp",
-                "html": "html",
-                "css": "css",
-                "java": "java",
-                "php": "php",
-                "go": "go",
-                "rust": "rust",
-                "swift": "swift",
-                "kotlin": "kotlin",
-                "sql": "sql",
-                "r": "r",
-                "scala": "scala",
-                "dart": "dart",
-                "perl": "perl",
-                "powershell": "powershell",
-                "c#": "csharp",
-                "": "",  # Default for empty language specification
-            }
+        elif self._in_code_block and line.strip().startswith("```"):
+            self._in_code_block = False
 
             # Normalize language name if it's in our mapping
-            if code_lang in language_mapping:
-                code_lang = language_mapping[code_lang]
+            code_lang = LANGUAGE_MAPPING.get(self._code_lang, self._code_lang)
 
             # Add the code content
-            delta["ops"].append({"insert": code_block_content.rstrip()})
+            delta["ops"].append({"insert": self._code_block_content.rstrip()})
 
             # Add the code-block attribute with language if specified
             delta["ops"].append(
@@ -75,28 +126,23 @@ def markdown_to_quill_delta(markdown):
                     "attributes": {"code-block": code_lang if code_lang else True},
                 }
             )
-
-            i += 1
-            continue
+            return
 
         # If we're inside a code block, add the line to our code content
-        elif in_code_block:
-            code_block_content += line + "\n"
-            i += 1
-            continue
+        elif self._in_code_block:
+            self._code_block_content += line + "\n"
+            return
 
         # Skip empty lines but preserve them in delta
         if line.strip() == "":
             delta["ops"].append({"insert": "\n"})
-            i += 1
-            continue
+            return
 
         # Handle horizontal line
         if re.match(r"^-{3,}$|^_{3,}$|^\*{3,}$", line.strip()):
             # Add divider operation
             delta["ops"].append({"insert": "\n", "attributes": {"divider": True}})
-            i += 1
-            continue
+            return
 
         # Handle headers
         header_match = re.match(r"^(#{1,6})\s+(.+)$", line)
@@ -109,9 +155,7 @@ def markdown_to_quill_delta(markdown):
 
             # Add the newline with header attribute
             delta["ops"].append({"insert": "\n", "attributes": {"header": level}})
-
-            i += 1
-            continue
+            return
 
         # Handle unordered lists
         list_match = re.match(r"^(\s*)([-*+])\s+(.+)$", line)
@@ -128,9 +172,7 @@ def markdown_to_quill_delta(markdown):
                 attributes["indent"] = str(indent_level)
 
             delta["ops"].append({"insert": "\n", "attributes": attributes})
-
-            i += 1
-            continue
+            return
 
         # Handle ordered lists
         ordered_list_match = re.match(r"^(\s*)(\d+)[.)]\s+(.+)$", line)
@@ -147,9 +189,7 @@ def markdown_to_quill_delta(markdown):
                 attributes["indent"] = str(indent_level)
 
             delta["ops"].append({"insert": "\n", "attributes": attributes})
-
-            i += 1
-            continue
+            return
 
         # Handle blockquotes
         blockquote_match = re.match(r"^>\s+(.+)$", line)
@@ -161,9 +201,7 @@ def markdown_to_quill_delta(markdown):
 
             # Add newline with blockquote attribute
             delta["ops"].append({"insert": "\n", "attributes": {"blockquote": True}})
-
-            i += 1
-            continue
+            return
 
         # Handle normal paragraph text
         process_inline_formatting(line, delta)
@@ -171,9 +209,19 @@ def markdown_to_quill_delta(markdown):
         # Add a paragraph break
         delta["ops"].append({"insert": "\n"})
 
-        i += 1
 
-    return json.dumps(delta,indent=1)
+def markdown_to_quill_delta(markdown):
+    """
+    Convert markdown to Quill Delta format with proper code block handling.
+
+    Args:
+        markdown (str): Input markdown text
+
+    Returns:
+        dict: Normalized Quill Delta format object
+    """
+    stream = MarkdownDeltaStream()
+    return {"ops": stream.feed(markdown) + stream.close()}
 
 
 def process_inline_formatting(text, delta):
@@ -254,7 +302,7 @@ def process_inline_formatting(text, delta):
 
 def to_json(delta):
     """
-    Convert delta object to JSON string with indentation
+    Convert delta object to a compact JSON string
 
     Args:
         delta (dict): Delta object
@@ -262,4 +310,4 @@ def to_json(delta):
     Returns:
         str: JSON string representation
     """
-    return json.dumps(delta, indent=2)
+    return json_dumps(delta)
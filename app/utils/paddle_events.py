@@ -0,0 +1,194 @@
+#  Background processing of Paddle webhook events
+#  POST /webhook/paddle only verifies an event, stores it in paddle_events (a
+#  redelivered event is a no-op) and wakes this consumer. The consumer applies the
+#  pending events of one subscription at a time, in occurred_at order, holding a
+#  transaction-level advisory lock on the subscription so no other worker applies its
+#  events concurrently. A failing event is retried on the next passes and holds back
+#  the later events of its subscription until it has failed PADDLE_EVENT_MAX_ATTEMPTS
+#  times, then it is left with its last_error. Events stored by other workers, or left
+#  pending by a restart, are picked up by polling every PADDLE_EVENT_POLL_SECONDS.
+
+import logging
+import asyncio
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional, Set
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.principal_cache import principal_cache
+from app.database.db import SessionLocal
+from app.models.models import PaddleEvent, Subscription, User
+from app.utils.entitlements import refresh_entitlements
+
+logger = logging.getLogger(__name__)
+
+PADDLE_EVENT_POLL_SECONDS = float(os.getenv("PADDLE_EVENT_POLL_SECONDS", "5"))
+PADDLE_EVENT_MAX_ATTEMPTS = int(os.getenv("PADDLE_EVENT_MAX_ATTEMPTS", "8"))
+# Subscriptions with pending events handled per pass
+PADDLE_EVENT_BATCH = 100
+
+
+def parse_paddle_time(value: Optional[str]) -> Optional[datetime]:
+    """Paddle RFC 3339 timestamp as naive UTC, like the DateTime columns"""
+    if not value:
+        return None
+    moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def subscription_key(event: dict) -> str:
+    """Key ordering the events of a subscription, see PaddleEvent.subscription_key"""
+    data = event.get("data") or {}
+    if event["event_type"].startswith("subscription."):
+        key = data.get("id")
+    else:
+        # transaction.* events carry the subscription they bill, if any
+        key = data.get("subscription_id")
+    return key or event["event_id"]
+
+
+async def apply_subscription_event(db: AsyncSession, data: dict) -> str:
+    """
+    Bring the subscription in line with the entity of a subscription.* event.
+
+    Every subscription event (created, activated, updated, trialing, past_due,
+    paused, resumed, canceled, imported) carries the whole subscription, so they
+    are all applied the same way.
+
+    Returns:
+        str: Id of the user owning the subscription
+    """
+    paddle_subscription_id = data.get("id")
+    if not paddle_subscription_id:
+        raise ValueError("Subscription id not provided")
+    subscription = await db.scalar(
+        select(Subscription).where(
+            Subscription.paddle_subscription_id == paddle_subscription_id
+        )
+    )
+    if subscription is None:
+        customer_email = (data.get("custom_data") or {}).get("email")
+        if not customer_email:
+            raise ValueError(
+                f"Subscription {paddle_subscription_id} unknown,"
+                " no customer email provided"
+            )
+        user_id = await db.scalar(select(User.id).where(User.email == customer_email))
+        if not user_id:
+            raise ValueError(f"User with email {customer_email} not found")
+        subscription = Subscription(
+            user_id=user_id, paddle_subscription_id=paddle_subscription_id
+        )
+        db.add(subscription)
+
+    paddle_status = data.get("status") or subscription.status or "active"
+    # A Paddle trial gives access like an active subscription
+    subscription.status = "active" if paddle_status == "trialing" else paddle_status
+    price = ((data.get("items") or [{}])[0].get("price")) or {}
+    subscription.plan_id = price.get("id") or subscription.plan_id
+    # Canceled and paused subscriptions have no billing period, keep the last one
+    period_end = parse_paddle_time(
+        (data.get("current_billing_period") or {}).get("ends_at")
+    )
+    if period_end is not None:
+        subscription.current_period_end = period_end
+    subscription.cancel_at_period_end = (data.get("scheduled_change") or {}).get(
+        "action"
+    ) == "cancel"
+    canceled_at = parse_paddle_time(data.get("canceled_at"))
+    if canceled_at is not None:
+        subscription.cancelled_at = canceled_at
+    await db.flush()
+    return subscription.user_id
+
+
+def _pending():
+    return (
+        PaddleEvent.processed_at.is_(None),
+        PaddleEvent.attempts < PADDLE_EVENT_MAX_ATTEMPTS,
+    )
+
+
+@dataclass
+class PaddleEventConsumer:
+    poll_seconds: float = PADDLE_EVENT_POLL_SECONDS
+    _wake: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def wake(self):
+        """Process pending events now rather than at the next poll"""
+        self._wake.set()
+
+    async def run(self):
+        """Apply pending events as they are stored, until cancelled"""
+        while True:
+            self._wake.clear()
+            try:
+                await self.process_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Error while processing Paddle events")
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def process_pending(self):
+        async with SessionLocal() as db:
+            keys = (
+                await db.scalars(
+                    select(PaddleEvent.subscription_key)
+                    .where(*_pending())
+                    .group_by(PaddleEvent.subscription_key)
+                    .order_by(func.min(PaddleEvent.occurred_at))
+                    .limit(PADDLE_EVENT_BATCH)
+                )
+            ).all()
+        for key in keys:
+            await self._process_subscription(key)
+
+    async def _process_subscription(self, key: str):
+        users: Set[str] = set()
+        async with SessionLocal() as db:
+            # Released at commit; another worker holding it is on these events already
+            locked = await db.scalar(
+                select(func.pg_try_advisory_xact_lock(func.hashtext(f"paddle:{key}")))
+            )
+            if not locked:
+                return
+            events = (
+                await db.scalars(
+                    select(PaddleEvent)
+                    .where(PaddleEvent.subscription_key == key, *_pending())
+                    .order_by(PaddleEvent.occurred_at, PaddleEvent.event_id)
+                )
+            ).all()
+            for event in events:
+                event.attempts += 1
+                try:
+                    async with db.begin_nested():
+                        if event.event_type.startswith("subscription."):
+                            user_id = await apply_subscription_event(
+                                db, event.payload["data"]
+                            )
+                            await refresh_entitlements(db, [user_id])
+                            users.add(user_id)
+                        # Other event types are kept for the record, nothing to apply
+                except Exception as e:
+                    logger.warning(
+                        "Error %s while applying Paddle event %s", e, event.event_id
+                    )
+                    event.last_error = str(e)
+                    # The later events of the subscription wait for this one
+                    break
+                event.processed_at = datetime.now(timezone.utc).replace(tzinfo=None)
+                event.last_error = None
+            await db.commit()
+        for user_id in users:
+            await principal_cache.invalidate_user(user_id)
+
+
+paddle_event_consumer = PaddleEventConsumer()
@@ -0,0 +1,29 @@
+#  Opaque cursors for keyset pagination on (name, id)
+#  The cursor is the (name, id) of the last row of a page; the next page starts
+#  strictly after it, so pages stay stable while rows are added or removed.
+
+import base64
+from uuid import UUID
+
+from app.utils.serialization import json_dumps, json_loads
+
+
+def encode_cursor(name: str, row_id) -> str:
+    return base64.urlsafe_b64encode(json_dumps([name, str(row_id)]).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """(name, id) of a cursor, raises ValueError when it is malformed"""
+    try:
+        name, row_id = json_loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(name), UUID(row_id)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def page(rows, limit: int):
+    """Split limit + 1 fetched rows into the page and the cursor of the next one"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].name, rows[-1].id)
@@ -0,0 +1,13 @@
+# Compact JSON (de)serialization shared by the DB layer and the API responses
+
+import orjson
+
+
+def json_dumps(obj) -> str:
+    """Serialize to compact JSON text (used for JSONB columns)"""
+    return orjson.dumps(obj).decode("utf-8")
+
+
+def json_loads(data):
+    """Parse JSON text or bytes"""
+    return orjson.loads(data)
@@ -0,0 +1,125 @@
+#  Per-user cache of the serialized GET /folder tree
+#  Entries are keyed by users.tree_version, which every folder/file mutation bumps
+#  in the same transaction, so a cached tree is served only while the version it
+#  was built from is still current. Concurrent misses for the same user and version
+#  share a single database fetch. The cache lives in the worker process; each
+#  worker fills its own, the version check keeps them all correct.
+
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.metrics import record_cache
+from app.database.db import mark_written
+from app.models.models import User
+
+TREE_CACHE_MAX_USERS = int(os.getenv("TREE_CACHE_MAX_USERS", "10000"))
+
+
+async def bump_tree_version(db: AsyncSession, user_id: str):
+    """Invalidate the cached folder tree of a user (call before committing)"""
+    await db.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(tree_version=User.tree_version + 1)
+    )
+    # The tree endpoints read from the primary until the replica has the change
+    mark_written(f"tree:{user_id}")
+
+
+def tree_etag(user_id: str, version: int) -> str:
+    # The user is part of the tag so switching accounts never matches a stale tree
+    user_digest = hashlib.sha1(user_id.encode()).hexdigest()[:12]
+    return f'"{user_digest}-{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """True if an If-None-Match header lists the ETag (weak comparison)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = (tag.strip() for tag in if_none_match.split(","))
+    return etag in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+@dataclass
+class TreeCache:
+    max_users: int = TREE_CACHE_MAX_USERS
+    # user_id -> (version, serialized tree), least recently used first
+    _entries: "OrderedDict[str, Tuple[int, str]]" = field(default_factory=OrderedDict)
+    _inflight: Dict[Tuple[str, int], asyncio.Future] = field(default_factory=dict)
+
+    def get(self, user_id: str, version: int) -> Optional[str]:
+        """Serialized tree of a user if it was built from this version"""
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] != version:
+            return None
+        self._entries.move_to_end(user_id)
+        return entry[1]
+
+    def put(self, user_id: str, version: int, body: str):
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > version:
+            return
+        self._entries[user_id] = (version, body)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_users:
+            self._entries.popitem(last=False)
+
+    async def load(
+        self, user_id: str, version: int, fetch: Callable[[], Awaitable[str]]
+    ) -> str:
+        """
+        Cached tree of a user, fetching it once for all concurrent callers on a miss.
+
+        Args:
+            user_id (str): Owner of the tree
+            version (int): Current tree_version of the user
+            fetch (callable): Coroutine function building the serialized tree
+
+        Returns:
+            str: Serialized tree
+        """
+        body = self.get(user_id, version)
+        record_cache("folder_tree", body is not None)
+        if body is not None:
+            return body
+
+        key = (user_id, version)
+        future = self._inflight.get(key)
+        if future is not None:
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The request doing the fetch went away, fetch for ourselves
+                if not future.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        # Mark the result as retrieved even when nobody else waited for it
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            body = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        self.put(user_id, version, body)
+        future.set_result(body)
+        return body
+
+
+tree_cache = TreeCache()
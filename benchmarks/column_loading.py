@@ -0,0 +1,225 @@
+"""Bytes fetched and latency of the existence/ownership checks, full rows vs columns.
+
+Seeds notes and files with realistic content and transcript sizes into a scratch
+schema (`bench_columns`) of the database in DATABASE_URI, then runs every hot
+check the way the routers used to (whole ORM rows, deferred columns undeferred)
+and the way they do now (EXISTS or only the needed columns). For each query it
+prints the payload received by the client (text protocol bytes of the returned
+values) and the median latency. The schema is dropped at the end.
+
+    python -m benchmarks.column_loading --users 200 --files 50 --note-kb 20
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, exists, select, text
+from sqlalchemy.orm import Session, undefer
+
+from app.database.db import Base
+from app.models.models import File, Folder, Note
+from app.utils.serialization import json_dumps
+
+SCHEMA = "bench_columns"
+
+
+def seed(conn, users, files, note_kb):
+    conn.execute(
+        text(
+            """
+            INSERT INTO users (id, email, google_id)
+            SELECT 'user_' || u, 'user_' || u || '@example.com', 'google_' || u
+            FROM generate_series(1, :users) u
+            """
+        ),
+        {"users": users},
+    )
+    conn.execute(
+        text(
+            """
+            INSERT INTO folders (id, name, parent_id, user_id)
+            SELECT gen_random_uuid(), 'folder_' || f, NULL, 'user_' || u
+            FROM generate_series(1, :users) u, generate_series(1, 5) f
+            """
+        ),
+        {"users": users},
+    )
+    # Random text so TOAST compression does not hide the size of the columns
+    conn.execute(
+        text(
+            """
+            INSERT INTO notes (id, content, video_id, transcript)
+            SELECT gen_random_uuid(),
+                   jsonb_build_object('ops', jsonb_build_array(jsonb_build_object(
+                       'insert', (SELECT string_agg(md5(random()::text || v || g), ' ')
+                                  FROM generate_series(1, :note_kb * 30) g) || E'\\n'))),
+                   lpad(v::text, 11, '0'),
+                   (SELECT string_agg(md5(random()::text || v || g), ' ')
+                    FROM generate_series(1, :note_kb * 90) g)
+            FROM generate_series(1, :videos) v
+            """
+        ),
+        {"videos": users * files // 4, "note_kb": note_kb},
+    )
+    conn.execute(
+        text(
+            """
+            INSERT INTO files (id, name, content, video_id, folder_id, user_id)
+            SELECT gen_random_uuid(), 'file_' || n, notes.content, notes.video_id,
+                   f.id, f.user_id
+            FROM folders f
+            CROSS JOIN generate_series(1, :per_folder) n
+            JOIN notes ON notes.video_id = lpad((1 + (hashtext(f.id::text || n)
+                         & 2147483647) % (:users * :files / 4))::text, 11, '0')
+            """
+        ),
+        {"users": users, "files": files, "per_folder": max(files // 5, 1)},
+    )
+    conn.execute(text("ANALYZE"))
+
+
+def sample_params(conn, users):
+    user_id = f"user_{users // 2}"
+    file = conn.execute(
+        text(
+            "SELECT id, name, video_id, folder_id FROM files WHERE user_id = :u LIMIT 1"
+        ),
+        {"u": user_id},
+    ).one()
+    return {
+        "user_id": user_id,
+        "file_id": file.id,
+        "file_name": file.name,
+        "folder_id": file.folder_id,
+        "video_id": file.video_id,
+    }
+
+
+def statements(p):
+    """(label, before, after) for each hot check"""
+    file_name_check = (
+        File.folder_id == p["folder_id"],
+        File.name == p["file_name"],
+        File.user_id == p["user_id"],
+    )
+    video_check = (File.video_id == p["video_id"], File.user_id == p["user_id"])
+    sibling_check = (
+        Folder.parent_id.is_(None),
+        Folder.name == "folder_1",
+        Folder.user_id == p["user_id"],
+    )
+    return [
+        (
+            "duplicate file check (POST /note)",
+            select(File)
+            .options(undefer(File.content))
+            .where(*file_name_check)
+            .limit(1),
+            select(exists().where(*file_name_check)),
+        ),
+        (
+            "note by video (POST /note)",
+            select(Note)
+            .options(undefer(Note.content), undefer(Note.transcript))
+            .where(Note.video_id == p["video_id"])
+            .limit(1),
+            select(Note.content).where(Note.video_id == p["video_id"]).limit(1),
+        ),
+        (
+            "video ownership (/note/ask)",
+            select(File).options(undefer(File.content)).where(*video_check).limit(1),
+            select(exists().where(*video_check)),
+        ),
+        (
+            "file lookup (PUT /rename_file)",
+            select(File)
+            .options(undefer(File.content))
+            .where(File.id == p["file_id"], File.user_id == p["user_id"]),
+            select(File.name).where(
+                File.id == p["file_id"], File.user_id == p["user_id"]
+            ),
+        ),
+        (
+            "sibling folder check (POST /folder)",
+            select(Folder).where(*sibling_check).limit(1),
+            select(exists().where(*sibling_check)),
+        ),
+    ]
+
+
+def payload_bytes(rows):
+    """Approximate wire size of the returned values (text protocol)"""
+    size = 0
+    for row in rows:
+        for value in row:
+            if isinstance(value, (File, Note, Folder)):
+                size += payload_bytes(
+                    [[getattr(value, c.key) for c in value.__mapper__.column_attrs]]
+                )
+            elif isinstance(value, dict):
+                size += len(json_dumps(value).encode())
+            elif value is not None:
+                size += len(str(value).encode())
+    return size
+
+
+def measure(engine, stmt, repeat):
+    timings = []
+    with Session(engine) as session:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = session.execute(stmt).all()
+            timings.append((time.perf_counter() - started) * 1000)
+            size = payload_bytes(rows)
+            session.expunge_all()
+    return statistics.median(timings), size
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--files", type=int, default=50, help="files per user")
+    parser.add_argument("--note-kb", type=int, default=20, help="note size in kB")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    engine = create_engine(
+        os.environ["DATABASE_URI"],
+        connect_args={"options": f"-csearch_path={SCHEMA}"},
+    )
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    try:
+        with engine.begin() as conn:
+            Base.metadata.create_all(conn)
+            started = time.perf_counter()
+            seed(conn, args.users, args.files, args.note_kb)
+            counts = {
+                table: conn.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+                for table in ("users", "folders", "files", "notes")
+            }
+            print(f"seeded {counts} in {time.perf_counter() - started:.1f}s")
+            params = sample_params(conn, args.users)
+
+        print(
+            f"\n{'check':40} {'bytes before':>13} {'after':>7}   {'ms before':>9} {'after':>7}"
+        )
+        for label, before, after in statements(params):
+            before_ms, before_bytes = measure(engine, before, args.repeat)
+            after_ms, after_bytes = measure(engine, after, args.repeat)
+            print(
+                f"{label:40} {before_bytes:13,} {after_bytes:7,}   "
+                f"{before_ms:9.3f} {after_ms:7.3f}"
+            )
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
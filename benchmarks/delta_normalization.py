@@ -0,0 +1,92 @@
+"""Op-count and size reduction of delta normalization on stored notes.
+
+Reads the deltas stored in `notes.content` (written by the converter before
+normalization existed) and reports ops / bytes before and after `normalize`.
+
+    python -m benchmarks.delta_normalization [--limit 500]
+
+Without DATABASE_URI a generated sample note is used instead.
+"""
+
+import argparse
+import os
+import time
+
+import orjson
+from dotenv import load_dotenv
+
+from app.utils.delta import normalize
+from app.utils.markdown_delta import MarkdownDeltaStream
+
+SAMPLE_MARKDOWN = """# 🎬 Video summary
+
+## Key ideas
+- **Main point**: the *speaker* explains `asyncio` and __why__ it matters
+- **Nested _italic_ inside bold** and a plain tail with a_b snake_case word
+  - A nested bullet with **bold** text
+1. First step with `code`
+2. Second step
+> A memorable quote from the video
+
+```py
+print("hello")
+```
+---
+Plain paragraph closing the section with some more words.
+"""
+
+
+def load_stored_deltas(limit):
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(os.environ["DATABASE_URI"])
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text("SELECT content::text FROM notes ORDER BY created_at DESC LIMIT :n"),
+            {"n": limit},
+        ).fetchall()
+    return [orjson.loads(row[0]) for row in rows]
+
+
+def raw_converter_delta(markdown):
+    """Converter output without the normalization pass"""
+    stream = MarkdownDeltaStream()
+    stream._normalized = lambda ops, final: ops
+    return {"ops": stream.feed(markdown) + stream.close()}
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=int, default=500)
+    args = parser.parse_args()
+
+    if os.getenv("DATABASE_URI"):
+        deltas = load_stored_deltas(args.limit)
+        source = f"{len(deltas)} stored notes"
+    else:
+        deltas = [raw_converter_delta(SAMPLE_MARKDOWN * 30)]
+        source = "generated sample note"
+
+    ops_before = ops_after = bytes_before = bytes_after = 0
+    started = time.perf_counter()
+    for delta in deltas:
+        normalized = normalize(delta)
+        ops_before += len(delta["ops"])
+        ops_after += len(normalized["ops"])
+        bytes_before += len(orjson.dumps(delta))
+        bytes_after += len(orjson.dumps(normalized))
+    elapsed = time.perf_counter() - started
+
+    print(f"source:  {source}")
+    print(
+        f"ops:     {ops_before} -> {ops_after} ({ops_after / max(ops_before, 1):.1%})"
+    )
+    print(
+        f"bytes:   {bytes_before} -> {bytes_after} ({bytes_after / max(bytes_before, 1):.1%})"
+    )
+    print(f"time:    {elapsed * 1000 / max(len(deltas), 1):.2f} ms per note")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""Folder tree operations on a large tree: recursive CTE / row by row vs closure table.
+
+Seeds one user with a large folder tree (plus smaller background users) into a
+scratch schema (`bench_folder_tree`) of the database in DATABASE_URI, fills
+folder_closure the way the migration does, then times:
+
+- the whole tree of the user (GET /folder): recursive CTE vs one index scan
+- the folder ids of a subtree: recursive CTE vs closure lookup
+- deleting a subtree (DELETE /folder): load it and delete row by row, like the old
+  ORM cascade, vs one DELETE over the closure rows
+- moving a subtree under another folder (PUT /folder/move)
+
+Every write runs in a transaction that is rolled back. The schema is dropped at the end.
+
+    python -m benchmarks.folder_tree --folders 20000 --fanout 8
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+from app.database.db import Base
+from app.models import models  # noqa: F401  (registers the tables)
+
+SCHEMA = "bench_folder_tree"
+
+RECURSIVE_TREE = """
+    WITH RECURSIVE folder_tree AS (
+        SELECT id, name, parent_id, 0 AS level
+        FROM folders WHERE user_id = :user_id AND parent_id IS NULL
+        UNION ALL
+        SELECT f.id, f.name, f.parent_id, ft.level + 1
+        FROM folders f JOIN folder_tree ft ON f.parent_id = ft.id
+        WHERE f.user_id = :user_id
+    )
+    SELECT id, name, parent_id, level FROM folder_tree ORDER BY level, name
+"""
+FLAT_TREE = """
+    SELECT id, name, parent_id FROM folders WHERE user_id = :user_id ORDER BY name
+"""
+RECURSIVE_SUBTREE = """
+    WITH RECURSIVE subtree AS (
+        SELECT id FROM folders WHERE id = :folder_id
+        UNION ALL
+        SELECT f.id FROM folders f JOIN subtree s ON f.parent_id = s.id
+    )
+    SELECT id FROM subtree
+"""
+CLOSURE_SUBTREE = """
+    SELECT descendant_id FROM folder_closure WHERE ancestor_id = :folder_id
+"""
+CLOSURE_DELETE = """
+    DELETE FROM folders
+    WHERE id IN (SELECT descendant_id FROM folder_closure WHERE ancestor_id = :folder_id)
+      AND user_id = :user_id
+"""
+CLOSURE_MOVE = [
+    """
+    DELETE FROM folder_closure
+    WHERE descendant_id IN (
+            SELECT descendant_id FROM folder_closure WHERE ancestor_id = :folder_id)
+      AND ancestor_id IN (
+            SELECT ancestor_id FROM folder_closure
+            WHERE descendant_id = :folder_id AND ancestor_id != :folder_id)
+    """,
+    """
+    INSERT INTO folder_closure (ancestor_id, descendant_id, depth)
+    SELECT p.ancestor_id, s.descendant_id, p.depth + s.depth + 1
+    FROM folder_closure p, folder_closure s
+    WHERE p.descendant_id = :new_parent_id AND s.ancestor_id = :folder_id
+    """,
+    "UPDATE folders SET parent_id = :new_parent_id WHERE id = :folder_id",
+]
+
+
+def seed(conn, folders, fanout, files, background_users):
+    conn.execute(
+        text(
+            """
+            INSERT INTO users (id, email, google_id)
+            SELECT 'user_' || u, 'user_' || u || '@example.com', 'google_' || u
+            FROM generate_series(0, :users) u
+            """
+        ),
+        {"users": background_users},
+    )
+    # user_0 owns the large tree: folder n hangs below folder (n - roots - 1) / fanout + 1
+    conn.execute(
+        text(
+            """
+            INSERT INTO folders (id, name, parent_id, user_id)
+            SELECT md5('f' || n)::uuid, 'folder_' || n,
+                   CASE WHEN n <= :roots THEN NULL
+                        ELSE md5('f' || ((n - :roots - 1) / :fanout + 1))::uuid END,
+                   'user_0'
+            FROM generate_series(1, :folders) n
+            """
+        ),
+        {"folders": folders, "fanout": fanout, "roots": fanout},
+    )
+    conn.execute(
+        text(
+            """
+            INSERT INTO folders (id, name, parent_id, user_id)
+            SELECT gen_random_uuid(), 'folder_' || f, NULL, 'user_' || u
+            FROM generate_series(1, :users) u, generate_series(1, 20) f
+            """
+        ),
+        {"users": background_users},
+    )
+    conn.execute(
+        text(
+            """
+            INSERT INTO files (id, name, content, video_id, folder_id, user_id)
+            SELECT gen_random_uuid(), 'file_' || n, NULL, 'video' || n, id, user_id
+            FROM folders, generate_series(1, :files) n
+            """
+        ),
+        {"files": files},
+    )
+    conn.execute(
+        text(
+            """
+            INSERT INTO folder_closure (ancestor_id, descendant_id, depth)
+            WITH RECURSIVE paths AS (
+                SELECT id AS ancestor_id, id AS descendant_id, 0 AS depth FROM folders
+                UNION ALL
+                SELECT paths.ancestor_id, folders.id, paths.depth + 1
+                FROM paths JOIN folders ON folders.parent_id = paths.descendant_id
+            )
+            SELECT ancestor_id, descendant_id, depth FROM paths
+            """
+        )
+    )
+    conn.execute(text("ANALYZE"))
+
+
+def timed(engine, statements, params, repeat):
+    timings = []
+    for _ in range(repeat):
+        with engine.connect() as conn:
+            transaction = conn.begin()
+            started = time.perf_counter()
+            for sql in statements:
+                result = conn.execute(text(sql), params)
+                if result.returns_rows:
+                    result.all()
+            timings.append((time.perf_counter() - started) * 1000)
+            transaction.rollback()
+    return statistics.median(timings)
+
+
+def timed_row_by_row_delete(engine, params, repeat):
+    """Like the old ORM cascade: load the subtree and its files, delete each row"""
+    timings = []
+    for _ in range(repeat):
+        with engine.connect() as conn:
+            transaction = conn.begin()
+            started = time.perf_counter()
+            pending = [params["folder_id"]]
+            subtree = []
+            while pending:
+                folder_id = pending.pop()
+                subtree.append(folder_id)
+                for (file_id,) in conn.execute(
+                    text("SELECT id FROM files WHERE folder_id = :id"),
+                    {"id": folder_id},
+                ):
+                    conn.execute(
+                        text("DELETE FROM files WHERE id = :id"), {"id": file_id}
+                    )
+                pending.extend(
+                    row.id
+                    for row in conn.execute(
+                        text("SELECT id FROM folders WHERE parent_id = :id"),
+                        {"id": folder_id},
+                    )
+                )
+            for folder_id in reversed(subtree):
+                conn.execute(
+                    text("DELETE FROM folders WHERE id = :id"), {"id": folder_id}
+                )
+            timings.append((time.perf_counter() - started) * 1000)
+            transaction.rollback()
+    return statistics.median(timings)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--folders", type=int, default=20000, help="folders of the large tree"
+    )
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--files", type=int, default=2, help="files per folder")
+    parser.add_argument("--background-users", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    engine = create_engine(
+        os.environ["DATABASE_URI"],
+        connect_args={"options": f"-csearch_path={SCHEMA}"},
+    )
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    try:
+        with engine.begin() as conn:
+            Base.metadata.create_all(conn)
+            started = time.perf_counter()
+            seed(conn, args.folders, args.fanout, args.files, args.background_users)
+            counts = {
+                table: conn.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+                for table in ("folders", "folder_closure", "files")
+            }
+            print(f"seeded {counts} in {time.perf_counter() - started:.1f}s")
+            # A top-level folder of the large tree and another one to move it under
+            subtree_root, new_parent = conn.execute(
+                text("SELECT md5('f1')::uuid, md5('f2')::uuid")
+            ).one()
+            subtree_size = conn.execute(
+                text(CLOSURE_SUBTREE), {"folder_id": subtree_root}
+            ).rowcount
+
+        params = {
+            "user_id": "user_0",
+            "folder_id": subtree_root,
+            "new_parent_id": new_parent,
+        }
+        rows = [
+            (
+                f"whole tree of the user ({args.folders} folders)",
+                timed(engine, [RECURSIVE_TREE], params, args.repeat),
+                timed(engine, [FLAT_TREE], params, args.repeat),
+            ),
+            (
+                f"subtree ids ({subtree_size} folders)",
+                timed(engine, [RECURSIVE_SUBTREE], params, args.repeat),
+                timed(engine, [CLOSURE_SUBTREE], params, args.repeat),
+            ),
+            (
+                "delete subtree with its files",
+                timed_row_by_row_delete(engine, params, max(args.repeat // 5, 1)),
+                timed(engine, [CLOSURE_DELETE], params, args.repeat),
+            ),
+        ]
+        move_ms = timed(engine, CLOSURE_MOVE, params, args.repeat)
+
+        print(f"\n{'operation':45} {'before ms':>10} {'closure ms':>11}")
+        for label, before, after in rows:
+            print(f"{label:45} {before:10.1f} {after:11.1f}  ({before / after:.1f}x)")
+        print(f"{'move subtree under another folder':45} {'-':>10} {move_ms:11.1f}")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""GET /folder tree built in Python vs as JSON inside Postgres (folder_tree_json).
+
+Seeds one user with a large tree (10k folders and 10k files by default) plus
+background users into a scratch schema (`bench_folder_tree_json`) of the database
+in DATABASE_URI, then times the serialized tree of that user built:
+
+- in Python from the recursive CTE and a files query with an IN list of every
+  folder id (the original get_folders)
+- in Python from one folder scan and one files scan
+- by folder_tree_json() in one statement, returned as text
+
+Both Python builds are checked to give the same tree as the SQL function. The
+schema is dropped at the end.
+
+    python -m benchmarks.folder_tree_json --folders 10000 --files 1
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+from app.database.db import Base
+from app.models import models  # noqa: F401  (registers the tables and the function)
+from app.utils.serialization import json_dumps, json_loads
+from benchmarks.folder_tree import RECURSIVE_TREE, seed
+
+SCHEMA = "bench_folder_tree_json"
+
+
+def build_in_python(conn, user_id, recursive):
+    if recursive:
+        folder_rows = conn.execute(text(RECURSIVE_TREE), {"user_id": user_id}).all()
+        file_rows = conn.execute(
+            text(
+                "SELECT id, name, folder_id, video_id FROM files "
+                "WHERE user_id = :user_id AND folder_id IN :folder_ids"
+            ).bindparams(folder_ids=tuple(row.id for row in folder_rows) or (None,)),
+            {"user_id": user_id},
+        ).all()
+    else:
+        folder_rows = conn.execute(
+            text(
+                "SELECT id, name, parent_id FROM folders "
+                "WHERE user_id = :user_id ORDER BY name"
+            ),
+            {"user_id": user_id},
+        ).all()
+        file_rows = conn.execute(
+            text(
+                "SELECT id, name, folder_id, video_id FROM files WHERE user_id = :user_id"
+            ),
+            {"user_id": user_id},
+        ).all()
+
+    folders_dict = {}
+    for row in folder_rows:
+        folders_dict[str(row.id)] = {
+            "id": str(row.id),
+            "name": row.name,
+            "parent_id": str(row.parent_id) if row.parent_id else None,
+            "subfolders": [],
+            "files": [],
+        }
+    for file in file_rows:
+        folder_id = str(file.folder_id)
+        if folder_id in folders_dict:
+            folders_dict[folder_id]["files"].append(
+                {
+                    "id": str(file.id),
+                    "name": file.name,
+                    "video_id": file.video_id,
+                    "folder_id": folder_id,
+                }
+            )
+    folder_tree = []
+    for folder_data in folders_dict.values():
+        parent_id = folder_data["parent_id"]
+        if not parent_id:
+            folder_tree.append(folder_data)
+        elif parent_id in folders_dict:
+            folders_dict[parent_id]["subfolders"].append(folder_data)
+    return json_dumps({"folders": folder_tree})
+
+
+def build_in_postgres(conn, user_id):
+    return conn.execute(
+        text("SELECT folder_tree_json(:user_id)::text"), {"user_id": user_id}
+    ).scalar()
+
+
+def canonical(body):
+    """Tree with siblings and files sorted by (name, id), to compare builds"""
+
+    def sort_folder(folder):
+        folder["files"].sort(key=lambda f: (f["name"], f["id"]))
+        folder["subfolders"].sort(key=lambda f: (f["name"], f["id"]))
+        for subfolder in folder["subfolders"]:
+            sort_folder(subfolder)
+        return folder
+
+    tree = json_loads(body)
+    return sorted(
+        (sort_folder(folder) for folder in tree["folders"]),
+        key=lambda f: (f["name"], f["id"]),
+    )
+
+
+def timed(engine, build, repeat):
+    timings = []
+    with engine.connect() as conn:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            body = build(conn)
+            timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), body
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--folders", type=int, default=10000, help="folders of the large tree"
+    )
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--files", type=int, default=1, help="files per folder")
+    parser.add_argument("--background-users", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    engine = create_engine(
+        os.environ["DATABASE_URI"],
+        connect_args={"options": f"-csearch_path={SCHEMA}"},
+    )
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    try:
+        with engine.begin() as conn:
+            Base.metadata.create_all(conn)
+            seed(conn, args.folders, args.fanout, args.files, args.background_users)
+
+        builds = [
+            (
+                "python, recursive CTE + IN list",
+                lambda conn: build_in_python(conn, "user_0", recursive=True),
+            ),
+            (
+                "python, folder scan + files scan",
+                lambda conn: build_in_python(conn, "user_0", recursive=False),
+            ),
+            (
+                "postgres, folder_tree_json()",
+                lambda conn: build_in_postgres(conn, "user_0"),
+            ),
+        ]
+        results = [
+            (label, *timed(engine, build, args.repeat)) for label, build in builds
+        ]
+
+        expected = canonical(results[-1][2])
+        print(
+            f"user_0: {args.folders} folders, {args.folders * args.files} files, "
+            f"{len(results[-1][2].encode()) / 1024:.0f} kB of JSON\n"
+        )
+        print(f"{'build':36} {'median ms':>10}  same tree")
+        for label, median_ms, body in results:
+            print(f"{label:36} {median_ms:10.1f}  {canonical(body) == expected}")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""Query plans and latencies of the router lookups with and without the hot indexes.
+
+Seeds a synthetic dataset into a scratch schema (`bench_indexes`) of the
+database in DATABASE_URI, then for every hot router query prints the plan
+(EXPLAIN ANALYZE) and the median latency, first with the indexes declared in
+app/models/models.py, then after dropping them. The schema is dropped at the end.
+
+    python -m benchmarks.index_plans --users 2000 --folders 50 --files 200
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+from app.database.db import Base
+from app.models import models  # noqa: F401  (registers the tables)
+
+SCHEMA = "bench_indexes"
+
+HOT_INDEXES = [
+    "ix_files_user_folder_name",
+    "ix_files_user_video",
+    "ix_folders_user_parent_name",
+    "uq_notes_video_id",
+    "ix_subscriptions_user_status_period_end",
+]
+
+QUERIES = {
+    "duplicate file check (POST /note)": """
+        SELECT id FROM files
+        WHERE folder_id = :file_folder_id AND name = :file_name AND user_id = :user_id
+        LIMIT 1
+    """,
+    "video ownership (/note/ask)": """
+        SELECT id FROM files WHERE video_id = :video_id AND user_id = :user_id LIMIT 1
+    """,
+    "note by video (POST /note)": """
+        SELECT id FROM notes WHERE video_id = :video_id LIMIT 1
+    """,
+    "sibling folder check (POST /folder)": """
+        SELECT id FROM folders
+        WHERE parent_id = :folder_id AND name = :folder_name AND user_id = :user_id
+        LIMIT 1
+    """,
+    "folder tree CTE (GET /folder)": """
+        WITH RECURSIVE folder_tree AS (
+            SELECT id, name, parent_id, 0 AS level
+            FROM folders WHERE user_id = :user_id AND parent_id IS NULL
+            UNION ALL
+            SELECT f.id, f.name, f.parent_id, ft.level + 1
+            FROM folders f JOIN folder_tree ft ON f.parent_id = ft.id
+            WHERE f.user_id = :user_id
+        )
+        SELECT id, name, parent_id, level FROM folder_tree ORDER BY level, name
+    """,
+    "active subscription (every request)": """
+        SELECT id FROM subscriptions
+        WHERE user_id = :user_id AND status = 'active' AND current_period_end > now()
+        LIMIT 1
+    """,
+}
+
+
+def seed(conn, users, folders, files):
+    conn.execute(
+        text(
+            """
+            INSERT INTO users (id, email, google_id)
+            SELECT 'user_' || u, 'user_' || u || '@example.com', 'google_' || u
+            FROM generate_series(1, :users) u
+            """
+        ),
+        {"users": users},
+    )
+    # Roots, then each level picks a parent among the previous level
+    roots = max(folders // 5, 1)
+    conn.execute(
+        text(
+            """
+            INSERT INTO folders (id, name, parent_id, user_id)
+            SELECT gen_random_uuid(), 'folder_' || f, NULL, 'user_' || u
+            FROM generate_series(1, :users) u, generate_series(1, :roots) f
+            """
+        ),
+        {"users": users, "roots": roots},
+    )
+    remaining = folders - roots
+    level = 0
+    while remaining > 0:
+        batch = min(remaining, roots * 2 ** (level + 1))
+        conn.execute(
+            text(
+                """
+                INSERT INTO folders (id, name, parent_id, user_id)
+                SELECT gen_random_uuid(), 'sub_' || :level || '_' || n, p.id, p.user_id
+                FROM (
+                    SELECT id, user_id,
+                           row_number() OVER (PARTITION BY user_id ORDER BY id) AS rn
+                    FROM folders
+                ) p, generate_series(1, 2) n
+                WHERE p.rn <= :batch / 2 + 1
+                """
+            ),
+            {"level": level, "batch": batch},
+        )
+        remaining -= batch
+        level += 1
+    conn.execute(
+        text(
+            """
+            INSERT INTO notes (id, content, video_id, transcript)
+            SELECT gen_random_uuid(), '{"ops": [{"insert": "note\\n"}]}',
+                   lpad(v::text, 11, '0'), repeat('transcript ', 200)
+            FROM generate_series(1, :videos) v
+            """
+        ),
+        {"videos": users * files // 4},
+    )
+    conn.execute(
+        text(
+            """
+            INSERT INTO files (id, name, content, video_id, folder_id, user_id)
+            SELECT gen_random_uuid(), 'file_' || n, '{"ops": [{"insert": "note\\n"}]}',
+                   lpad((1 + (hashtext(f.id::text || n) & 2147483647)
+                         % (:users * :files / 4))::text, 11, '0'),
+                   f.id, f.user_id
+            FROM (
+                SELECT id, user_id,
+                       row_number() OVER (PARTITION BY user_id ORDER BY id) AS rn
+                FROM folders
+            ) f, generate_series(1, :per_folder) n
+            WHERE f.rn <= 10
+            """
+        ),
+        {"users": users, "files": files, "per_folder": max(files // 10, 1)},
+    )
+    conn.execute(
+        text(
+            """
+            INSERT INTO subscriptions
+                (id, user_id, paddle_subscription_id, plan_id, status,
+                 current_period_end, cancel_at_period_end)
+            SELECT gen_random_uuid(), 'user_' || u, 'sub_' || u || '_' || s, 'monthly',
+                   CASE WHEN s = 1 THEN 'canceled' ELSE 'active' END,
+                   now() + (s - 1) * interval '30 days', false
+            FROM generate_series(1, :users) u, generate_series(1, 2) s
+            """
+        ),
+        {"users": users},
+    )
+    conn.execute(text("ANALYZE"))
+
+
+def sample_params(conn, users):
+    user_id = f"user_{users // 2}"
+    file = conn.execute(
+        text("SELECT name, video_id, folder_id FROM files WHERE user_id = :u LIMIT 1"),
+        {"u": user_id},
+    ).one()
+    folder = conn.execute(
+        text(
+            "SELECT parent_id, name FROM folders "
+            "WHERE user_id = :u AND parent_id IS NOT NULL LIMIT 1"
+        ),
+        {"u": user_id},
+    ).one()
+    return {
+        "user_id": user_id,
+        "folder_id": folder.parent_id,
+        "folder_name": folder.name,
+        "file_name": file.name,
+        "file_folder_id": file.folder_id,
+        "video_id": file.video_id,
+    }
+
+
+def run_queries(conn, params, repeat):
+    results = {}
+    for label, sql in QUERIES.items():
+        plan = (
+            conn.execute(text("EXPLAIN (ANALYZE, BUFFERS) " + sql), params)
+            .scalars()
+            .all()
+        )
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            conn.execute(text(sql), params).fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[label] = (statistics.median(timings), plan)
+    return results
+
+
+def print_results(title, results):
+    print(f"\n=== {title} ===")
+    for label, (median_ms, plan) in results.items():
+        print(f"\n-- {label}: median {median_ms:.3f} ms")
+        for line in plan:
+            print(f"   {line}")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--folders", type=int, default=50, help="folders per user")
+    parser.add_argument("--files", type=int, default=200, help="files per user")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    engine = create_engine(
+        os.environ["DATABASE_URI"],
+        connect_args={"options": f"-csearch_path={SCHEMA}"},
+    )
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    try:
+        with engine.begin() as conn:
+            Base.metadata.create_all(conn)
+            started = time.perf_counter()
+            seed(conn, args.users, args.folders, args.files)
+            counts = {
+                table: conn.execute(text(f"SELECT count(*) FROM {table}")).scalar()
+                for table in ("users", "folders", "files", "notes", "subscriptions")
+            }
+            print(f"seeded {counts} in {time.perf_counter() - started:.1f}s")
+
+        with engine.connect() as conn:
+            params = sample_params(conn, args.users)
+            with_indexes = run_queries(conn, params, args.repeat)
+
+        with engine.begin() as conn:
+            for name in HOT_INDEXES:
+                conn.execute(text(f"DROP INDEX {SCHEMA}.{name}"))
+            conn.execute(text("ANALYZE"))
+
+        with engine.connect() as conn:
+            without_indexes = run_queries(conn, params, args.repeat)
+
+        print_results("without hot indexes", without_indexes)
+        print_results("with hot indexes", with_indexes)
+        print("\n=== summary (median ms) ===")
+        for label in QUERIES:
+            before = without_indexes[label][0]
+            after = with_indexes[label][0]
+            print(f"{label:40} {before:9.3f} -> {after:7.3f}  ({before / after:.0f}x)")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
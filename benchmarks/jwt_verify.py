@@ -0,0 +1,127 @@
+"""JWT verifications per second: python-jose on every request vs app.core.token_verifier.
+
+Signs tokens like create_token does, checks that every backend accepts them with the
+same claims and rejects tampered and expired ones, then reports verifications per
+second of:
+
+- jwt.decode from python-jose, what verify_token did before
+- each available backend, without the cache (a token seen for the first time)
+- TokenVerifier with a warm cache, cycling over --tokens distinct tokens
+
+No database needed.
+
+    python -m benchmarks.jwt_verify --algorithm HS256
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+from jose import jwt
+from jose.exceptions import ExpiredSignatureError, JWTError
+
+from app.core.token_verifier import BACKENDS, TokenVerifier
+
+KEY = "benchmark-secret-" + "x" * 32
+
+
+def make_token(algorithm, minutes=60, n=0):
+    claims = {
+        "name": f"User {n}",
+        "email": f"user{n}@example.com",
+        "image": "https://lh3.googleusercontent.com/a/" + "x" * 80,
+        "subscribed": True,
+        "jti": uuid4().hex,
+        "exp": datetime.now(timezone.utc) + timedelta(minutes=minutes),
+    }
+    return jwt.encode(claims, KEY, algorithm=algorithm)
+
+
+def rate(verify, tokens, seconds):
+    """Verifications per second, cycling over the tokens for about `seconds`"""
+    done = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for token in tokens:
+            verify(token)
+        done += len(tokens)
+    return done / (time.perf_counter() - started)
+
+
+def check(backend, algorithm):
+    token = make_token(algorithm)
+    assert backend.decode(token) == jwt.decode(token, KEY, algorithms=[algorithm])
+    header, payload, signature = token.split(".")
+    tampered = [
+        f"{header}.{payload}.{signature[:-2]}AA",
+        f"{header}.{make_token(algorithm).split('.')[1]}.{signature}",
+        token[:-1],
+        "not.a.token",
+    ]
+    for bad in tampered:
+        try:
+            backend.decode(bad)
+        except JWTError:
+            continue
+        raise AssertionError(f"{backend.name} accepted a tampered token")
+    try:
+        backend.decode(make_token(algorithm, minutes=-1))
+        raise AssertionError(f"{backend.name} accepted an expired token")
+    except ExpiredSignatureError:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--algorithm", default="HS256")
+    parser.add_argument(
+        "--tokens", type=int, default=1000, help="distinct tokens (users)"
+    )
+    parser.add_argument("--seconds", type=float, default=2.0, help="per measurement")
+    args = parser.parse_args()
+
+    tokens = [make_token(args.algorithm, n=n) for n in range(args.tokens)]
+    rows = [
+        (
+            "python-jose jwt.decode (before)",
+            rate(
+                lambda t: jwt.decode(t, KEY, algorithms=[args.algorithm]),
+                tokens,
+                args.seconds,
+            ),
+        )
+    ]
+    backends = []
+    for name, backend_class in BACKENDS.items():
+        try:
+            backend = backend_class(KEY, args.algorithm)
+        except ValueError as e:
+            print(f"skipping {name}: {e}")
+            continue
+        check(backend, args.algorithm)
+        backends.append(backend)
+        rows.append(
+            (f"{name} backend, uncached", rate(backend.decode, tokens, args.seconds))
+        )
+    for backend in backends:
+        verifier = TokenVerifier(backend)
+        for token in tokens:
+            verifier.verify(token)
+        rows.append(
+            (
+                f"{backend.name} backend, cache hit",
+                rate(verifier.verify, tokens, args.seconds),
+            )
+        )
+
+    baseline = rows[0][1]
+    print(f"\n{args.algorithm}, {args.tokens} tokens of {len(tokens[0])} bytes\n")
+    print(f"{'verification':36} {'per second':>12}")
+    for label, per_second in rows:
+        print(f"{label:36} {per_second:12,.0f}  ({per_second / baseline:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Concurrent load test for the read endpoints.
+
+Runs N concurrent clients against a running API for a fixed duration and
+reports requests per second and latency percentiles per route. Run it
+against the same data before and after a change to compare.
+
+    python -m benchmarks.load_test --base-url http://localhost:8000 \
+        --token <access_token cookie> --note-id <file id> --concurrency 50
+
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from collections import defaultdict
+
+import httpx
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def worker(client, paths, deadline, latencies, errors):
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            response = await client.get(path)
+            if response.status_code >= 400:
+                errors[path] += 1
+        except httpx.HTTPError:
+            errors[path] += 1
+        latencies[path].append((time.perf_counter() - started) * 1000)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--token", required=True, help="access_token cookie value")
+    parser.add_argument("--note-id", help="file id used for GET /note/{id}")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30.0)
+    args = parser.parse_args()
+
+    paths = ["/folder", "/status"]
+    if args.note_id:
+        paths.append(f"/note/{args.note_id}")
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.base_url,
+        cookies={"access_token": args.token},
+        limits=limits,
+        timeout=60.0,
+    ) as client:
+        deadline = time.perf_counter() + args.duration
+        await asyncio.gather(
+            *(
+                worker(client, paths, deadline, latencies, errors)
+                for _ in range(args.concurrency)
+            )
+        )
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"concurrency={args.concurrency} duration={args.duration}s")
+    print(f"total: {total / args.duration:.1f} req/s")
+    for path, values in latencies.items():
+        print(
+            f"{path:40} {len(values) / args.duration:8.1f} req/s"
+            f"  p50={statistics.median(values):7.1f}ms"
+            f"  p95={percentile(values, 95):7.1f}ms"
+            f"  p99={percentile(values, 99):7.1f}ms"
+            f"  errors={errors[path]}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,233 @@
+"""Searching the notes of a user: ILIKE over the delta JSON vs full-text search.
+
+Seeds one user with thousands of files (a third with their own edited text, the
+others still sharing their video's note) plus background users into a scratch schema
+(`bench_note_search`) of the database in DATABASE_URI, then times, for a rare word,
+a word and a two-word query of one topic, and a word found in every note:
+
+- ILIKE over files.content / notes.content cast to text, what a LIKE search would do
+- the /notes/search query: GIN lookups on search_vector, ts_rank, ts_headline on the
+  returned page
+
+The schema is dropped at the end.
+
+    python -m benchmarks.note_search --files 5000
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+
+from app.database.db import Base
+from app.models import models  # noqa: F401  (registers the tables)
+
+SCHEMA = "bench_note_search"
+
+# Notes are about one of TOPICS topics, topic 0 uses these words; each note
+# also contains a filler word every 50 words and one out of 200 the rare word
+TOPIC_WORDS = [
+    "gradient",
+    "descent",
+    "learning",
+    "rate",
+    "model",
+    "training",
+    "layer",
+    "network",
+    "function",
+    "value",
+    "loss",
+    "weight",
+    "batch",
+    "epoch",
+    "tensor",
+    "optimizer",
+]
+TOPICS = 20
+RARE_WORD = "backpropagation"
+FILLER_WORD = "lorem"
+
+LIKE_SEARCH = """
+    SELECT f.id FROM files f
+    LEFT JOIN notes n ON f.content IS NULL AND n.video_id = f.video_id
+    WHERE f.user_id = :user_id
+      AND (f.content::text ILIKE :pattern OR n.content::text ILIKE :pattern)
+    LIMIT 10
+"""
+# Same statement as GET /notes/search
+FULL_TEXT_SEARCH = """
+    WITH matches AS (
+        SELECT f.id, ts_rank(f.search_vector, websearch_to_tsquery('english', :q)) AS rank
+        FROM files f
+        WHERE f.user_id = :user_id
+          AND f.search_vector @@ websearch_to_tsquery('english', :q)
+        UNION ALL
+        SELECT f.id, ts_rank(n.search_vector, websearch_to_tsquery('english', :q))
+        FROM files f JOIN notes n ON n.video_id = f.video_id
+        WHERE f.user_id = :user_id AND f.content_text IS NULL
+          AND n.search_vector @@ websearch_to_tsquery('english', :q)
+    ), best AS (
+        SELECT id, sum(rank) AS rank FROM matches
+        GROUP BY id ORDER BY sum(rank) DESC, id LIMIT 10
+    )
+    SELECT f.id, f.name, best.rank,
+           ts_headline('english',
+                       replace(replace(replace(coalesce(f.content_text, n.content_text),
+                                               '&', '&amp;'), '<', '&lt;'), '>', '&gt;'),
+                       websearch_to_tsquery('english', :q),
+                       'StartSel=<mark>, StopSel=</mark>, MaxFragments=3, MaxWords=20, MinWords=8')
+    FROM files f JOIN best ON best.id = f.id
+    LEFT JOIN notes n ON f.content_text IS NULL AND n.video_id = f.video_id
+    ORDER BY best.rank DESC, f.id
+"""
+
+
+def seed(conn, files, words, background_users, background_files):
+    conn.execute(
+        text(
+            """
+            INSERT INTO users (id, email, google_id)
+            SELECT 'user_' || u, 'user_' || u || '@example.com', 'google_' || u
+            FROM generate_series(0, :users) u
+            """
+        ),
+        {"users": background_users},
+    )
+    conn.execute(
+        text(
+            """
+            INSERT INTO folders (id, name, parent_id, user_id)
+            SELECT md5('root' || u)::uuid, 'root', NULL, 'user_' || u
+            FROM generate_series(0, :users) u
+            """
+        ),
+        {"users": background_users},
+    )
+    # One note per video
+    conn.execute(
+        text(
+            """
+            INSERT INTO notes (id, video_id, content, content_text)
+            SELECT gen_random_uuid(), 'v' || n, jsonb_build_object(
+                       'ops', jsonb_build_array(jsonb_build_object('insert', body || E'\n'))),
+                   body || E'\n'
+            FROM generate_series(1, :notes) n,
+            LATERAL (
+                SELECT string_agg(
+                           CASE WHEN n % 200 = 0 AND w = 1 THEN :rare
+                                WHEN w % 50 = 0 THEN :filler
+                                WHEN n % :topics = 0
+                                    THEN (:topic_words)[1 + floor(random() * :size)::int]
+                                ELSE 'topic' || n % :topics || 'word'
+                                     || floor(random() * 300)::int END,
+                           ' ') AS body
+                FROM generate_series(1, :words + n % 2) w
+            ) text
+            """
+        ),
+        {
+            "notes": files + background_users * background_files,
+            "words": words,
+            "rare": RARE_WORD,
+            "filler": FILLER_WORD,
+            "topics": TOPICS,
+            "topic_words": TOPIC_WORDS,
+            "size": len(TOPIC_WORDS),
+        },
+    )
+    # Every video has one file: user_0 owns the first :files, each background user
+    # :background_files of the others; one file out of 3 is edited (has its own text)
+    conn.execute(
+        text(
+            """
+            INSERT INTO files (id, name, content, content_text, video_id, folder_id, user_id)
+            SELECT gen_random_uuid(), 'file_' || n,
+                   CASE WHEN n % 3 = 0 THEN notes.content END,
+                   CASE WHEN n % 3 = 0 THEN notes.content_text END,
+                   notes.video_id, md5('root' || owner)::uuid, 'user_' || owner
+            FROM generate_series(1, :notes) n
+            JOIN notes ON notes.video_id = 'v' || n,
+            LATERAL (SELECT CASE WHEN n <= :files THEN 0
+                                 ELSE (n - :files - 1) / :background_files + 1 END) o(owner)
+            """
+        ),
+        {
+            "notes": files + background_users * background_files,
+            "files": files,
+            "background_files": background_files,
+        },
+    )
+    conn.execute(text("ANALYZE"))
+
+
+def timed(engine, sql, params, repeat):
+    timings = []
+    with engine.connect() as conn:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rows = conn.execute(text(sql), params).all()
+            timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), len(rows)
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--files", type=int, default=5000, help="files of the searching user"
+    )
+    parser.add_argument("--words", type=int, default=500, help="words per note")
+    parser.add_argument("--background-users", type=int, default=5000)
+    parser.add_argument(
+        "--background-files", type=int, default=4, help="files per background user"
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine(
+        os.environ["DATABASE_URI"],
+        connect_args={"options": f"-csearch_path={SCHEMA}"},
+    )
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    try:
+        with engine.begin() as conn:
+            Base.metadata.create_all(conn)
+            started = time.perf_counter()
+            seed(
+                conn,
+                args.files,
+                args.words,
+                args.background_users,
+                args.background_files,
+            )
+            print(f"seeded in {time.perf_counter() - started:.1f}s")
+
+        print(
+            f"\n{'query':28} {'ILIKE ms':>9} {'rows':>5} {'full-text ms':>13} {'rows':>5}"
+        )
+        for words in (RARE_WORD, "gradient", "learning rate", FILLER_WORD):
+            like_ms, like_rows = timed(
+                engine,
+                LIKE_SEARCH,
+                {"user_id": "user_0", "pattern": f"%{words.split()[0]}%"},
+                args.repeat,
+            )
+            search_ms, search_rows = timed(
+                engine, FULL_TEXT_SEARCH, {"user_id": "user_0", "q": words}, args.repeat
+            )
+            print(
+                f"{words:28} {like_ms:9.1f} {like_rows:5} {search_ms:13.1f} {search_rows:5}"
+            )
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+
+if __name__ == "__main__":
+    main()
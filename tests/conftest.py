@@ -0,0 +1,9 @@
+import os
+
+# The app modules read their settings at import; no test connects with these
+os.environ.setdefault("DATABASE_URI", "postgresql://postgres@localhost/ytnote")
+os.environ.setdefault("AUTH_SECRET", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")
+os.environ.setdefault("PINECONE_API_KEY", "test")
+os.environ.setdefault("REDIS_URL", "")
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from app.utils import autosave
+from app.utils.autosave import AutosaveBuffer
+
+CONTENT = {"ops": [{"insert": "hello\n"}]}
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_failed_flush_is_retried_then_dropped(monkeypatch):
+    attempts = []
+
+    async def write_content(file_id, user_id, content):
+        attempts.append(asyncio.get_running_loop().time())
+        raise OSError("Statement timeout")
+
+    monkeypatch.setattr(autosave, "_write_content", write_content)
+    buffer = AutosaveBuffer(quiet_seconds=0.01, max_attempts=3)
+    buffer.put("f1", "u1", CONTENT)
+    for _ in range(100):
+        await asyncio.sleep(0.01)
+        if buffer.get("f1", "u1") is None:
+            break
+
+    assert len(attempts) == 3
+    # Backoff: the second wait is twice the first
+    assert attempts[2] - attempts[1] > attempts[1] - attempts[0]
+    assert buffer.get("f1", "u1") is None
+    assert not buffer._pending and not buffer._locks
+
+
+@pytest.mark.anyio
+async def test_flush_all_waits_for_running_flushes(monkeypatch):
+    started = asyncio.Event()
+    written = []
+
+    async def write_content(file_id, user_id, content):
+        started.set()
+        await asyncio.sleep(0.05)
+        written.append(file_id)
+
+    monkeypatch.setattr(autosave, "_write_content", write_content)
+    buffer = AutosaveBuffer(quiet_seconds=0)
+    buffer.put("f1", "u1", CONTENT)
+    await started.wait()
+    assert not buffer._pending
+
+    await buffer.flush_all()
+    assert written == ["f1"]
@@ -0,0 +1,209 @@
+import asyncio
+import os
+from uuid import uuid4
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.api.bulk import bulk_router
+from app.core.security import get_subscribed_user
+from app.database.db import get_db, to_async_url
+from app.models.models import File, Folder, User
+from app.utils.folder_tree import add_folder
+
+# A migrated database, DATABASE_URI; connections are not pooled so the setup and the
+# app (each on its own event loop) never share one
+engine = create_async_engine(
+    to_async_url(os.environ["DATABASE_URI"]), poolclass=NullPool
+)
+Session = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+
+async def _create_library(user_id):
+    """root/{a, b, doomed/{inner/}} folders and files a.txt, b.txt in root"""
+    async with Session() as db:
+        db.add(User(id=user_id, email=f"{user_id}@example.com", google_id=user_id))
+        await db.flush()
+        folders = {}
+        for name, parent in (
+            ("root", None),
+            ("a", "root"),
+            ("doomed", "root"),
+            ("inner", "doomed"),
+        ):
+            folder = Folder(
+                id=uuid4(), name=name, user_id=user_id, parent_id=folders.get(parent)
+            )
+            db.add(folder)
+            await db.flush()
+            await add_folder(db, folder.id, folders.get(parent))
+            folders[name] = folder.id
+        files = {}
+        for name in ("a.txt", "b.txt"):
+            file = File(
+                id=uuid4(),
+                name=name,
+                user_id=user_id,
+                folder_id=folders["root"],
+                video_id="vid00000001",
+            )
+            db.add(file)
+            files[name] = file.id
+        await db.commit()
+    return folders, files
+
+
+async def _library(user_id):
+    """{name: parent id} of the folders and files of a user"""
+    async with Session() as db:
+        folders = await db.execute(
+            select(Folder.name, Folder.parent_id).where(Folder.user_id == user_id)
+        )
+        files = await db.execute(
+            select(File.name, File.folder_id).where(File.user_id == user_id)
+        )
+        return dict(folders.all()), dict(files.all())
+
+
+async def _file_name(file_id):
+    async with Session() as db:
+        return await db.scalar(select(File.name).where(File.id == file_id))
+
+
+async def _delete_user(user_id):
+    async with Session() as db:
+        user = await db.get(User, user_id)
+        if user is not None:
+            # Folders and files go with it
+            await db.delete(user)
+            await db.commit()
+
+
+@pytest.fixture
+def user_id():
+    user_id = f"bulk-test-{uuid4().hex}"
+    yield user_id
+    try:
+        asyncio.run(_delete_user(user_id))
+    except (OSError, DBAPIError):
+        pass
+
+
+@pytest.fixture
+def library(user_id):
+    try:
+        return asyncio.run(_create_library(user_id))
+    except (OSError, DBAPIError) as e:
+        pytest.skip(f"Database unavailable: {e}")
+
+
+@pytest.fixture
+def client(user_id):
+    async def session():
+        async with Session() as db:
+            yield db
+
+    app = FastAPI()
+    app.include_router(bulk_router)
+    app.dependency_overrides[get_db] = session
+    app.dependency_overrides[get_subscribed_user] = lambda: User(id=user_id)
+    return TestClient(app)
+
+
+def bulk(client, *operations):
+    response = client.post("/bulk", json={"operations": list(operations)})
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_nothing_moves_or_is_renamed_into_a_deleted_folder(user_id, library, client):
+    folders, files = library
+    result = bulk(
+        client,
+        {
+            "op": "move",
+            "kind": "file",
+            "id": str(files["a.txt"]),
+            "new_parent_id": str(folders["inner"]),
+        },
+        {
+            "op": "move",
+            "kind": "folder",
+            "id": str(folders["a"]),
+            "new_parent_id": str(folders["doomed"]),
+        },
+        {
+            "op": "rename",
+            "kind": "folder",
+            "id": str(folders["inner"]),
+            "new_name": "renamed",
+        },
+        {"op": "delete", "kind": "folder", "id": str(folders["doomed"])},
+    )
+    assert [r["status"] for r in result["results"]] == ["error", "error", "error", "ok"]
+    assert result["results"][0]["detail"] == (
+        "Destination folder is deleted by this request"
+    )
+    assert result["applied"] == 1
+
+    folder_parents, file_parents = asyncio.run(_library(user_id))
+    assert set(folder_parents) == {"root", "a"}
+    assert folder_parents["a"] == folders["root"]
+    assert file_parents == {"a.txt": folders["root"], "b.txt": folders["root"]}
+
+
+def test_items_moved_out_of_a_deleted_folder_survive(user_id, library, client):
+    folders, _ = library
+    result = bulk(
+        client,
+        {
+            "op": "move",
+            "kind": "folder",
+            "id": str(folders["inner"]),
+            "new_parent_id": str(folders["a"]),
+        },
+        {"op": "delete", "kind": "folder", "id": str(folders["doomed"])},
+    )
+    assert [r["status"] for r in result["results"]] == ["ok", "ok"]
+    folder_parents, _ = asyncio.run(_library(user_id))
+    assert folder_parents["inner"] == folders["a"]
+    assert "doomed" not in folder_parents
+
+
+@pytest.mark.parametrize("delete_first", [True, False])
+def test_rename_reuses_the_name_of_a_deleted_item(
+    user_id, library, client, delete_first
+):
+    _, files = library
+    delete = {"op": "delete", "kind": "file", "id": str(files["a.txt"])}
+    rename = {
+        "op": "rename",
+        "kind": "file",
+        "id": str(files["b.txt"]),
+        "new_name": "a.txt",
+    }
+    operations = [delete, rename] if delete_first else [rename, delete]
+    result = bulk(client, *operations)
+    assert [r["status"] for r in result["results"]] == ["ok", "ok"]
+    _, file_parents = asyncio.run(_library(user_id))
+    assert list(file_parents) == ["a.txt"]
+    assert asyncio.run(_file_name(files["b.txt"])) == "a.txt"
+
+
+def test_rename_still_conflicts_with_a_kept_item(user_id, library, client):
+    _, files = library
+    result = bulk(
+        client,
+        {
+            "op": "rename",
+            "kind": "file",
+            "id": str(files["b.txt"]),
+            "new_name": "a.txt",
+        },
+    )
+    assert result["results"][0]["status"] == "error"
@@ -0,0 +1,178 @@
+import orjson
+import pytest
+
+from app.utils.delta import compose, normalize, transform
+
+DOC = {"ops": [{"insert": "hi 😀\n"}]}
+
+
+def delta(*ops):
+    return {"ops": list(ops)}
+
+
+# Cases of the quill-delta test suite (test/delta/compose.js)
+@pytest.mark.parametrize(
+    "a, b, expected",
+    [
+        (delta({"insert": "A"}), delta({"insert": "B"}), delta({"insert": "BA"})),
+        (
+            delta({"insert": "A"}),
+            delta({"retain": 1, "attributes": {"bold": True, "color": "red"}}),
+            delta({"insert": "A", "attributes": {"bold": True, "color": "red"}}),
+        ),
+        (delta({"insert": "A"}), delta({"delete": 1}), delta()),
+        (
+            delta({"delete": 1}),
+            delta({"insert": "B"}),
+            delta({"insert": "B"}, {"delete": 1}),
+        ),
+        (
+            delta({"retain": 1, "attributes": {"color": "blue"}}),
+            delta({"insert": "B"}),
+            delta({"insert": "B"}, {"retain": 1, "attributes": {"color": "blue"}}),
+        ),
+        (
+            delta({"insert": "Hello"}),
+            delta({"retain": 3}, {"insert": "X"}),
+            delta({"insert": "HelXlo"}),
+        ),
+        (
+            delta({"insert": "Hello"}),
+            delta({"retain": 3}, {"insert": "X"}, {"delete": 1}),
+            delta({"insert": "HelXo"}),
+        ),
+        (
+            delta({"insert": "Hello"}),
+            delta({"retain": 3}, {"delete": 1}, {"insert": "X"}),
+            delta({"insert": "HelXo"}),
+        ),
+        (
+            delta({"insert": "A", "attributes": {"bold": True}}),
+            delta({"retain": 1, "attributes": {"bold": None}}),
+            delta({"insert": "A"}),
+        ),
+    ],
+)
+def test_compose_reference(a, b, expected):
+    assert compose(a, b) == expected
+
+
+# Cases of the quill-delta test suite (test/delta/transform.js)
+@pytest.mark.parametrize(
+    "a, b, priority, expected",
+    [
+        (
+            delta({"insert": "A"}),
+            delta({"insert": "B"}),
+            True,
+            delta({"retain": 1}, {"insert": "B"}),
+        ),
+        (delta({"insert": "A"}), delta({"insert": "B"}), False, delta({"insert": "B"})),
+        (
+            delta({"insert": "A"}),
+            delta({"retain": 1, "attributes": {"bold": True, "color": "red"}}),
+            True,
+            delta(
+                {"retain": 1},
+                {"retain": 1, "attributes": {"bold": True, "color": "red"}},
+            ),
+        ),
+        (delta({"delete": 1}), delta({"delete": 1}), True, delta()),
+        (
+            delta({"retain": 2}, {"insert": "si"}, {"delete": 5}),
+            delta({"retain": 1}, {"insert": "e"}, {"delete": 5}, {"insert": "ow"}),
+            False,
+            delta(
+                {"retain": 1},
+                {"insert": "e"},
+                {"delete": 1},
+                {"retain": 2},
+                {"insert": "ow"},
+            ),
+        ),
+        (
+            delta({"retain": 1}, {"insert": "e"}, {"delete": 5}, {"insert": "ow"}),
+            delta({"retain": 2}, {"insert": "si"}, {"delete": 5}),
+            False,
+            delta({"retain": 2}, {"insert": "si"}, {"retain": 2}, {"delete": 1}),
+        ),
+        (
+            delta({"retain": 3}, {"insert": "aa"}),
+            delta({"retain": 3}, {"insert": "bb"}),
+            True,
+            delta({"retain": 5}, {"insert": "bb"}),
+        ),
+        (
+            delta({"retain": 3}, {"insert": "bb"}),
+            delta({"retain": 3}, {"insert": "aa"}),
+            False,
+            delta({"retain": 3}, {"insert": "aa"}),
+        ),
+    ],
+)
+def test_transform_reference(a, b, priority, expected):
+    assert transform(a, b, priority) == expected
+    # Both orders of applying the edits give the same document
+    doc = delta({"insert": "abcdefg"})
+    assert compose(compose(doc, a), expected) == compose(
+        compose(doc, b), transform(b, a, not priority)
+    )
+
+
+@pytest.mark.parametrize(
+    "change, expected",
+    [
+        (delta({"retain": 3}, {"delete": 2}), delta({"insert": "hi \n"})),
+        (delta({"retain": 5}, {"insert": "!"}), delta({"insert": "hi 😀!\n"})),
+        (
+            delta({"retain": 3}, {"retain": 2, "attributes": {"bold": True}}),
+            delta(
+                {"insert": "hi "},
+                {"insert": "😀", "attributes": {"bold": True}},
+                {"insert": "\n"},
+            ),
+        ),
+        (delta({"retain": 6}), DOC),
+    ],
+)
+def test_compose_astral_characters(change, expected):
+    # The emoji is two UTF-16 units, as Quill counts it
+    assert compose(DOC, change) == expected
+    orjson.dumps(normalize(compose(DOC, change)))
+
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        delta({"retain": 4}, {"retain": 1}),
+        delta({"retain": 4}, {"insert": "x"}),
+        delta({"retain": 4}, {"delete": 1}),
+        delta({"retain": 3}, {"delete": 1}),
+        delta({"retain": 4}, {"retain": 2, "attributes": {"bold": True}}),
+    ],
+)
+def test_compose_rejects_split_characters(change):
+    with pytest.raises(ValueError):
+        compose(DOC, change)
+
+
+def test_transform_astral_characters_converge():
+    a = delta({"retain": 3}, {"insert": "🎉"})
+    b = delta({"retain": 5}, {"insert": "😎"})
+    assert transform(a, b, True) == delta({"retain": 7}, {"insert": "😎"})
+    assert compose(compose(DOC, a), transform(a, b, True)) == compose(
+        compose(DOC, b), transform(b, a, False)
+    )
+    assert compose(compose(DOC, a), transform(a, b, True)) == delta(
+        {"insert": "hi 🎉😀😎\n"}
+    )
+
+
+def test_normalize_joins_halves_of_a_character():
+    halves = delta({"insert": "\ud83d"}, {"insert": "\ude00"})
+    assert normalize(halves) == delta({"insert": "😀"})
+
+
+def test_normalize_rejects_half_characters():
+    with pytest.raises(ValueError):
+        normalize(delta({"insert": "a\ud83d"}, {"insert": "b"}))
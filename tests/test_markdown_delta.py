@@ -0,0 +1,51 @@
+from hypothesis import given, settings
+from hypothesis import strategies as st
+
+from app.utils.markdown_delta import MarkdownDeltaStream, markdown_to_quill_delta
+
+words = st.text(alphabet="abc xyz*`_[]()#>-", min_size=0, max_size=20)
+lines = st.one_of(
+    words,
+    words.map(lambda text: f"# {text}"),
+    words.map(lambda text: f"### {text}"),
+    words.map(lambda text: f"- **{text}**"),
+    words.map(lambda text: f"  * *{text}*"),
+    words.map(lambda text: f"1. `{text}`"),
+    words.map(lambda text: f"> {text}"),
+    words.map(lambda text: f"[{text}](https://example.com)"),
+    st.sampled_from(["", "   ", "---", "***", "```", "```py", "```js ", "```unknown"]),
+)
+markdown = st.lists(lines, max_size=30).map("\n".join)
+
+
+def stream(text, split_points):
+    converter = MarkdownDeltaStream()
+    bounds = [0, *sorted(split_points), len(text)]
+    ops = []
+    for start, end in zip(bounds, bounds[1:]):
+        ops += converter.feed(text[start:end])
+    return ops + converter.close()
+
+
+@settings(max_examples=300)
+@given(st.data())
+def test_streamed_ops_equal_batch_ops(data):
+    text = data.draw(markdown)
+    split_points = data.draw(
+        st.lists(st.integers(min_value=0, max_value=len(text)), max_size=20)
+    )
+    assert stream(text, split_points) == markdown_to_quill_delta(text)["ops"]
+
+
+@given(markdown)
+def test_one_character_at_a_time(text):
+    assert stream(text, range(len(text))) == markdown_to_quill_delta(text)["ops"]
+
+
+def test_code_block_held_until_closing_fence():
+    converter = MarkdownDeltaStream()
+    # "intro" is the last op so far, held back as the next line may merge into it
+    assert converter.feed("intro\n```py\nx = 1\n") == []
+    ops = converter.feed("```\nafter") + converter.close()
+    assert {"insert": "\n", "attributes": {"code-block": "python"}} in ops
+    assert ops[-1] == {"insert": "after\n"}
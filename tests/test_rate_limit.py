@@ -0,0 +1,135 @@
+import time
+
+import fakeredis
+import pytest
+from starlette.requests import Request
+
+from app.middlewares.middleware import (
+    TOKEN_BUCKET_SCRIPT,
+    LocalTokenBuckets,
+    RateLimit,
+    RateLimiter,
+    client_ip,
+)
+
+LIMIT = RateLimit(capacity=3, refill_per_second=1)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.aioredis.FakeRedis()
+
+
+@pytest.fixture
+def limiter(redis):
+    return RateLimiter(_redis=redis, _script=redis.register_script(TOKEN_BUCKET_SCRIPT))
+
+
+@pytest.mark.anyio
+async def test_allows_up_to_capacity_then_denies(limiter):
+    for _ in range(LIMIT.capacity):
+        assert await limiter.take("user:1", LIMIT, 1) == (True, 0)
+    allowed, retry_after = await limiter.take("user:1", LIMIT, 1)
+    assert not allowed
+    assert 0 < retry_after <= 1 / LIMIT.refill_per_second
+
+
+@pytest.mark.anyio
+async def test_retry_after_covers_the_cost(limiter):
+    assert (await limiter.take("user:1", LIMIT, 2))[0]
+    allowed, retry_after = await limiter.take("user:1", LIMIT, 3)
+    assert not allowed
+    # 1 token left, 2 more refill in 2 seconds
+    assert 1.9 <= retry_after <= 2
+
+
+@pytest.mark.anyio
+async def test_buckets_are_per_key(limiter):
+    for _ in range(LIMIT.capacity):
+        await limiter.take("user:1", LIMIT, 1)
+    assert not (await limiter.take("user:1", LIMIT, 1))[0]
+    assert (await limiter.take("user:2", LIMIT, 1))[0]
+
+
+@pytest.mark.anyio
+async def test_bucket_refills_over_time(limiter, redis):
+    for _ in range(LIMIT.capacity):
+        await limiter.take("user:1", LIMIT, 1)
+    assert not (await limiter.take("user:1", LIMIT, 1))[0]
+    # Move the last refill two seconds back: two tokens are due
+    ts = int(await redis.hget("ratelimit:user:1", "ts"))
+    await redis.hset("ratelimit:user:1", "ts", str(ts - 2000))
+    assert (await limiter.take("user:1", LIMIT, 1))[0]
+    assert (await limiter.take("user:1", LIMIT, 1))[0]
+    assert not (await limiter.take("user:1", LIMIT, 1))[0]
+
+
+@pytest.mark.anyio
+async def test_bucket_expires_once_full_again(limiter, redis):
+    await limiter.take("user:1", LIMIT, 1)
+    ttl = await redis.pttl("ratelimit:user:1")
+    assert 0 < ttl <= LIMIT.capacity * 1000 / LIMIT.refill_per_second
+
+
+@pytest.mark.anyio
+async def test_falls_back_to_local_buckets_when_redis_fails():
+    calls = []
+
+    async def broken_script(keys, args):
+        calls.append(keys)
+        raise ConnectionError("Redis is down")
+
+    limiter = RateLimiter(_script=broken_script)
+    for _ in range(LIMIT.capacity):
+        assert (await limiter.take("user:1", LIMIT, 1))[0]
+    allowed, retry_after = await limiter.take("user:1", LIMIT, 1)
+    assert not allowed and retry_after > 0
+    # Redis is skipped until the retry delay has passed
+    assert len(calls) == 1
+    assert limiter._redis_down_until > time.monotonic()
+
+
+def test_local_buckets_refill():
+    buckets = LocalTokenBuckets()
+    for _ in range(LIMIT.capacity):
+        assert buckets.take("user:1", LIMIT, 1)[0]
+    assert not buckets.take("user:1", LIMIT, 1)[0]
+    tokens, ts = buckets._buckets["user:1"]
+    buckets._buckets["user:1"] = (tokens, ts - 2)
+    assert buckets.take("user:1", LIMIT, 1)[0]
+    assert buckets.take("user:1", LIMIT, 1)[0]
+    assert not buckets.take("user:1", LIMIT, 1)[0]
+
+
+def test_local_buckets_evict_least_recently_used():
+    buckets = LocalTokenBuckets(max_keys=2)
+    buckets.take("a", LIMIT, 1)
+    buckets.take("b", LIMIT, 1)
+    buckets.take("a", LIMIT, 1)
+    buckets.take("c", LIMIT, 1)
+    assert list(buckets._buckets) == ["a", "c"]
+    # An evicted client starts again from a full bucket
+    assert buckets.take("b", LIMIT, LIMIT.capacity)[0]
+
+
+def request_from(peer, *forwarded_for):
+    headers = [(b"x-forwarded-for", value.encode()) for value in forwarded_for]
+    return Request({"type": "http", "client": (peer, 4321), "headers": headers})
+
+
+def test_client_ip_ignores_forwarded_for_from_untrusted_peers():
+    assert client_ip(request_from("203.0.113.9", "198.51.100.1")) == "203.0.113.9"
+
+
+def test_client_ip_behind_trusted_proxy():
+    # The first address was sent by the client, only the proxy's own hop is trusted
+    request = request_from("127.0.0.1", "10.6.6.6, 198.51.100.1")
+    assert client_ip(request) == "198.51.100.1"
+    request = request_from("127.0.0.1", "10.6.6.6", "198.51.100.1, 127.0.0.1")
+    assert client_ip(request) == "198.51.100.1"
+    assert client_ip(request_from("127.0.0.1")) == "127.0.0.1"
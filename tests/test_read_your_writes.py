@@ -0,0 +1,108 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.api.folder import get_tree_read_db
+from app.database import db
+from app.utils import autosave
+from app.utils.autosave import AutosaveBuffer
+from app.utils.tree_cache import bump_tree_version
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def replica(monkeypatch):
+    """Stand-in replica: read sessions without a bind"""
+
+    async def replica_session():
+        return AsyncSession()
+
+    monkeypatch.setattr(db, "_read_session", replica_session)
+    monkeypatch.setattr(db, "_written_until", {})
+
+
+async def note_session_bind(note_id):
+    """Engine of the session GET /note/{note_id} reads with, None for the replica"""
+    dependency = db.get_note_read_db(note_id)
+    session = await dependency.__anext__()
+    await dependency.aclose()
+    return session.sync_session.bind
+
+
+async def tree_session_bind(user_id):
+    """Engine of the session the folder tree of a user is read with"""
+    dependency = get_tree_read_db(SimpleNamespace(id=user_id))
+    session = await dependency.__anext__()
+    await dependency.aclose()
+    return session.sync_session.bind
+
+
+@pytest.mark.anyio
+async def test_note_read_from_replica_unless_written():
+    assert (await note_session_bind("f1")) is None
+    db.mark_written("file:f1")
+    assert (await note_session_bind("f1")) is db.engine.sync_engine
+    assert (await note_session_bind("f2")) is None
+
+
+def test_written_mark_expires(monkeypatch):
+    monkeypatch.setattr(db, "DB_REPLICA_LAG_SECONDS", 0)
+    db.mark_written("file:f1")
+    assert not db.recently_written("file:f1")
+    assert "file:f1" not in db._written_until
+
+
+@pytest.mark.anyio
+async def test_flushed_autosave_is_read_from_primary(monkeypatch):
+    written = []
+
+    async def write_content(file_id, user_id, content):
+        # Still served from the buffer while the write is in flight
+        assert buffer.get(file_id, user_id) == content
+        written.append(file_id)
+
+    monkeypatch.setattr(autosave, "_write_content", write_content)
+    buffer = AutosaveBuffer()
+    buffer.put("f1", "u1", {"ops": [{"insert": "hello\n"}]})
+    await buffer.flush("f1")
+
+    assert written == ["f1"]
+    assert buffer.get("f1", "u1") is None
+    assert (await note_session_bind("f1")) is db.engine.sync_engine
+
+
+@pytest.mark.anyio
+async def test_failed_flush_keeps_the_content_buffered(monkeypatch):
+    async def write_content(file_id, user_id, content):
+        raise OSError("Database unavailable")
+
+    monkeypatch.setattr(autosave, "_write_content", write_content)
+    buffer = AutosaveBuffer(quiet_seconds=60)
+    buffer.put("f1", "u1", {"ops": [{"insert": "hello\n"}]})
+    await buffer.flush("f1")
+
+    assert buffer.get("f1", "u1") == {"ops": [{"insert": "hello\n"}]}
+    assert not db.recently_written("file:f1")
+    buffer.discard("f1")
+
+
+@pytest.mark.anyio
+async def test_tree_read_from_primary_after_a_change():
+    statements = []
+
+    class Session:
+        async def execute(self, statement):
+            statements.append(statement)
+
+    assert (await tree_session_bind("u1")) is None
+    await bump_tree_version(Session(), "u1")
+
+    assert len(statements) == 1
+    assert (await tree_session_bind("u1")) is db.engine.sync_engine
+    assert (await tree_session_bind("u2")) is None